@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+HTML修正スクリプトのベンチマーク
+
+update_html.py と public/patch_engine.py（apply_complete_fix.py /
+apply_fix_compatible.py、両ターゲットを1回で出力する apply_fix_multi_target）を、
+合成した大きな index.html で計測します。
+修正ごとの処理時間、スループット（MB/s）、ピークメモリを表示し、
+ベースラインと比較して性能劣化を検出します。
+
+使用方法:
+    python3 benchmark_patchers.py                          # 0.1〜50MB で計測
+    python3 benchmark_patchers.py --sizes 0.1,1,5          # サイズ指定（MB）
+    python3 benchmark_patchers.py --slides 200 --courses 5 --near-miss 50
+    python3 benchmark_patchers.py --save-baseline          # ベースラインを保存
+    python3 benchmark_patchers.py --compare                # ベースラインと比較
+
+出力:
+    benchmark_baseline.json - --save-baseline 指定時
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public'))
+
+import patch_engine  # noqa: E402
+import update_html  # noqa: E402
+
+DEFAULT_SIZES = [0.1, 1, 5, 10, 50]
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# 合成 index.html の骨格（修正対象の6関数・Database・起動処理を含む）
+SKELETON_HEAD = '''<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <title>インサイダー取引規制 eラーニング</title>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/jszip/3.10.1/jszip.min.js"></script>
+</head>
+<body>
+    <div id="app"></div>
+    <script>
+        const AppData = {
+            users: [],
+            courses: SEED_COURSES_PLACEHOLDER,
+            learningRecords: [],
+            currentUser: null,
+            currentCourse: null,
+            savedProgress: null,
+            learningState: { screen: 'start', slideIndex: 0, questionIndex: 0, answers: {}, showExplanations: {} }
+        };
+
+        const slideImages = SLIDE_IMAGES_PLACEHOLDER;
+
+        // データベース管理(localStorage使用)
+        const Database = {
+            save() {
+                localStorage.setItem('elearning', JSON.stringify(AppData));
+            },
+            load() {
+                const saved = localStorage.getItem('elearning');
+                if (saved) {
+                    Object.assign(AppData, JSON.parse(saved));
+                }
+            },
+            loadProgress(userId) {
+                return null;
+            },
+            saveProgress(userId) {
+            },
+            clearProgress(userId) {
+            }
+        };
+
+        const App = {
+            currentView: 'login',
+
+            init() {
+                Database.load();
+                this.render();
+            },
+
+            render() {
+                document.getElementById('app').innerHTML = `<div class="view">${this.currentView}</div>`;
+            },
+
+            renderTrainingScreen(state, totalSlides) {
+                const courseImages = AppData.currentCourse && AppData.currentCourse.slideImages
+                    ? AppData.currentCourse.slideImages
+                    : [];
+
+                let imageToShow = null;
+                if (courseImages.length > state.slideIndex) {
+                    imageToShow = courseImages[state.slideIndex].data;
+                } else if (slideImages.length > state.slideIndex) {
+                    imageToShow = slideImages[state.slideIndex];
+                }
+                return `<div class="slide">${imageToShow ? `<img src="${imageToShow}">` : '{画像なし}'}</div>`;
+            },
+
+            async login() {
+                const username = document.getElementById('username').value;
+                const password = document.getElementById('password').value;
+                const user = AppData.users.find(u => u.username === username && u.password === password);
+
+                if (user) {
+                    AppData.currentUser = user;
+                    const progress = await Database.loadProgress(user.id);
+                    if (progress) {
+                        AppData.savedProgress = progress;
+                    }
+
+                    if (AppData.courses.length > 0) {
+                        AppData.currentCourse = AppData.courses[0];
+                    }
+
+                    if (user.role === 'admin') {
+                        this.currentView = 'admin';
+                    } else {
+                        this.currentView = 'learning';
+                    }
+                    this.render();
+                } else {
+                    alert('ログインに失敗しました');
+                }
+            },
+
+            async switchToLearning() {
+                if (AppData.courses.length > 0 && !AppData.currentCourse) {
+                    AppData.currentCourse = AppData.courses[0];
+                }
+                this.currentView = 'learning';
+                this.render();
+            },
+
+            resumeLearning() {
+                if (AppData.savedProgress) {
+                    AppData.learningState = { ...AppData.savedProgress };
+                    if (AppData.savedProgress.courseId) {
+                        const course = AppData.courses.find(c => c.id === AppData.savedProgress.courseId);
+                        if (course) {
+                            AppData.currentCourse = course;
+                        }
+                    }
+                    AppData.savedProgress = null;
+                    this.render();
+                }
+            },
+
+            async startFromBeginning() {
+                if (confirm('前回の進行状況を削除して、最初から開始しますか?')) {
+                    AppData.savedProgress = null;
+                    if (!AppData.currentCourse && AppData.courses.length > 0) {
+                        AppData.currentCourse = AppData.courses[0];
+                    }
+                    this.render();
+                }
+            },
+
+            async startTraining() {
+                const userName = document.getElementById('userName').value;
+                if (!userName) {
+                    return;
+                }
+                if (!AppData.currentCourse && AppData.courses.length > 0) {
+                    AppData.currentCourse = AppData.courses[0];
+                }
+                AppData.learningState.screen = 'training';
+                this.render();
+            },
+
+            startLearning(courseId) {
+                const course = AppData.courses.find(c => c.id === courseId);
+                if (course) {
+                    AppData.currentCourse = course;
+                }
+                this.render();
+            },
+
+            renderLearners() {
+                const learners = AppData.users.filter(u => u.role === 'user');
+                return learners.map(learner => {
+                    const records = AppData.learningRecords.filter(r => r.userId === learner.id);
+                    return `<tr><td>${learner.name}</td><td>${records.length}</td></tr>`;
+                }).join('');
+            },
+
+            addLearner(username, email) {
+                if (AppData.users.find(u => u.username === username)) {
+                    return false;
+                }
+                if (AppData.users.find(u => u.email === email)) {
+                    return false;
+                }
+                AppData.users.push({ id: Date.now(), username: username, email: email, role: 'user' });
+                Database.save();
+                return true;
+            },
+
+            viewLearnerDetail(userId) {
+                const learner = AppData.users.find(u => u.id === userId);
+                const records = AppData.learningRecords.filter(r => r.userId === userId);
+                return { learner, records };
+            },
+
+            viewCertificate(userId) {
+                const learner = AppData.users.find(u => u.id === userId);
+                const records = AppData.learningRecords.filter(r => r.userId === userId && r.passed);
+                return { learner, records };
+            },
+'''
+
+SKELETON_TAIL = '''
+            noop() {
+            }
+        };
+
+        // アプリ起動
+        document.addEventListener('DOMContentLoaded', () => {
+            App.init();
+        });
+    </script>
+</body>
+</html>
+'''
+
+# 正規表現が途中まで一致して失敗する「ニアミス」アンカー
+NEAR_MISSES = [
+    "            // renderTrainingScreen(state) は旧シグネチャ {0}\n",
+    "            // データベース管理メモ {0}: const Database の定義は下記\n",
+    "            helperLogin{0}() {{ return 'async login() は App 側 {{'; }},\n",
+    "            // const courseImages = 旧実装 {0}\n",
+    "            note{0}() {{ return `if (AppData.courses.length > 0) {{ ${{'{0}'}}`; }},\n",
+]
+
+
+def _data_uri(rng, size):
+    raw = rng.randbytes(max(1, size * 3 // 4))
+    return 'data:image/png;base64,' + base64.b64encode(raw).decode('ascii')
+
+
+def generate_html(target_bytes, slides=20, courses=3, near_misses=10, seed=0):
+    """target_bytes 前後の合成 index.html を生成する"""
+    rng = random.Random(seed)
+    fixed = len(SKELETON_HEAD) + len(SKELETON_TAIL)
+    misses = ''.join(NEAR_MISSES[i % len(NEAR_MISSES)].format(i) for i in range(near_misses))
+
+    # 残りのサイズをスライド画像に割り当てる（コース画像 + デモ画像）
+    image_count = max(1, slides * (courses + 1))
+    per_image = max(64, (target_bytes - fixed - len(misses)) // image_count - 64)
+
+    course_list = []
+    for c in range(courses):
+        images = ', '.join(
+            f'{{"slideNumber": {n + 1}, "data": "{_data_uri(rng, per_image)}"}}' for n in range(slides))
+        course_list.append(f'{{"id": {c + 1}, "title": "研修コース{c + 1}", "slideImages": [{images}]}}')
+    demo = ', '.join(f'"{_data_uri(rng, per_image)}"' for _ in range(slides))
+
+    html = (SKELETON_HEAD
+            .replace('SEED_COURSES_PLACEHOLDER', '[' + ', '.join(course_list) + ']')
+            .replace('SLIDE_IMAGES_PLACEHOLDER', '[' + demo + ']')
+            + misses + SKELETON_TAIL)
+    return html
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def _peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_engine(html, targets):
+    """patch_engine: 索引作成と修正ごとの特定（1回）+ ターゲットごとの変換・連結"""
+    timings = {}
+    index, timings['索引作成'] = _timed(patch_engine.build_index, html)
+    located = []
+    for key, label, locate in patch_engine.FIXES:
+        found, timings[key] = _timed(locate, index, patch_engine.TEMPLATES.get(key))
+        if found is patch_engine.NOT_APPLICABLE:
+            located.append(patch_engine.LocatedFix(key, label, applicable=False))
+        else:
+            located.append(patch_engine.LocatedFix(key, label, found))
+    for target in targets:
+        _, timings[f'生成 ({target})'] = _timed(patch_engine.emit_target, html, located, target)
+    return timings, sum(1 for fix in located if fix.found or not fix.applicable)
+
+
+def bench_update_html(html):
+    """update_html.py: 各ステップ"""
+    timings = {}
+    content = html
+    for label, step in update_html.STEPS:
+        content, timings[label] = _timed(step, content)
+    return timings, None
+
+
+TARGETS = {
+    'apply_complete_fix': lambda html: bench_engine(html, ['modern']),
+    'apply_fix_compatible': lambda html: bench_engine(html, ['compatible']),
+    'apply_fix_multi_target': lambda html: bench_engine(html, ['modern', 'compatible']),
+    'update_html': bench_update_html,
+}
+
+
+def run(sizes, slides, courses, near_misses, repeat):
+    results = []
+    for size_mb in sizes:
+        html = generate_html(int(size_mb * 1024 * 1024), slides, courses, near_misses)
+        mb = len(html.encode('utf-8')) / (1024 * 1024)
+        print(f"\n📄 合成ファイル {mb:.2f} MB（スライド {slides} × コース {courses}, ニアミス {near_misses}）")
+        for name, target in TARGETS.items():
+            best = None
+            for _ in range(repeat):
+                timings, matched = target(html)
+                if best is None or sum(timings.values()) < sum(best.values()):
+                    best = timings
+            total = sum(best.values())
+            peak = _peak_memory(target, html)
+            row = {
+                'target': name,
+                'size_mb': size_mb,
+                'actual_mb': round(mb, 3),
+                'seconds': round(total, 6),
+                'mb_per_s': round(mb / total, 2) if total else None,
+                'peak_mb': round(peak / (1024 * 1024), 2),
+                'matched': matched,
+                'steps': {k: round(v * 1000, 3) for k, v in best.items()},
+            }
+            results.append(row)
+            matched_text = '' if matched is None else f"  修正 {matched}/{len(patch_engine.FIXES)}"
+            print(f"  {name:<22} {total * 1000:>9.1f}ms  {row['mb_per_s'] or 0:>9.1f} MB/s  "
+                  f"ピーク {row['peak_mb']:>7.1f} MB{matched_text}")
+            slowest = sorted(best.items(), key=lambda kv: kv[1], reverse=True)[:3]
+            print('      ' + ', '.join(f"{k} {v * 1000:.1f}ms" for k, v in slowest))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ベースラインよりスループットが tolerance 以上落ちた項目を返す"""
+    base = {(r['target'], r['size_mb']): r for r in baseline['results']}
+    regressions = []
+    for row in results:
+        old = base.get((row['target'], row['size_mb']))
+        if not old or not old.get('mb_per_s') or not row.get('mb_per_s'):
+            continue
+        ratio = row['mb_per_s'] / old['mb_per_s']
+        if ratio < 1 - tolerance:
+            regressions.append((row, old, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTML修正スクリプトのベンチマーク')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='生成するファイルサイズ（MB, カンマ区切り）')
+    parser.add_argument('--slides', type=int, default=20, help='コースあたりのスライド画像数')
+    parser.add_argument('--courses', type=int, default=3, help='コース数')
+    parser.add_argument('--near-miss', type=int, default=10, help='ニアミスアンカーの数')
+    parser.add_argument('--repeat', type=int, default=3, help='計測回数（最速値を採用）')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='ベースラインファイル')
+    parser.add_argument('--save-baseline', action='store_true', help='結果をベースラインとして保存')
+    parser.add_argument('--compare', action='store_true', help='ベースラインと比較')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='許容するスループット低下率')
+    args = parser.parse_args()
+
+    sizes = [float(s) for s in args.sizes.split(',') if s]
+    results = run(sizes, args.slides, args.courses, args.near_miss, args.repeat)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': sys.version.split()[0],
+                       'params': {'slides': args.slides, 'courses': args.courses,
+                                  'near_miss': args.near_miss},
+                       'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 ベースラインを保存しました: {args.baseline}")
+
+    if args.compare:
+        try:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"❌ エラー: ベースラインが見つかりません: {args.baseline}")
+            sys.exit(1)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n⚠️ 性能劣化を検出しました:")
+            for row, old, ratio in regressions:
+                print(f"  {row['target']} {row['size_mb']}MB: "
+                      f"{old['mb_per_s']} → {row['mb_per_s']} MB/s ({ratio:.0%})")
+            sys.exit(1)
+        print("\n✅ ベースラインからの性能劣化はありません")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+// server.js のデータ保存方式のベンチマーク
+//
+// 既定の方式（保存のたびに database.json 全体を JSON.stringify(data, null, 2) で
+// 書き直す）と、DATA_STORAGE=journal（変更1件をジャーナルに追記）の保存時間を、
+// 学習記録数・埋め込み画像サイズを変えた合成データで比較します。
+// あわせてジャーナル方式の起動時の再生時間も計測します。
+//
+// 使用方法:
+//     node benchmark_storage.js
+//     node benchmark_storage.js --records 1000,10000,50000 --image-mb 5 --saves 50
+
+const fs = require('fs').promises;
+const os = require('os');
+const path = require('path');
+const { JournalStore } = require('./journal-store');
+
+function parseArgs(argv) {
+    const options = { records: [1000, 10000, 50000], imageMb: 2, saves: 30 };
+    for (let i = 0; i < argv.length; i++) {
+        const value = argv[i + 1];
+        if (argv[i] === '--records') {
+            options.records = value.split(',').filter(Boolean).map(Number);
+            i++;
+        } else if (argv[i] === '--image-mb') {
+            options.imageMb = Number(value);
+            i++;
+        } else if (argv[i] === '--saves') {
+            options.saves = Number(value);
+            i++;
+        } else {
+            console.error(`❌ エラー: 不明な引数 ${argv[i]}`);
+            process.exit(1);
+        }
+    }
+    return options;
+}
+
+// 合成データ（コース3件に合計 imageMb の画像を埋め込み、学習記録を records 件）
+function generateData(records, imageMb) {
+    const imageBytes = Math.floor(imageMb * 1024 * 1024 / 3 / 10);
+    const image = 'data:image/png;base64,' + Buffer.alloc(Math.floor(imageBytes * 3 / 4), 7).toString('base64');
+    const courses = [1, 2, 3].map(id => ({
+        id,
+        title: `コース${id}`,
+        slideImages: Array.from({ length: 10 }, (_, i) => ({ name: `slide${i + 1}.png`, data: image })),
+        quiz: Array.from({ length: 10 }, (_, i) => ({ question: `問題${i + 1}`, options: ['A', 'B', 'C', 'D'], correct: 0 }))
+    }));
+    const users = Array.from({ length: 200 }, (_, i) => ({
+        id: i + 1, username: `user${i + 1}`, password: 'pass', name: `ユーザー${i + 1}`, role: 'user', department: '部署'
+    }));
+    const learningRecords = Array.from({ length: records }, (_, i) => ({
+        id: i + 1,
+        userId: (i % 200) + 1,
+        courseId: (i % 3) + 1,
+        score: i % 11,
+        passed: i % 11 >= 7,
+        answers: Array.from({ length: 10 }, (_, j) => (i + j) % 4),
+        completedAt: new Date(1700000000000 + i * 60000).toISOString()
+    }));
+    return { users, courses, learningRecords, revision: 0, lastUpdated: new Date().toISOString() };
+}
+
+// 既定の方式（server.js の saveData と同じ処理）
+async function rewriteSave(file, data) {
+    data.lastUpdated = new Date().toISOString();
+    const tmpFile = `${file}.tmp`;
+    await fs.writeFile(tmpFile, JSON.stringify(data, null, 2));
+    await fs.rename(tmpFile, file);
+}
+
+function percentile(sorted, p) {
+    return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+}
+
+function summarize(label, timings) {
+    const sorted = [...timings].sort((a, b) => a - b);
+    const mean = sorted.reduce((sum, t) => sum + t, 0) / sorted.length;
+    console.log(`  ${label.padEnd(16)} 平均 ${mean.toFixed(2).padStart(9)}ms  ` +
+        `p50 ${percentile(sorted, 0.5).toFixed(2).padStart(9)}ms  p95 ${percentile(sorted, 0.95).toFixed(2).padStart(9)}ms`);
+    return mean;
+}
+
+async function bench(records, imageMb, saves) {
+    const dir = await fs.mkdtemp(path.join(os.tmpdir(), 'elearning-storage-'));
+    try {
+        const dataFile = path.join(dir, 'database.json');
+        const journalFile = path.join(dir, 'database.journal');
+        const data = generateData(records, imageMb);
+        await fs.writeFile(dataFile, JSON.stringify(data, null, 2));
+        const size = (await fs.stat(dataFile)).size;
+        console.log(`\n📄 学習記録 ${records.toLocaleString()} 件 / 画像 ${imageMb} MB（database.json ${(size / 1024 / 1024).toFixed(2)} MB）`);
+
+        // 既定: 学習記録を1件追加するたびに全体を書き直す
+        const rewrite = [];
+        for (let i = 0; i < saves; i++) {
+            const started = process.hrtime.bigint();
+            data.learningRecords.push({ id: records + i + 1, userId: 1, courseId: 1, score: 8, passed: true });
+            await rewriteSave(dataFile, data);
+            rewrite.push(Number(process.hrtime.bigint() - started) / 1e6);
+        }
+        const rewriteMean = summarize('全体書き直し', rewrite);
+
+        // ジャーナル: 同じ変更を差分として追記（fsync 込み）
+        await fs.writeFile(dataFile, JSON.stringify(generateData(records, imageMb)));
+        const store = new JournalStore(dataFile, journalFile, { compactEntries: saves + 1 });
+        await store.open();
+        const journal = [];
+        for (let i = 0; i < saves; i++) {
+            const started = process.hrtime.bigint();
+            await store.patch({ learningRecords: { upsert: [{ id: records + i + 1, userId: 1, courseId: 1, score: 8, passed: true }] } });
+            journal.push(Number(process.hrtime.bigint() - started) / 1e6);
+        }
+        const journalMean = summarize('ジャーナル追記', journal);
+        await store.close();
+
+        // 起動時の再生（スナップショット + saves 件のジャーナル）
+        const started = process.hrtime.bigint();
+        const reopened = new JournalStore(dataFile, journalFile);
+        const replayed = await reopened.open();
+        const replayMs = Number(process.hrtime.bigint() - started) / 1e6;
+        await reopened.close();
+        console.log(`  ${'起動時の再生'.padEnd(16)} ${replayMs.toFixed(2)}ms（${replayed} 件）`);
+        console.log(`  📊 保存あたり ${(rewriteMean / journalMean).toFixed(1)} 倍高速`);
+    } finally {
+        await fs.rm(dir, { recursive: true, force: true });
+    }
+}
+
+async function main() {
+    const options = parseArgs(process.argv.slice(2));
+    for (const records of options.records) {
+        await bench(records, options.imageMb, options.saves);
+    }
+}
+
+main().catch(error => {
+    console.error('❌ エラー:', error);
+    process.exit(1);
+});
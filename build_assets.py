@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+index.html のインライン script / style を分割・ハッシュ化・事前圧縮するビルド
+
+使用方法:
+    python3 build_assets.py                        # public/index.html → build/
+    python3 build_assets.py public/index.html public/user-management.html
+    python3 build_assets.py --out-dir build --force
+
+修正スクリプト（update_html.py / public/apply_*.py）を実行した後に実行します。
+public/ のファイルは変更しません。出力先（既定: build/）に次を書き出します。
+
+    build/index.html                 インラインの script / style を外部参照に書き換えた HTML
+    build/assets/index.<hash>.js     抽出したスクリプト（ファイル名が内容ハッシュ）
+    build/assets/index.<hash>.css    抽出したスタイル
+    *.gz / *.br                      gzip / brotli で事前圧縮したもの（小さくなる場合のみ）
+    build/asset-manifest.json        サーバー（static-assets.js）が読むマニフェスト
+
+サーバーはマニフェストに載ったファイルを Accept-Encoding に合わせて圧縮済みの
+ものから返し、assets/ には長期キャッシュ（immutable）、HTML には no-cache を付けます。
+修正で index.html が変わっても、内容の変わらないアセットの URL は変わりません。
+ビルド後に public/ の HTML を修正すると、サーバーはビルドを使わずに public/ から配信します。
+
+brotli は brotli パッケージがある場合のみ作ります（pip install brotli）。
+Docker イメージではビルド用のステージで実行します（Dockerfile）。
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+DEFAULT_PAGES = ['public/index.html']
+DEFAULT_OUT_DIR = 'build'
+ASSETS_DIR = 'assets'
+MANIFEST_FILE = 'asset-manifest.json'
+MANIFEST_VERSION = 1
+
+# これより小さいインライン要素は HTML に残す（リクエストを増やすほうが遅い）
+MIN_EXTRACT_BYTES = 1024
+# 圧縮しても元の 95% 以上になるものは圧縮版を作らない
+MIN_COMPRESSION_RATIO = 0.95
+HASH_LENGTH = 10
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+}
+
+SCRIPT_PATTERN = re.compile(r'<script\b([^>]*)>(.*?)</script\s*>', re.S | re.I)
+STYLE_PATTERN = re.compile(r'<style\b([^>]*)>(.*?)</style\s*>', re.S | re.I)
+ATTRIBUTE_PATTERN = re.compile(r'''([\w:-]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?''')
+
+# 外部ファイルにしてよい type（これ以外の JSON・テンプレートなどは残す）
+SCRIPT_TYPES = {'', 'text/javascript', 'application/javascript', 'module'}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_attributes(text):
+    """{属性名（小文字）: 値}（値のない属性は空文字）"""
+    attributes = {}
+    for m in ATTRIBUTE_PATTERN.finditer(text):
+        value = m.group(2) or ''
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        attributes[m.group(1).lower()] = value
+    return attributes
+
+
+def write_atomic(path, data):
+    """一時ファイルに書き込んでから置き換える（配信中のサーバーが書きかけを読まない）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def load_brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+# ===========================================
+# HTML の分割
+# ===========================================
+
+def extract_inline(html, stem):
+    """インラインの script / style を抜き出し、(書き換えた HTML, [(ファイル名, 内容)]) を返す"""
+    assets = []
+
+    def asset_name(body, extension):
+        data = body.encode('utf-8')
+        name = f'{stem}.{content_hash(data)[:HASH_LENGTH]}{extension}'
+        assets.append((name, data))
+        return f'/{ASSETS_DIR}/{name}'
+
+    def replace_script(m):
+        attributes = parse_attributes(m.group(1))
+        body = m.group(2)
+        if ('src' in attributes
+                or attributes.get('type', '').strip().lower() not in SCRIPT_TYPES
+                or len(body.encode('utf-8')) < MIN_EXTRACT_BYTES):
+            return m.group(0)
+        # 外部スクリプトもパーサーを止めて同じ位置で実行されるため、実行順は変わらない
+        return f'<script src="{asset_name(body, ".js")}"{m.group(1)}></script>'
+
+    def replace_style(m):
+        attributes = parse_attributes(m.group(1))
+        body = m.group(2)
+        if len(body.encode('utf-8')) < MIN_EXTRACT_BYTES:
+            return m.group(0)
+        media = f' media="{attributes["media"]}"' if attributes.get('media') else ''
+        return f'<link rel="stylesheet" href="{asset_name(body, ".css")}"{media}>'
+
+    html = SCRIPT_PATTERN.sub(replace_script, html)
+    html = STYLE_PATTERN.sub(replace_style, html)
+    return html, assets
+
+
+# ===========================================
+# 書き出し
+# ===========================================
+
+class Builder:
+    def __init__(self, out_dir, brotli=None):
+        self.out_dir = out_dir
+        self.brotli = brotli
+        self.files = {}     # URL → マニフェストの項目
+        self.written = 0
+
+    def write_file(self, relative, data):
+        """内容が同じファイルは書き直さない（ファイル名が内容ハッシュの assets はほぼすべて）"""
+        path = os.path.join(self.out_dir, relative)
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return
+        except OSError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, data)
+        self.written += 1
+
+    def compress(self, data):
+        """{エンコーディング: 圧縮した内容}（gzip は mtime=0 で毎回同じ内容にする）"""
+        variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+        if self.brotli:
+            variants['br'] = self.brotli.compress(data, quality=11)
+        return {encoding: body for encoding, body in variants.items()
+                if len(body) < len(data) * MIN_COMPRESSION_RATIO}
+
+    def add(self, relative, data, immutable):
+        relative = relative.replace(os.sep, '/')
+        digest = content_hash(data)
+        self.write_file(relative, data)
+        encodings = {}
+        for encoding, body in self.compress(data).items():
+            suffix = '.br' if encoding == 'br' else '.gz'
+            self.write_file(relative + suffix, body)
+            encodings[encoding] = {'path': relative + suffix, 'size': len(body)}
+        self.files['/' + relative] = {
+            'path': relative,
+            'type': CONTENT_TYPES.get(os.path.splitext(relative)[1], 'application/octet-stream'),
+            'size': len(data),
+            'hash': digest[:HASH_LENGTH * 2],
+            'immutable': immutable,
+            'encodings': encodings,
+        }
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(manifest, pages, out_dir, encodings):
+    """前回のビルドが同じ入力・同じ圧縮形式から作られ、出力がすべて残っているか"""
+    if not manifest or manifest.get('version') != MANIFEST_VERSION or manifest.get('encodings') != encodings:
+        return False
+    if set(manifest.get('pages', {})) != {page_key(page) for page in pages}:
+        return False
+    for page, source_hash in page_hashes(pages).items():
+        if manifest['pages'][page].get('sha256') != source_hash:
+            return False
+    for entry in manifest.get('files', {}).values():
+        paths = [entry['path']] + [v['path'] for v in entry.get('encodings', {}).values()]
+        if not all(os.path.exists(os.path.join(out_dir, p)) for p in paths):
+            return False
+    return True
+
+
+def page_key(page):
+    """マニフェストでの HTML の名前（サーバーがリポジトリのルートからの相対パスで照合する）"""
+    return os.path.relpath(page).replace(os.sep, '/')
+
+
+def page_hashes(pages):
+    hashes = {}
+    for page in pages:
+        with open(page, 'rb') as f:
+            hashes[page_key(page)] = content_hash(f.read())
+    return hashes
+
+
+def retain_previous(builder, previous):
+    """前回のビルドの assets を1世代だけ残す（デプロイ直前に HTML を読んだブラウザ用）"""
+    if not previous:
+        return 0
+    retained = 0
+    for url, entry in previous.get('files', {}).items():
+        if (url in builder.files or not entry.get('immutable') or entry.get('previous')
+                or not os.path.exists(os.path.join(builder.out_dir, entry['path']))):
+            continue
+        builder.files[url] = dict(entry, previous=True)
+        retained += 1
+    return retained
+
+
+def prune_assets(builder):
+    """マニフェストに載っていない assets/ のファイルを削除する"""
+    directory = os.path.join(builder.out_dir, ASSETS_DIR)
+    if not os.path.isdir(directory):
+        return 0
+    keep = set()
+    for entry in builder.files.values():
+        keep.add(entry['path'])
+        keep.update(v['path'] for v in entry.get('encodings', {}).values())
+    removed = 0
+    for name in os.listdir(directory):
+        if f'{ASSETS_DIR}/{name}' not in keep:
+            os.unlink(os.path.join(directory, name))
+            removed += 1
+    return removed
+
+
+def encoding_names(brotli):
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+
+def format_size(size):
+    return f'{size / 1024:.1f} KB' if size >= 1024 else f'{size} B'
+
+
+def print_report(builder):
+    print(f"{'ファイル':<40} {'元':>10} {'gzip':>10} {'brotli':>10}")
+    for url, entry in sorted(builder.files.items(), key=lambda item: (item[1]['immutable'], item[0])):
+        if entry.get('previous'):
+            continue
+        sizes = [format_size(entry['size'])]
+        for encoding in ('gzip', 'br'):
+            variant = entry['encodings'].get(encoding)
+            sizes.append(format_size(variant['size']) if variant else '-')
+        cache = 'immutable' if entry['immutable'] else 'no-cache'
+        print(f'{url:<40} {sizes[0]:>10} {sizes[1]:>10} {sizes[2]:>10}  {cache}')
+
+
+def build(pages, out_dir, brotli):
+    builder = Builder(out_dir, brotli)
+    previous = load_manifest(os.path.join(out_dir, MANIFEST_FILE))
+    sources = {}
+    for page in pages:
+        with open(page, 'rb') as f:
+            raw = f.read()
+        stem = os.path.splitext(os.path.basename(page))[0]
+        html, assets = extract_inline(raw.decode('utf-8'), stem)
+        for name, data in assets:
+            builder.add(os.path.join(ASSETS_DIR, name), data, immutable=True)
+        output = os.path.basename(page)
+        builder.add(output, html.encode('utf-8'), immutable=False)
+        sources[page_key(page)] = {
+            'sha256': content_hash(raw),
+            'output': output,
+            'assets': [f'/{ASSETS_DIR}/{name}' for name, _ in assets],
+        }
+
+    retained = retain_previous(builder, previous)
+    removed = prune_assets(builder)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'built': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'encodings': encoding_names(brotli),
+        'pages': sources,
+        'files': builder.files,
+    }
+    write_atomic(os.path.join(out_dir, MANIFEST_FILE),
+                 json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    return builder, retained, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='index.html のインライン script / style を分割・ハッシュ化・事前圧縮します')
+    parser.add_argument('pages', nargs='*', default=DEFAULT_PAGES, help=f'対象の HTML（既定: {" ".join(DEFAULT_PAGES)}）')
+    parser.add_argument('--out-dir', default=DEFAULT_OUT_DIR, help=f'出力先（既定: {DEFAULT_OUT_DIR}）')
+    parser.add_argument('--force', action='store_true', help='入力が前回と同じでもビルドし直す')
+    parser.add_argument('--no-brotli', action='store_true', help='brotli 版を作らない')
+    args = parser.parse_args()
+
+    for page in args.pages:
+        if not os.path.isfile(page):
+            print(f'❌ エラー: {page} が見つかりません')
+            sys.exit(1)
+    names = [os.path.basename(page) for page in args.pages]
+    if len(set(names)) != len(names):
+        print('❌ エラー: 同じファイル名の HTML は同時にビルドできません')
+        sys.exit(1)
+
+    brotli = None
+    if not args.no_brotli:
+        brotli = load_brotli()
+        if brotli is None:
+            print('⚠️  brotli パッケージがないため gzip 版のみ作ります（pip install brotli）')
+
+    manifest_path = os.path.join(args.out_dir, MANIFEST_FILE)
+    if not args.force and is_current(load_manifest(manifest_path), args.pages, args.out_dir, encoding_names(brotli)):
+        print(f'✅ 変更なし: {manifest_path} は最新です')
+        return
+
+    started = time.perf_counter()
+    os.makedirs(os.path.join(args.out_dir, ASSETS_DIR), exist_ok=True)
+    builder, retained, removed = build(args.pages, args.out_dir, brotli)
+    elapsed = (time.perf_counter() - started) * 1000
+
+    print(f'📦 ビルドしました: {", ".join(args.pages)} → {args.out_dir}/ ({elapsed:.0f}ms)')
+    print()
+    print_report(builder)
+    print()
+    print(f'   書き込み: {builder.written} ファイル / 前回の assets を保持: {retained} / 削除: {removed}')
+    print(f'✅ マニフェスト: {manifest_path}')
+
+
+if __name__ == '__main__':
+    main()
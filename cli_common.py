@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+コマンドラインツール共通の小さな部品
+
+update_html.py / extract_slide_images.py / pg_transfer.py / roster_sync.py /
+item_analysis.py から使います。標準ライブラリだけに依存し、import しても
+何も実行しません。
+
+    atomic_output   一時ファイルに書き込み、成功時だけ置き換える
+    Phases          フェーズごとの処理時間と件数を記録して表示する
+"""
+
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_output(path, mode='wb', encoding=None):
+    """一時ファイルに書き込み、成功時のみ fsync して置き換える"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class Phases:
+    """フェーズごとの処理時間と件数"""
+
+    def __init__(self):
+        self.rows = []
+
+    def run(self, label, func, count=None):
+        """func() を計測する（count は件数、または結果から件数を求める関数）"""
+        started = time.time()
+        result = func()
+        seconds = time.time() - started
+        self.rows.append((label, seconds, count(result) if callable(count) else count))
+        return result
+
+    def print(self):
+        print('\n📊 フェーズ別:')
+        for label, seconds, n in self.rows:
+            count = f'{n:>7,} 件' if n is not None else ' ' * 10
+            print(f'  {label:<14}{count}  {seconds * 1000:>9.1f}ms')
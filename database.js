@@ -1,11 +1,42 @@
 const { Pool } = require('pg');
+const { migrate } = require('./migrations');
+const { instrumentPool } = require('./db-metrics');
+
+// 環境変数の数値（未設定・不正なら既定値）
+function envInt(name, fallback) {
+    const value = Number(process.env[name]);
+    return Number.isInteger(value) && value >= 0 && process.env[name] !== '' ? value : fallback;
+}
+
+// 接続プールの設定（/api/metrics の待ち時間・クエリ時間を見て調整する）
+//   PG_POOL_MAX                 同時接続数の上限（既定 10）
+//   PG_POOL_IDLE_TIMEOUT_MS     使われていない接続を閉じるまでの時間（既定 30000）
+//   PG_CONNECTION_TIMEOUT_MS    接続の取得を諦めるまでの時間（既定 0 = 無制限）
+//   PG_STATEMENT_TIMEOUT_MS     1クエリの実行時間の上限（既定 0 = 無制限）
+//   PG_SLOW_QUERY_MS            遅いクエリとして記録するしきい値（既定 200）
+const poolConfig = {
+    max: envInt('PG_POOL_MAX', 10),
+    idleTimeoutMs: envInt('PG_POOL_IDLE_TIMEOUT_MS', 30000),
+    connectionTimeoutMs: envInt('PG_CONNECTION_TIMEOUT_MS', 0),
+    statementTimeoutMs: envInt('PG_STATEMENT_TIMEOUT_MS', 0)
+};
 
 // PostgreSQL接続設定
 const pool = new Pool({
     connectionString: process.env.DATABASE_URL,
     ssl: process.env.DATABASE_URL?.includes('localhost') ? false : {
         rejectUnauthorized: false
-    }
+    },
+    max: poolConfig.max,
+    idleTimeoutMillis: poolConfig.idleTimeoutMs,
+    connectionTimeoutMillis: poolConfig.connectionTimeoutMs,
+    ...(poolConfig.statementTimeoutMs ? { statement_timeout: poolConfig.statementTimeoutMs } : {})
+});
+
+// pool.query / pool.connect の計測（/api/metrics）
+const metrics = instrumentPool(pool, {
+    config: poolConfig,
+    slowQueryMs: envInt('PG_SLOW_QUERY_MS', 200)
 });
 
 // データベーステーブルの作成
@@ -15,55 +46,8 @@ async function initializeDatabase() {
     try {
         console.log('📊 データベースを初期化しています...');
         
-        // テーブル作成
-        await client.query(`
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(100) UNIQUE NOT NULL,
-                password VARCHAR(255) NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                role VARCHAR(20) DEFAULT 'user',
-                department VARCHAR(100),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS courses (
-                id SERIAL PRIMARY KEY,
-                title VARCHAR(255) NOT NULL,
-                description TEXT,
-                slides JSONB,
-                quiz JSONB,
-                passing_score INTEGER DEFAULT 70,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS learning_records (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                course_id INTEGER REFERENCES courses(id) ON DELETE CASCADE,
-                score INTEGER NOT NULL,
-                passed BOOLEAN DEFAULT FALSE,
-                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                answers JSONB,
-                time_spent INTEGER DEFAULT 0
-            );
-
-            CREATE TABLE IF NOT EXISTS progress (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                course_id INTEGER,
-                current_slide INTEGER DEFAULT 0,
-                quiz_started BOOLEAN DEFAULT FALSE,
-                quiz_answers JSONB,
-                expires_at TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, course_id)
-            );
-        `);
+        // テーブル作成・変更（migrations.js の未適用分）
+        await migrate(client);
 
         // デフォルトユーザーを確認・作成
         const userCheck = await client.query('SELECT COUNT(*) FROM users');
@@ -105,7 +89,7 @@ async function initializeDatabase() {
 
 // データベース操作関数
 
-// 全ユーザー取得
+// 全ユーザー取得（無効化されたユーザーも含む。全体保存で消えないように active ごと返す）
 async function getUsers() {
     const result = await pool.query('SELECT * FROM users ORDER BY id');
     return result.rows;
@@ -119,7 +103,7 @@ async function getUserById(id) {
 
 // ユーザー取得（ユーザー名）
 async function getUserByUsername(username) {
-    const result = await pool.query('SELECT * FROM users WHERE username = $1', [username]);
+    const result = await pool.query('SELECT * FROM users WHERE username = $1 AND active', [username]);
     return result.rows[0];
 }
 
@@ -149,27 +133,125 @@ async function deleteUser(id) {
     return true;
 }
 
+// コース本文のLRUキャッシュ（id ごとに updated_at を版として保持し、
+// 版が変わっていれば読み直す。updateCourse / deleteCourse で破棄）
+const COURSE_CACHE_SIZE = parseInt(process.env.COURSE_CACHE_SIZE || '20');
+const courseCache = new Map();   // id → { version, course }（挿入順 = LRU順）
+const courseCacheStats = { hits: 0, misses: 0, evictions: 0, invalidations: 0 };
+
+function cachedCourse(id, version) {
+    const entry = courseCache.get(id);
+    if (entry && entry.version === version) {
+        courseCache.delete(id);
+        courseCache.set(id, entry);
+        courseCacheStats.hits++;
+        return entry.course;
+    }
+    courseCacheStats.misses++;
+    return null;
+}
+
+function cacheCourse(id, version, course) {
+    courseCache.delete(id);
+    courseCache.set(id, { version, course });
+    while (courseCache.size > COURSE_CACHE_SIZE) {
+        courseCache.delete(courseCache.keys().next().value);
+        courseCacheStats.evictions++;
+    }
+}
+
+function invalidateCourse(id) {
+    if (courseCache.delete(id)) {
+        courseCacheStats.invalidations++;
+    }
+}
+
+function getCourseCacheStats() {
+    const lookups = courseCacheStats.hits + courseCacheStats.misses;
+    return {
+        ...courseCacheStats,
+        hitRate: lookups ? courseCacheStats.hits / lookups : 0,
+        size: courseCache.size,
+        capacity: COURSE_CACHE_SIZE
+    };
+}
+
+// slidesをslideImagesにマッピング
+function toCourse({ version, ...row }) {
+    return {
+        ...row,
+        slideImages: row.slides || []
+    };
+}
+
+// キャッシュにない（または古い）コースだけを読み込む
+async function loadCourses(versions) {
+    const courses = new Map();
+    const missing = [];
+    for (const { id, version } of versions) {
+        const course = cachedCourse(id, version);
+        if (course) {
+            courses.set(id, course);
+        } else {
+            missing.push(id);
+        }
+    }
+    if (missing.length > 0) {
+        const result = await pool.query(
+            'SELECT *, updated_at::text AS version FROM courses WHERE id = ANY($1::int[])',
+            [missing]
+        );
+        for (const row of result.rows) {
+            const course = toCourse(row);
+            cacheCourse(row.id, row.version, course);
+            courses.set(row.id, course);
+        }
+    }
+    return versions.map(({ id }) => courses.get(id)).filter(Boolean);
+}
+
 // 全コース取得
 async function getCourses() {
-    const result = await pool.query('SELECT * FROM courses ORDER BY id');
-    // slidesをslideImagesにマッピング
-    return result.rows.map(course => ({
+    const versions = await pool.query('SELECT id, updated_at::text AS version FROM courses ORDER BY id');
+    return loadCourses(versions.rows);
+}
+
+// 一覧画面用のコース概要（スライド画像・問題本文を読まない）
+async function getCourseSummaries() {
+    const result = await pool.query(
+        `SELECT id, title, description, slide_count AS "slideCount", quiz_length AS "quizLength", updated_at
+         FROM courses ORDER BY id`
+    );
+    return result.rows;
+}
+
+// 画像を除いたコース一覧（/api/data?slides=lazy 用。画像は getCourseSlide で1枚ずつ取得）
+async function getCoursesWithoutSlides() {
+    const result = await pool.query(
+        `SELECT id, title, description, quiz, passing_score, created_at, updated_at, slide_count
+         FROM courses ORDER BY id`
+    );
+    return result.rows.map(({ slide_count, ...course }) => ({
         ...course,
-        slideImages: course.slides || []
+        slideImages: [],
+        slideCount: slide_count
     }));
 }
 
+// スライド1枚の取得（index は0始まり）
+async function getCourseSlide(id, index) {
+    const result = await pool.query(
+        'SELECT slides->$2::int AS slide FROM courses WHERE id = $1',
+        [id, index]
+    );
+    return result.rows[0] ? result.rows[0].slide : null;
+}
+
 // コース取得（ID）
 async function getCourseById(id) {
-    const result = await pool.query('SELECT * FROM courses WHERE id = $1', [id]);
-    if (result.rows[0]) {
-        // slidesをslideImagesにマッピング
-        return {
-            ...result.rows[0],
-            slideImages: result.rows[0].slides || []
-        };
-    }
-    return null;
+    const versions = await pool.query('SELECT id, updated_at::text AS version FROM courses WHERE id = $1', [id]);
+    const [course] = await loadCourses(versions.rows);
+    return course || null;
 }
 
 // コース作成
@@ -197,6 +279,7 @@ async function updateCourse(id, courseData) {
         'UPDATE courses SET title = $1, description = $2, slides = $3, quiz = $4, passing_score = $5, updated_at = CURRENT_TIMESTAMP WHERE id = $6 RETURNING *',
         [title, description, JSON.stringify(slidesData), JSON.stringify(quiz), passing_score, id]
     );
+    invalidateCourse(Number(id));
     // 返す際はslideImagesフィールドも含める
     return {
         ...result.rows[0],
@@ -207,34 +290,40 @@ async function updateCourse(id, courseData) {
 // コース削除
 async function deleteCourse(id) {
     await pool.query('DELETE FROM courses WHERE id = $1', [id]);
+    invalidateCourse(Number(id));
     return true;
 }
 
+// 学習記録の列（ユーザー・コース情報を含める）
+// 問題数はコース保存時に計算済みの quiz_length を使い、行ごとに quiz を展開しない
+const RECORD_COLUMNS = `
+    lr.id,
+    lr.user_id as "userId",
+    lr.course_id as "courseId",
+    lr.score,
+    lr.passed,
+    lr.completed_at as "completedAt",
+    lr.answers,
+    lr.time_spent as "timeSpent",
+    u.name as "userName",
+    u.department as "userDept",
+    c.title as "courseTitle",
+    CASE 
+        WHEN lr.passed = true THEN 'completed'
+        ELSE 'failed'
+    END as status,
+    lr.score as "correctCount",
+    CASE 
+        WHEN c.quiz IS NOT NULL THEN c.quiz_length
+        ELSE 10
+    END as "totalQuestions",
+    lr.completed_at as "completedDate"
+`;
+
 // 🔧 修正: 学習記録取得（全て） - JOINでユーザーとコース情報を含める
 async function getLearningRecords() {
     const result = await pool.query(`
-        SELECT 
-            lr.id,
-            lr.user_id as "userId",
-            lr.course_id as "courseId",
-            lr.score,
-            lr.passed,
-            lr.completed_at as "completedAt",
-            lr.answers,
-            lr.time_spent as "timeSpent",
-            u.name as "userName",
-            u.department as "userDept",
-            c.title as "courseTitle",
-            CASE 
-                WHEN lr.passed = true THEN 'completed'
-                ELSE 'failed'
-            END as status,
-            lr.score as "correctCount",
-            CASE 
-                WHEN c.quiz IS NOT NULL THEN jsonb_array_length(c.quiz)
-                ELSE 10
-            END as "totalQuestions",
-            lr.completed_at as "completedDate"
+        SELECT ${RECORD_COLUMNS}
         FROM learning_records lr
         LEFT JOIN users u ON lr.user_id = u.id
         LEFT JOIN courses c ON lr.course_id = c.id
@@ -246,28 +335,7 @@ async function getLearningRecords() {
 // 🔧 修正: 学習記録取得（ユーザーID） - JOINでユーザーとコース情報を含める
 async function getLearningRecordsByUserId(userId) {
     const result = await pool.query(`
-        SELECT 
-            lr.id,
-            lr.user_id as "userId",
-            lr.course_id as "courseId",
-            lr.score,
-            lr.passed,
-            lr.completed_at as "completedAt",
-            lr.answers,
-            lr.time_spent as "timeSpent",
-            u.name as "userName",
-            u.department as "userDept",
-            c.title as "courseTitle",
-            CASE 
-                WHEN lr.passed = true THEN 'completed'
-                ELSE 'failed'
-            END as status,
-            lr.score as "correctCount",
-            CASE 
-                WHEN c.quiz IS NOT NULL THEN jsonb_array_length(c.quiz)
-                ELSE 10
-            END as "totalQuestions",
-            lr.completed_at as "completedDate"
+        SELECT ${RECORD_COLUMNS}
         FROM learning_records lr
         LEFT JOIN users u ON lr.user_id = u.id
         LEFT JOIN courses c ON lr.course_id = c.id
@@ -277,6 +345,81 @@ async function getLearningRecordsByUserId(userId) {
     return result.rows;
 }
 
+// 学習記録の絞り込み条件（部署・コース・ユーザー・合否・完了日の範囲）
+// to が日付だけ（YYYY-MM-DD）の場合はその日の終わりまでを含める
+function recordFilters({ department, courseId, userId, status, from, to } = {}, params = []) {
+    const conditions = [];
+    const add = (sql, value) => {
+        params.push(value);
+        conditions.push(sql.replace('?', `$${params.length}`));
+    };
+    if (department) add('u.department = ?', department);
+    if (courseId) add('lr.course_id = ?', courseId);
+    if (userId) add('lr.user_id = ?', userId);
+    if (status === 'completed') conditions.push('lr.passed = true');
+    if (status === 'failed') conditions.push('lr.passed IS NOT TRUE');
+    if (from) add('lr.completed_at >= ?::timestamp', from);
+    if (to) {
+        add(/^\d{4}-\d{2}-\d{2}$/.test(to) ? 'lr.completed_at < ?::date + 1' : 'lr.completed_at <= ?::timestamp', to);
+    }
+    return { conditions, params };
+}
+
+// 学習記録の1ページ分（completed_at, id の降順、キーセットページング）
+//
+// after は前のページの last（{ at, id }）。at は completed_at をマイクロ秒まで
+// 含む文字列で、OFFSET を使わないので後ろのページでも読み飛ばしが発生しない。
+// completed_at が NULL の記録は先頭（DESC の NULLS FIRST）に並ぶ。
+async function getLearningRecordsPage({ limit = 50, after = null, ...filters } = {}) {
+    const { conditions, params } = recordFilters(filters);
+    if (after) {
+        params.push(after.id);
+        const id = `$${params.length}`;
+        if (after.at === null) {
+            conditions.push(`(lr.completed_at IS NOT NULL OR lr.id < ${id})`);
+        } else {
+            params.push(after.at);
+            conditions.push(`(lr.completed_at, lr.id) < ($${params.length}::timestamp, ${id})`);
+        }
+    }
+    params.push(limit + 1);
+    const result = await pool.query(`
+        SELECT ${RECORD_COLUMNS}, lr.completed_at::text AS "sortKey"
+        FROM learning_records lr
+        LEFT JOIN users u ON lr.user_id = u.id
+        LEFT JOIN courses c ON lr.course_id = c.id
+        ${conditions.length ? 'WHERE ' + conditions.join(' AND ') : ''}
+        ORDER BY lr.completed_at DESC, lr.id DESC
+        LIMIT $${params.length}
+    `, params);
+
+    const rows = result.rows.slice(0, limit);
+    const lastRow = rows[rows.length - 1];
+    const records = rows.map(({ sortKey, ...record }) => record);
+    return {
+        records,
+        last: result.rows.length > limit ? { at: lastRow.sortKey, id: lastRow.id } : null
+    };
+}
+
+// 絞り込み条件に一致する学習記録の集計（件数・合格数・受講者数・平均点）
+async function getLearningRecordTotals(filters = {}) {
+    const { conditions, params } = recordFilters(filters);
+    const result = await pool.query(`
+        SELECT COUNT(*)::int AS total,
+               (COUNT(*) FILTER (WHERE lr.passed))::int AS passed,
+               COUNT(DISTINCT lr.user_id)::int AS learners,
+               ROUND(AVG(lr.score), 1)::float AS "averageScore",
+               MIN(lr.completed_at) AS "firstCompletedAt",
+               MAX(lr.completed_at) AS "lastCompletedAt"
+        FROM learning_records lr
+        ${filters.department ? 'LEFT JOIN users u ON lr.user_id = u.id' : ''}
+        ${conditions.length ? 'WHERE ' + conditions.join(' AND ') : ''}
+    `, params);
+    const totals = result.rows[0];
+    return { ...totals, failed: totals.total - totals.passed };
+}
+
 // 学習記録作成
 async function createLearningRecord(recordData) {
     const { user_id, course_id, score, passed, answers = [], time_spent = 0 } = recordData;
@@ -317,6 +460,55 @@ async function saveProgress(userId, progressData) {
     return result.rows[0];
 }
 
+// 複数ユーザーの進捗を1回の upsert で保存（同じユーザー・コースは最後の状態を採用）
+// course_id が NULL の行は ON CONFLICT (user_id, course_id) に一致せず毎回重複して
+// 追加されるため、user_id / course_id のない項目は保存せず rejected として返す
+async function saveProgressBatch(items) {
+    const latest = new Map();
+    const rejected = [];
+    items.forEach((item, index) => {
+        const row = {
+            user_id: parseInt(item.user_id ?? item.userId),
+            course_id: item.course_id ?? item.courseId ?? null,
+            current_slide: item.current_slide ?? item.slideIndex ?? 0,
+            quiz_started: item.quiz_started ?? item.screen === 'quiz',
+            quiz_answers: item.quiz_answers ?? item.answers ?? [],
+            expires_at: item.expires_at ?? null
+        };
+        if (!Number.isInteger(row.user_id)) {
+            rejected.push({ index, error: 'userIdが必要です' });
+            return;
+        }
+        if (row.course_id === null) {
+            rejected.push({ index, userId: row.user_id, error: 'courseIdが必要です' });
+            return;
+        }
+        latest.set(`${row.user_id}:${row.course_id}`, row);
+    });
+    if (latest.size === 0) {
+        return { saved: 0, rejected };
+    }
+    
+    const result = await pool.query(
+        `INSERT INTO progress (user_id, course_id, current_slide, quiz_started, quiz_answers, expires_at)
+         SELECT user_id, course_id, current_slide, quiz_started, quiz_answers, expires_at
+         FROM jsonb_to_recordset($1::jsonb) AS t(
+            user_id INTEGER, course_id INTEGER, current_slide INTEGER,
+            quiz_started BOOLEAN, quiz_answers JSONB, expires_at TIMESTAMP
+         )
+         ON CONFLICT (user_id, course_id)
+         DO UPDATE SET 
+            current_slide = EXCLUDED.current_slide,
+            quiz_started = EXCLUDED.quiz_started,
+            quiz_answers = EXCLUDED.quiz_answers,
+            expires_at = EXCLUDED.expires_at,
+            updated_at = CURRENT_TIMESTAMP`,
+        [JSON.stringify([...latest.values()])]
+    );
+    
+    return { saved: result.rowCount, rejected };
+}
+
 // 進捗削除
 async function deleteProgress(userId, courseId = null) {
     if (courseId) {
@@ -333,26 +525,400 @@ async function cleanupExpiredProgress() {
     return result.rowCount;
 }
 
+// ========================================
+// 学習記録のメンテナンス（maintenance.js / /api/debug/*）
+// ========================================
+
+// 1バッチで扱う学習記録の目安
+const MAINTENANCE_BATCH_ROWS = 5000;
+// 行ロック待ちの上限（超えたらバッチをやり直す）
+const MAINTENANCE_LOCK_TIMEOUT = '5s';
+const MAINTENANCE_RETRIES = 3;
+
+// 1バッチを短いトランザクションで実行する（ロック待ちはリトライ）
+async function runMaintenanceBatch(sql, params) {
+    for (let attempt = 1; ; attempt++) {
+        const client = await pool.connect();
+        try {
+            await client.query('BEGIN');
+            await client.query(`SET LOCAL lock_timeout = '${MAINTENANCE_LOCK_TIMEOUT}'`);
+            const result = await client.query(sql, params);
+            await client.query('COMMIT');
+            return result.rows[0];
+        } catch (error) {
+            await client.query('ROLLBACK');
+            // 55P03 = lock_not_available
+            if (error.code !== '55P03' || attempt >= MAINTENANCE_RETRIES) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+        } finally {
+            client.release();
+        }
+    }
+}
+
+// バッチの結果を合計し、進捗を通知する
+function addBatch(totals, row, range, onBatch) {
+    totals.batches++;
+    totals.scanned += row.scanned;
+    totals.deleted += row.deleted;
+    totals.seconds = (Date.now() - totals.started) / 1000;
+    if (onBatch) onBatch({ ...totals, range, batchScanned: row.scanned, batchDeleted: row.deleted });
+}
+
+// ユーザー・コースごとに最新の記録だけを残す
+//
+// user_id の範囲 (lower, upper] ごとに、ウィンドウ関数で順位を付けて2件目以降を
+// 削除する1文を実行する。範囲は約 batchRows 件になるように索引から決めるので、
+// 1回のトランザクションで触る行数とロック時間が一定に収まる（稼働中でも実行可）。
+// 残す行は以前の array_agg(id ORDER BY completed_at DESC) の先頭と同じく、
+// completed_at が NULL の記録を最新とみなす（DESC の既定 NULLS FIRST）。
+async function dedupeLearningRecords({ batchRows = MAINTENANCE_BATCH_ROWS, dryRun = false, onBatch } = {}) {
+    const rankAndDelete = where => `
+        WITH ranked AS (
+            SELECT id, row_number() OVER (
+                PARTITION BY user_id, course_id
+                ORDER BY completed_at DESC NULLS FIRST, id DESC
+            ) AS rn
+            FROM learning_records
+            WHERE ${where}
+        )${dryRun ? `
+        SELECT COUNT(*)::int AS scanned, (COUNT(*) FILTER (WHERE rn > 1))::int AS deleted FROM ranked` : `,
+        deleted AS (
+            DELETE FROM learning_records WHERE id IN (SELECT id FROM ranked WHERE rn > 1) RETURNING id
+        )
+        SELECT (SELECT COUNT(*) FROM ranked)::int AS scanned, (SELECT COUNT(*) FROM deleted)::int AS deleted`}
+    `;
+    const inRange = rankAndDelete('user_id > $1 AND user_id <= $2');
+    const totals = { batches: 0, scanned: 0, deleted: 0, seconds: 0, started: Date.now(), dryRun };
+
+    let lower = -2147483648;
+    for (;;) {
+        // 約 batchRows 件先の user_id を上限にする（同じユーザーの記録は同じバッチ）
+        const bound = await pool.query(`
+            SELECT COALESCE(
+                (SELECT user_id FROM learning_records WHERE user_id > $1 ORDER BY user_id OFFSET $2 LIMIT 1),
+                (SELECT MAX(user_id) FROM learning_records WHERE user_id > $1)
+            ) AS upper
+        `, [lower, batchRows - 1]);
+        const upper = bound.rows[0].upper;
+        if (upper === null) break;
+        addBatch(totals, await runMaintenanceBatch(inRange, [lower, upper]), [lower, upper], onBatch);
+        lower = upper;
+    }
+
+    // user_id のない記録（ユーザー削除前のデータなど）
+    addBatch(totals, await runMaintenanceBatch(rankAndDelete('user_id IS NULL'), []), null, onBatch);
+    delete totals.started;
+    return totals;
+}
+
+// 学習記録を id の範囲ごとに削除する（TRUNCATE と違いテーブル全体をロックしない）
+async function deleteLearningRecords({ batchRows = MAINTENANCE_BATCH_ROWS, dryRun = false, onBatch } = {}) {
+    const totals = { batches: 0, scanned: 0, deleted: 0, seconds: 0, started: Date.now(), dryRun };
+    if (dryRun) {
+        const count = await pool.query('SELECT COUNT(*)::int AS scanned, COUNT(*)::int AS deleted FROM learning_records');
+        addBatch(totals, count.rows[0], null, onBatch);
+    } else {
+        for (;;) {
+            const row = await runMaintenanceBatch(`
+                WITH batch AS (
+                    SELECT id FROM learning_records ORDER BY id LIMIT $1
+                ), deleted AS (
+                    DELETE FROM learning_records WHERE id IN (SELECT id FROM batch) RETURNING id
+                )
+                SELECT COUNT(*)::int AS scanned, COUNT(*)::int AS deleted, MAX(id) AS upper FROM deleted
+            `, [batchRows]);
+            if (row.deleted === 0) break;
+            addBatch(totals, row, [null, row.upper], onBatch);
+        }
+        // 空になった場合だけ id を 1 から振り直す（RESTART IDENTITY 相当）
+        await pool.query(`
+            SELECT setval(pg_get_serial_sequence('learning_records', 'id'), 1, false)
+            WHERE NOT EXISTS (SELECT 1 FROM learning_records)
+        `);
+    }
+    delete totals.started;
+    return totals;
+}
+
+// ========================================
+// 修了状況の集計（course_rollups は学習記録のトリガーで更新される）
+// ========================================
+
+// 集計行を合計する（部署・コース単位の小計用）
+function sumRollups(rows) {
+    const total = { attempts: 0, passed: 0, scoreSum: 0, learners: 0, completedLearners: 0 };
+    for (const row of rows) {
+        total.attempts += row.attempts;
+        total.passed += row.passed;
+        total.scoreSum += row.scoreSum;
+        total.learners += row.learners;
+        total.completedLearners += row.completedLearners;
+    }
+    return withRates(total);
+}
+
+function withRates({ scoreSum, ...row }) {
+    return {
+        ...row,
+        passRate: row.attempts ? Math.round(row.passed / row.attempts * 1000) / 10 : null,
+        averageScore: row.attempts ? Math.round(scoreSum / row.attempts * 10) / 10 : null
+    };
+}
+
+// 部署 × コースの修了状況（集計済みの行を読むだけなので記録数に依存しない）
+// 部署・全体の learners / completedLearners はコースごとの人数の合計
+async function getCompletionDashboard() {
+    const [rollups, members] = await Promise.all([
+        pool.query(`
+            SELECT r.department, r.course_id AS "courseId", c.title AS "courseTitle",
+                   r.attempts, r.passes AS passed, r.score_sum::float AS "scoreSum",
+                   r.learners, r.completed_learners AS "completedLearners"
+            FROM course_rollups r
+            LEFT JOIN courses c ON c.id = r.course_id
+            ORDER BY r.department, r.course_id
+        `),
+        pool.query(`
+            SELECT COALESCE(department, '') AS department, COUNT(*)::int AS members
+            FROM users WHERE active AND role = 'user'
+            GROUP BY 1
+        `)
+    ]);
+
+    const group = key => {
+        const groups = new Map();
+        for (const row of rollups.rows) {
+            if (!groups.has(row[key])) groups.set(row[key], []);
+            groups.get(row[key]).push(row);
+        }
+        return groups;
+    };
+    const memberCounts = new Map(members.rows.map(row => [row.department, row.members]));
+
+    return {
+        cells: rollups.rows.map(withRates),
+        departments: [...group('department')].map(([department, rows]) => ({
+            department, members: memberCounts.get(department) || 0, ...sumRollups(rows)
+        })),
+        courses: [...group('courseId')].map(([courseId, rows]) => ({
+            courseId, courseTitle: rows[0].courseTitle, ...sumRollups(rows)
+        })),
+        total: sumRollups(rollups.rows)
+    };
+}
+
+// 集計と学習記録から計算し直した値の差分（一致していれば空配列）
+async function verifyRollups() {
+    const result = await pool.query(`
+        WITH stats AS (
+            SELECT COALESCE(lr.user_id, 0) AS user_id, COALESCE(lr.course_id, 0) AS course_id,
+                   COALESCE(MAX(u.department), '') AS department,
+                   COUNT(*) AS attempts, COUNT(*) FILTER (WHERE lr.passed) AS passes, SUM(lr.score) AS score_sum
+            FROM learning_records lr
+            LEFT JOIN users u ON u.id = lr.user_id
+            GROUP BY 1, 2
+        ), live AS (
+            SELECT department, course_id, SUM(attempts)::int AS attempts, SUM(passes)::int AS passes,
+                   SUM(score_sum)::bigint AS score_sum, COUNT(*)::int AS learners,
+                   (COUNT(*) FILTER (WHERE passes > 0))::int AS completed_learners
+            FROM stats
+            GROUP BY department, course_id
+        )
+        SELECT COALESCE(l.department, r.department) AS department,
+               COALESCE(l.course_id, r.course_id) AS "courseId",
+               CASE WHEN l.course_id IS NULL THEN NULL ELSE
+                   jsonb_build_object('attempts', l.attempts, 'passed', l.passes, 'scoreSum', l.score_sum,
+                                      'learners', l.learners, 'completedLearners', l.completed_learners) END AS live,
+               CASE WHEN r.course_id IS NULL THEN NULL ELSE
+                   jsonb_build_object('attempts', r.attempts, 'passed', r.passes, 'scoreSum', r.score_sum,
+                                      'learners', r.learners, 'completedLearners', r.completed_learners) END AS stored
+        FROM live l
+        FULL JOIN course_rollups r ON r.department = l.department AND r.course_id = l.course_id
+        WHERE (l.attempts, l.passes, l.score_sum, l.learners, l.completed_learners)
+              IS DISTINCT FROM (r.attempts, r.passes, r.score_sum, r.learners, r.completed_learners)
+        ORDER BY 1, 2
+    `);
+    return result.rows;
+}
+
+// 集計を学習記録から作り直す
+async function rebuildRollups() {
+    const client = await pool.connect();
+    try {
+        await client.query('BEGIN');
+        // 全件の再集計は PG_STATEMENT_TIMEOUT_MS の対象外
+        await client.query('SET LOCAL statement_timeout = 0');
+        await client.query('SELECT rebuild_course_rollups()');
+        const count = await client.query('SELECT COUNT(*)::int AS count FROM course_rollups');
+        await client.query('COMMIT');
+        return count.rows[0].count;
+    } catch (error) {
+        await client.query('ROLLBACK');
+        throw error;
+    } finally {
+        client.release();
+    }
+}
+
 // データエクスポート（既存のJSON形式互換）
-async function exportData() {
+async function exportData({ lazySlides = false } = {}) {
     const users = await getUsers();
-    const courses = await getCourses();
+    const courses = lazySlides ? await getCoursesWithoutSlides() : await getCourses();
     const learningRecords = await getLearningRecords();
+    const revision = await getRevision();
     
     return {
         users,
         courses,
         learningRecords,
+        revision,
         lastUpdated: new Date().toISOString()
     };
 }
 
+// データのリビジョン（差分保存の競合検出用）
+async function getRevision(client = pool) {
+    const result = await client.query('SELECT revision FROM data_revision WHERE id = 1');
+    return result.rows[0] ? Number(result.rows[0].revision) : 0;
+}
+
+// /api/data の ETag（リビジョン + 変更カウンタ）
+// version は data_version_slots（migrations.js）の合計で、コミット済みの変更だけを数える
+async function getDataTag(client = pool) {
+    const result = await client.query(`
+        SELECT (SELECT revision FROM data_revision WHERE id = 1) AS revision,
+               (SELECT SUM(version) FROM data_version_slots) AS version
+    `);
+    const row = result.rows[0] || {};
+    return `${row.revision || 0}.${row.version || 0}`;
+}
+
+class RevisionConflict extends Error {
+    constructor(revision) {
+        super('revision conflict');
+        this.revision = revision;
+    }
+}
+
+// 差分保存で扱うコレクション（update は $1 = id、insert は id なし）
+const PATCH_TABLES = {
+    users: {
+        table: 'users',
+        update: 'UPDATE users SET username = $2, password = $3, name = $4, email = $5, role = $6, department = $7, updated_at = CURRENT_TIMESTAMP WHERE id = $1',
+        insert: 'INSERT INTO users (username, password, name, email, role, department) VALUES ($1, $2, $3, $4, $5, $6) RETURNING id',
+        values: user => [user.username, user.password, user.name, user.email, user.role || 'user', user.department]
+    },
+    courses: {
+        table: 'courses',
+        // slides が null（?slides=lazy で読み込んだコース）の場合は画像を保持する
+        update: 'UPDATE courses SET title = $2, description = $3, slides = COALESCE($4, slides), quiz = $5, passing_score = $6, updated_at = CURRENT_TIMESTAMP WHERE id = $1',
+        insert: "INSERT INTO courses (title, description, slides, quiz, passing_score) VALUES ($1, $2, COALESCE($3, '[]'::jsonb), $4, $5) RETURNING id",
+        values: course => {
+            const slides = course.slideImages || course.slides || [];
+            const lazy = course.slideCount > 0 && slides.length === 0;
+            return [course.title, course.description, lazy ? null : JSON.stringify(slides),
+                JSON.stringify(course.quiz || []), course.passing_score || 70];
+        }
+    },
+    learningRecords: {
+        table: 'learning_records',
+        // 同じパッチで追加されたユーザー・コース（クライアント側のID）を参照する列
+        references: { userId: 'users', user_id: 'users', courseId: 'courses', course_id: 'courses' },
+        update: 'UPDATE learning_records SET user_id = $2, course_id = $3, score = $4, passed = $5, answers = $6, time_spent = $7, completed_at = $8 WHERE id = $1',
+        insert: 'INSERT INTO learning_records (user_id, course_id, score, passed, answers, time_spent, completed_at) VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id',
+        values: record => [record.userId || record.user_id, record.courseId || record.course_id, record.score, record.passed,
+            JSON.stringify(record.answers || []), record.timeSpent || record.time_spent || 0,
+            record.completedAt || record.completed_at || new Date()]
+    }
+};
+
+const MAX_SERIAL = 2147483647;
+
+// references の列がこのパッチで採番されたレコードを指していれば、採番されたIDに付け替える
+// assigned: コレクション → Map(クライアント側のID（文字列） → 採番されたID)
+function remapReferences(record, references, assigned) {
+    let remapped = record;
+    for (const [field, collection] of Object.entries(references)) {
+        const value = record[field];
+        const map = assigned[collection];
+        if (value === undefined || value === null || !map || !map.has(String(value))) continue;
+        if (remapped === record) remapped = { ...record };
+        remapped[field] = map.get(String(value));
+    }
+    return remapped;
+}
+
+// 変更されたレコードだけを1トランザクションで反映する
+// 戻り値: { revision, ids }（ids はクライアント側のID → 採番されたID）
+// コレクションは PATCH_TABLES の順（users, courses, learningRecords）に反映し、同じパッチで
+// 追加したユーザー・コースを参照する学習記録は採番されたIDで追加する
+async function applyDataPatch(baseRevision, changes) {
+    const client = await pool.connect();
+    
+    try {
+        await client.query('BEGIN');
+        const locked = await client.query('SELECT revision FROM data_revision WHERE id = 1 FOR UPDATE');
+        const revision = locked.rows[0] ? Number(locked.rows[0].revision) : 0;
+        if (baseRevision !== revision) {
+            throw new RevisionConflict(revision);
+        }
+        
+        const ids = {};
+        const assigned = {};
+        for (const [name, spec] of Object.entries(PATCH_TABLES)) {
+            const change = changes[name];
+            if (!change) continue;
+            
+            const removed = (change.delete || [])
+                .map(id => Number(id))
+                .filter(id => Number.isInteger(id) && id > 0 && id <= MAX_SERIAL);
+            if (removed.length > 0) {
+                await client.query(`DELETE FROM ${spec.table} WHERE id = ANY($1::int[])`, [removed]);
+            }
+            
+            for (const original of change.upsert || []) {
+                const record = spec.references ? remapReferences(original, spec.references, assigned) : original;
+                const values = spec.values(record);
+                const id = Number(record.id);
+                if (Number.isInteger(id) && id > 0 && id <= MAX_SERIAL) {
+                    const updated = await client.query(spec.update, [id, ...values]);
+                    if (updated.rowCount > 0) continue;
+                }
+                // クライアントで採番されたID（Date.now() など）は新規行として追加
+                const inserted = await client.query(spec.insert, values);
+                if (record.id !== undefined && record.id !== null) {
+                    (ids[name] = ids[name] || []).push([record.id, inserted.rows[0].id]);
+                    (assigned[name] = assigned[name] || new Map()).set(String(record.id), inserted.rows[0].id);
+                }
+            }
+        }
+        
+        const next = await client.query(
+            'UPDATE data_revision SET revision = revision + 1 WHERE id = 1 RETURNING revision'
+        );
+        await client.query('COMMIT');
+        const courses = changes.courses || {};
+        for (const course of [...(courses.upsert || []), ...(courses.delete || []).map(id => ({ id }))]) {
+            invalidateCourse(Number(course.id));
+        }
+        return { revision: Number(next.rows[0].revision), ids };
+        
+    } catch (error) {
+        await client.query('ROLLBACK');
+        throw error;
+    } finally {
+        client.release();
+    }
+}
+
 // データインポート（既存のJSON形式互換）
 async function importData(data) {
     const client = await pool.connect();
     
     try {
         await client.query('BEGIN');
+        // 全件の入れ替えは PG_STATEMENT_TIMEOUT_MS の対象外
+        await client.query('SET LOCAL statement_timeout = 0');
         
         // 既存データをクリア
         await client.query('TRUNCATE users, courses, learning_records, progress RESTART IDENTITY CASCADE');
@@ -361,8 +927,8 @@ async function importData(data) {
         if (data.users && data.users.length > 0) {
             for (const user of data.users) {
                 await client.query(
-                    'INSERT INTO users (username, password, name, email, role, department) VALUES ($1, $2, $3, $4, $5, $6)',
-                    [user.username, user.password, user.name, user.email, user.role || 'user', user.department]
+                    'INSERT INTO users (username, password, name, email, role, department, active) VALUES ($1, $2, $3, $4, $5, $6, $7)',
+                    [user.username, user.password, user.name, user.email, user.role || 'user', user.department, user.active !== false]
                 );
             }
         }
@@ -387,7 +953,9 @@ async function importData(data) {
             }
         }
         
+        await client.query('UPDATE data_revision SET revision = revision + 1 WHERE id = 1');
         await client.query('COMMIT');
+        courseCache.clear();
         return true;
         
     } catch (error) {
@@ -410,16 +978,33 @@ module.exports = {
     deleteUser,
     getCourses,
     getCourseById,
+    getCourseSummaries,
+    getCoursesWithoutSlides,
+    getCourseSlide,
+    getCourseCacheStats,
     createCourse,
     updateCourse,
     deleteCourse,
     getLearningRecords,
     getLearningRecordsByUserId,
+    getLearningRecordsPage,
+    getLearningRecordTotals,
     createLearningRecord,
     getProgress,
     saveProgress,
+    saveProgressBatch,
     deleteProgress,
     cleanupExpiredProgress,
+    dedupeLearningRecords,
+    deleteLearningRecords,
+    getCompletionDashboard,
+    verifyRollups,
+    rebuildRollups,
     exportData,
-    importData
+    importData,
+    getRevision,
+    getDataTag,
+    applyDataPatch,
+    RevisionConflict,
+    metrics
 };
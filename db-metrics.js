@@ -0,0 +1,247 @@
+// データベース接続プールとクエリの計測（database.js の pg Pool 用）
+//
+// pool.query / pool.connect を包み、クエリ（SQL を正規化した名前）ごとの所要時間の
+// ヒストグラム、接続プールの待ち時間、使用中・待機中の接続数、遅いクエリの直近の
+// 記録を集めます。/api/metrics（server-postgres.js）で JSON として返します。
+// パラメーターの値（パスワードなど）は記録しません。
+
+// ヒストグラムの区切り（ミリ秒）。最後の区切りを超えたものは +Inf に入る
+const BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000];
+
+// 記録するクエリ名の上限（超えた分は OTHER_QUERY にまとめる）
+const MAX_QUERY_NAMES = 200;
+const OTHER_QUERY = '(other)';
+const MAX_NAME_LENGTH = 120;
+
+const SLOW_SAMPLES = 20;
+
+const INSTRUMENTED = Symbol('dbMetricsInstrumented');
+
+function elapsedMs(started) {
+    return Number(process.hrtime.bigint() - started) / 1e6;
+}
+
+class Histogram {
+    constructor() {
+        this.counts = new Array(BUCKETS_MS.length + 1).fill(0);
+        this.count = 0;
+        this.totalMs = 0;
+        this.maxMs = 0;
+    }
+
+    observe(ms) {
+        let index = BUCKETS_MS.findIndex(bound => ms <= bound);
+        if (index < 0) index = BUCKETS_MS.length;
+        this.counts[index]++;
+        this.count++;
+        this.totalMs += ms;
+        if (ms > this.maxMs) this.maxMs = ms;
+    }
+
+    // 区切りの上限で近似したパーセンタイル
+    percentile(p) {
+        if (!this.count) return null;
+        const rank = Math.ceil(this.count * p / 100);
+        let seen = 0;
+        for (let i = 0; i < this.counts.length; i++) {
+            seen += this.counts[i];
+            if (seen >= rank) return round(i < BUCKETS_MS.length ? Math.min(BUCKETS_MS[i], this.maxMs) : this.maxMs);
+        }
+        return round(this.maxMs);
+    }
+
+    toJSON() {
+        const buckets = {};
+        BUCKETS_MS.forEach((bound, i) => { buckets[`le_${bound}`] = this.counts[i]; });
+        buckets.le_inf = this.counts[BUCKETS_MS.length];
+        return {
+            count: this.count,
+            avgMs: this.count ? round(this.totalMs / this.count) : null,
+            p50Ms: this.percentile(50),
+            p95Ms: this.percentile(95),
+            p99Ms: this.percentile(99),
+            maxMs: round(this.maxMs),
+            buckets
+        };
+    }
+}
+
+function round(ms) {
+    return Math.round(ms * 100) / 100;
+}
+
+// SQL をクエリ名にする（空白をまとめ、複数行 VALUES のプレースホルダーを省略）
+function queryName(query) {
+    const text = typeof query === 'string' ? query : query && query.text;
+    if (typeof text !== 'string') return OTHER_QUERY;
+    const name = text
+        .replace(/\s+/g, ' ')
+        .trim()
+        .replace(/\$\d+/g, '?')
+        .replace(/(\((?:[?, ]|::\w+)+\))(?:, \((?:[?, ]|::\w+)+\))+/g, '$1, …');
+    return name.length > MAX_NAME_LENGTH ? name.slice(0, MAX_NAME_LENGTH - 1) + '…' : name;
+}
+
+class PoolMetrics {
+    constructor(pool, options = {}) {
+        this.pool = pool;
+        this.slowQueryMs = options.slowQueryMs || 200;
+        this.config = options.config || {};
+        this.reset();
+    }
+
+    reset() {
+        this.startedAt = new Date();
+        this.queries = new Map();
+        this.wait = new Histogram();
+        this.connectErrors = 0;
+        this.maxWaiting = 0;
+        this.maxActive = 0;
+        this.slow = [];
+    }
+
+    entry(name) {
+        let entry = this.queries.get(name);
+        if (!entry) {
+            if (this.queries.size >= MAX_QUERY_NAMES) {
+                return this.entry(OTHER_QUERY);
+            }
+            entry = { latency: new Histogram(), errors: 0, timeouts: 0 };
+            this.queries.set(name, entry);
+        }
+        return entry;
+    }
+
+    // 接続の取得待ち（waiting は取得を始めた時点の待ち行列）
+    recordWait(ms, waiting, error) {
+        this.wait.observe(ms);
+        if (error) this.connectErrors++;
+        this.maxWaiting = Math.max(this.maxWaiting, waiting);
+        this.maxActive = Math.max(this.maxActive, this.pool.totalCount - this.pool.idleCount);
+    }
+
+    recordQuery(query, ms, error) {
+        const name = queryName(query);
+        const entry = this.entry(name);
+        entry.latency.observe(ms);
+        if (error) {
+            entry.errors++;
+            // 57014: statement_timeout などによるキャンセル
+            if (error.code === '57014') entry.timeouts++;
+        }
+        if (ms >= this.slowQueryMs) {
+            this.slow.push({ name, ms: round(ms), at: new Date().toISOString(), error: error ? error.code || error.message : undefined });
+            if (this.slow.length > SLOW_SAMPLES) this.slow.shift();
+        }
+    }
+
+    // 集計から設定の目安を出す
+    advice(wait, queries) {
+        const advice = [];
+        const max = this.config.max;
+        if (this.maxWaiting > 0 && wait.p95Ms !== null && wait.p95Ms >= 50) {
+            advice.push(`接続待ちの p95 が ${wait.p95Ms}ms（最大待ち ${this.maxWaiting} 件）です。` +
+                `PG_POOL_MAX（現在 ${max}）を増やすか、遅いクエリを減らしてください`);
+        } else if (this.maxActive > 0 && max && this.maxActive < max / 2 && this.wait.count > 100) {
+            advice.push(`同時使用は最大 ${this.maxActive} 接続です。PG_POOL_MAX（現在 ${max}）は減らせます`);
+        }
+        const p99 = Math.max(0, ...queries.map(q => q.p99Ms || 0));
+        const timeout = this.config.statementTimeoutMs;
+        if (!timeout && p99 > 0) {
+            advice.push(`PG_STATEMENT_TIMEOUT_MS が未設定です（全クエリの p99 最大 ${p99}ms）。` +
+                `目安: ${Math.max(1000, Math.ceil(p99 * 5 / 1000) * 1000)}ms`);
+        }
+        const timeouts = queries.reduce((sum, q) => sum + q.timeouts, 0);
+        if (timeouts) {
+            advice.push(`statement_timeout で ${timeouts} 件のクエリが中断されました（PG_STATEMENT_TIMEOUT_MS: ${timeout}ms）`);
+        }
+        return advice;
+    }
+
+    snapshot() {
+        const queries = [...this.queries].map(([name, entry]) => ({
+            name,
+            errors: entry.errors,
+            timeouts: entry.timeouts,
+            ...entry.latency.toJSON()
+        })).sort((a, b) => b.avgMs * b.count - a.avgMs * a.count);
+        const wait = this.wait.toJSON();
+        return {
+            since: this.startedAt.toISOString(),
+            config: this.config,
+            pool: {
+                total: this.pool.totalCount,
+                active: this.pool.totalCount - this.pool.idleCount,
+                idle: this.pool.idleCount,
+                waiting: this.pool.waitingCount,
+                maxActive: this.maxActive,
+                maxWaiting: this.maxWaiting,
+                connectErrors: this.connectErrors
+            },
+            wait,
+            queries,
+            slowQueries: [...this.slow].reverse(),
+            advice: this.advice(wait, queries)
+        };
+    }
+}
+
+// client.query を包む（pool.connect で取得した接続・トランザクション内のクエリも計測する）
+function instrumentClient(client, metrics) {
+    if (client[INSTRUMENTED]) return client;
+    const query = client.query;
+    client.query = function (...args) {
+        const started = process.hrtime.bigint();
+        const result = query.apply(this, args);
+        // カーソルなど Promise を返さない呼び出しはそのまま
+        if (!result || typeof result.then !== 'function') return result;
+        return result.then(
+            value => { metrics.recordQuery(args[0], elapsedMs(started)); return value; },
+            error => { metrics.recordQuery(args[0], elapsedMs(started), error); throw error; }
+        );
+    };
+    client[INSTRUMENTED] = true;
+    return client;
+}
+
+// pool.query / pool.connect を計測付きに置き換え、PoolMetrics を返す
+function instrumentPool(pool, options = {}) {
+    const metrics = new PoolMetrics(pool, options);
+    const connect = pool.connect.bind(pool);
+    const originalQuery = pool.query.bind(pool);
+
+    pool.connect = function (callback) {
+        const started = process.hrtime.bigint();
+        const waiting = pool.waitingCount;
+        if (typeof callback === 'function') {
+            return connect((error, client, done) => {
+                metrics.recordWait(elapsedMs(started), waiting, error);
+                callback(error, client && instrumentClient(client, metrics), done);
+            });
+        }
+        return connect().then(
+            client => { metrics.recordWait(elapsedMs(started), waiting); return instrumentClient(client, metrics); },
+            error => { metrics.recordWait(elapsedMs(started), waiting, error); throw error; }
+        );
+    };
+
+    // pg の Pool#query と同じく、1クエリごとに接続を借りて返す（エラー時は接続を破棄）
+    pool.query = async function (text, values) {
+        if (typeof values === 'function' || arguments.length > 2) {
+            return originalQuery(...arguments);
+        }
+        const client = await pool.connect();
+        try {
+            const result = await client.query(text, values);
+            client.release();
+            return result;
+        } catch (error) {
+            client.release(error);
+            throw error;
+        }
+    };
+
+    return metrics;
+}
+
+module.exports = { instrumentPool, queryName, Histogram, BUCKETS_MS };
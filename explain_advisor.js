@@ -0,0 +1,211 @@
+// クエリの実行計画チェック（インデックスアドバイザー）
+//
+// database.js の主な関数を1つのトランザクション内で実際に呼び出し、発行された
+// クエリごとに EXPLAIN (ANALYZE, BUFFERS) を実行して、大きな Seq Scan（全件走査）と
+// Sort（並べ替え）を指摘します。最後に ROLLBACK するので、書き込み系の関数や
+// --seed の合成データはデータベースに残りません。
+//
+// 使用方法:
+//     node explain_advisor.js                     # 既存データで確認
+//     node explain_advisor.js --seed 200000       # 学習記録20万件を仮に追加して確認
+//     node explain_advisor.js --min-rows 100      # 指摘する行数のしきい値
+//
+// 接続先は環境変数 DATABASE_URL です。実行計画の計測でクエリを実際に実行するため、
+// ローカルの PostgreSQL 以外では --allow-remote が必要です。
+
+require('dotenv').config();
+const db = require('./database');
+
+// 確認する関数（s は既存データから選んだサンプルの ID）
+const SCENARIOS = [
+    { name: 'getUsers', run: () => db.getUsers() },
+    { name: 'getUserByUsername', run: s => db.getUserByUsername(s.username) },
+    { name: 'getCourses', run: () => db.getCourses() },
+    { name: 'getCourseSummaries', run: () => db.getCourseSummaries() },
+    { name: 'getCoursesWithoutSlides', run: () => db.getCoursesWithoutSlides() },
+    { name: 'getCourseById', run: s => db.getCourseById(s.courseId) },
+    { name: 'getCourseSlide', run: s => db.getCourseSlide(s.courseId, 0) },
+    { name: 'getLearningRecords', run: () => db.getLearningRecords() },
+    { name: 'getLearningRecordsByUserId', run: s => db.getLearningRecordsByUserId(s.userId) },
+    { name: 'createLearningRecord', run: s => db.createLearningRecord({ user_id: s.userId, course_id: s.courseId, score: 8, passed: true }) },
+    { name: 'getProgress', run: s => db.getProgress(s.userId, s.courseId) },
+    { name: 'saveProgressBatch', run: s => db.saveProgressBatch([{ userId: s.userId, courseId: s.courseId, slideIndex: 1 }]) },
+    { name: 'deleteProgress', run: s => db.deleteProgress(s.userId, s.courseId) },
+    { name: 'cleanupExpiredProgress', run: () => db.cleanupExpiredProgress() },
+    { name: 'getDataTag', run: () => db.getDataTag() }
+];
+
+function parseArgs(argv) {
+    const options = { seed: 0, minRows: 1000, allowRemote: false };
+    for (let i = 0; i < argv.length; i++) {
+        if (argv[i] === '--seed') {
+            options.seed = Number(argv[++i]);
+        } else if (argv[i] === '--min-rows') {
+            options.minRows = Number(argv[++i]);
+        } else if (argv[i] === '--allow-remote') {
+            options.allowRemote = true;
+        } else {
+            console.error(`❌ エラー: 不明な引数 ${argv[i]}`);
+            process.exit(1);
+        }
+    }
+    return options;
+}
+
+function isLocal(url) {
+    if (!url) return true;
+    try {
+        return ['', 'localhost', '127.0.0.1', '[::1]'].includes(new URL(url).hostname);
+    } catch (error) {
+        return false;
+    }
+}
+
+// 合成データ（学習記録 records 件、ユーザー・コース・進捗はそれに比例）
+async function seed(client, records) {
+    const users = Math.max(100, Math.floor(records / 50));
+    await client.query(`
+        INSERT INTO users (username, password, name, email, role, department)
+        SELECT 'advisor_' || g, 'advisor', 'ユーザー' || g, 'advisor_' || g || '@example.invalid', 'user', '部署' || (g % 10)
+        FROM generate_series(1, $1) g
+    `, [users]);
+    await client.query(`
+        INSERT INTO courses (title, description, slides, quiz)
+        SELECT 'アドバイザー用コース' || g, '', '[]'::jsonb,
+               (SELECT jsonb_agg(jsonb_build_object('question', '問題' || q, 'options', '["A","B","C","D"]'::jsonb, 'correct', 0))
+                FROM generate_series(1, 10) q)
+        FROM generate_series(1, 5) g
+    `);
+    await client.query(`
+        WITH u AS (SELECT array_agg(id) AS ids FROM users), c AS (SELECT array_agg(id) AS ids FROM courses)
+        INSERT INTO learning_records (user_id, course_id, score, passed, completed_at, answers)
+        SELECT u.ids[1 + g % cardinality(u.ids)], c.ids[1 + (g / 7) % cardinality(c.ids)],
+               g % 11, g % 11 >= 7, CURRENT_TIMESTAMP - g * INTERVAL '1 minute', '[]'::jsonb
+        FROM generate_series(1, $1) g, u, c
+    `, [records]);
+    await client.query(`
+        WITH u AS (SELECT array_agg(id) AS ids FROM users), c AS (SELECT array_agg(id) AS ids FROM courses)
+        INSERT INTO progress (user_id, course_id, current_slide, expires_at)
+        SELECT u.ids[1 + g % cardinality(u.ids)], c.ids[1 + (g / cardinality(u.ids)) % cardinality(c.ids)], g % 20,
+               CASE WHEN g % 2 = 0 THEN CURRENT_TIMESTAMP + (g % 48 - 24) * INTERVAL '1 hour' END
+        FROM generate_series(1, $1) g, u, c
+        ON CONFLICT (user_id, course_id) DO NOTHING
+    `, [Math.floor(records / 10)]);
+    await client.query('ANALYZE users, courses, learning_records, progress');
+}
+
+// 実行計画から大きな Seq Scan と Sort を探す
+function findIssues(node, minRows, issues = []) {
+    const loops = node['Actual Loops'] || 1;
+    const rows = (node['Actual Rows'] || 0) * loops;
+    if (node['Node Type'] === 'Seq Scan') {
+        const scanned = rows + (node['Rows Removed by Filter'] || 0) * loops;
+        if (scanned >= minRows) {
+            issues.push(`Seq Scan on ${node['Relation Name']}: ${scanned.toLocaleString()} 行を走査` +
+                (node.Filter ? `（Filter: ${node.Filter}）` : ''));
+        }
+    } else if (node['Node Type'] === 'Sort' || node['Node Type'] === 'Incremental Sort') {
+        const disk = node['Sort Space Type'] === 'Disk';
+        if (rows >= minRows || disk) {
+            issues.push(`Sort (${(node['Sort Key'] || []).join(', ')}): ${rows.toLocaleString()} 行, ` +
+                `${node['Sort Method']} ${node['Sort Space Used']}kB${disk ? '（ディスク使用）' : ''}`);
+        }
+    }
+    for (const child of node.Plans || []) {
+        findIssues(child, minRows, issues);
+    }
+    return issues;
+}
+
+function summarizeSql(sql) {
+    return sql.replace(/\s+/g, ' ').trim().slice(0, 100);
+}
+
+async function explain(client, sql, params) {
+    await client.query('SAVEPOINT advisor_explain');
+    try {
+        const result = await client.query(`EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ${sql}`, params);
+        return result.rows[0]['QUERY PLAN'][0];
+    } finally {
+        await client.query('ROLLBACK TO SAVEPOINT advisor_explain');
+    }
+}
+
+async function main() {
+    const options = parseArgs(process.argv.slice(2));
+    if (!options.allowRemote && !isLocal(process.env.DATABASE_URL)) {
+        console.error('❌ エラー: DATABASE_URL がローカルではありません（実行する場合は --allow-remote）');
+        process.exit(1);
+    }
+
+    const client = await db.pool.connect();
+    const originalQuery = db.pool.query;
+    let flagged = 0;
+    try {
+        await client.query('BEGIN');
+        if (options.seed > 0) {
+            console.log(`🌱 合成データを追加しています（学習記録 ${options.seed.toLocaleString()} 件、終了時に取り消し）...`);
+            await seed(client, options.seed);
+        }
+
+        // 学習記録の最も多いユーザー（なければ先頭のユーザー）をサンプルにする
+        const sample = (await client.query(`
+            WITH busiest AS (
+                SELECT COALESCE(
+                    (SELECT user_id FROM learning_records GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1),
+                    (SELECT id FROM users ORDER BY id LIMIT 1)
+                ) AS id
+            )
+            SELECT u.id AS "userId", u.username,
+                   (SELECT id FROM courses ORDER BY id LIMIT 1) AS "courseId"
+            FROM busiest JOIN users u ON u.id = busiest.id
+        `)).rows[0] || {};
+
+        // database.js の pool.query を同じトランザクションの client に向け、発行されたクエリを記録する
+        let captured = [];
+        db.pool.query = (sql, params) => {
+            captured.push({ sql, params });
+            return client.query(sql, params);
+        };
+
+        for (const scenario of SCENARIOS) {
+            console.log(`\n🔍 ${scenario.name}`);
+            captured = [];
+            await client.query('SAVEPOINT advisor_scenario');
+            try {
+                await scenario.run(sample);
+            } catch (error) {
+                await client.query('ROLLBACK TO SAVEPOINT advisor_scenario');
+                console.log(`  ⚠️ 実行できませんでした: ${error.message}`);
+                continue;
+            }
+            for (const { sql, params } of captured) {
+                const plan = await explain(client, sql, params);
+                const top = plan.Plan;
+                const issues = findIssues(top, options.minRows);
+                const buffers = `shared hit ${top['Shared Hit Blocks'] || 0} / read ${top['Shared Read Blocks'] || 0}`;
+                console.log(`  ${issues.length ? '⚠️' : '✅'} ${plan['Execution Time'].toFixed(2)}ms  ${buffers}  ${summarizeSql(sql)}`);
+                for (const issue of issues) {
+                    console.log(`      - ${issue}`);
+                }
+                if (issues.length) flagged++;
+            }
+        }
+    } finally {
+        db.pool.query = originalQuery;
+        await client.query('ROLLBACK');
+        client.release();
+    }
+
+    console.log(`\n📊 指摘のあるクエリ: ${flagged} 件（しきい値 ${options.minRows.toLocaleString()} 行）`);
+    if (flagged) {
+        console.log('   インデックスの追加は migrations.js に新しいマイグレーションとして追記してください');
+    }
+}
+
+main()
+    .catch(error => {
+        console.error('❌ エラー:', error);
+        process.exitCode = 1;
+    })
+    .finally(() => db.pool.end());
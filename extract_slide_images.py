@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+スライド画像（base64 データURI）の抽出ツール
+
+index.html や /api/export のJSONに埋め込まれた data:image/...;base64,... を
+デコードしてコンテンツハッシュ名で public/slides/ に保存し、参照を
+/slides/<先頭2桁>/<sha256>.<拡張子> に書き換えます。同じ画像はコース間・バックアップ間で
+1つのファイルにまとめられます。/slides は server-postgres.js / server.js で
+immutable キャッシュ付きで配信されます。
+
+使用方法:
+    python3 extract_slide_images.py public/index.html backup.json
+    python3 extract_slide_images.py 'public/index.html.backup.*' --dry-run
+    python3 extract_slide_images.py --inline bundle.html -o bundle_offline.html   # 逆変換
+
+--inline は /slides/... の参照をデータURIに戻します（オフライン配布用）。
+入力はメモリマップで読み、出力は一時ファイル経由で書き込みます。
+"""
+
+import argparse
+import base64
+import binascii
+import glob
+import hashlib
+import mmap
+import os
+import re
+import sys
+
+from cli_common import atomic_output
+
+STORE_DIR = os.path.join('public', 'slides')
+URL_PREFIX = '/slides/'
+COPY_CHUNK = 1024 * 1024
+
+DATA_URI = re.compile(rb'data:(image/[A-Za-z0-9.+-]+);base64,([A-Za-z0-9+/]+={0,2})')
+SLIDE_URL = re.compile(rb'/slides/[0-9a-f]{2}/([0-9a-f]{64})\.([a-z0-9]+)')
+
+EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/svg+xml': 'svg',
+    'image/bmp': 'bmp',
+    'image/x-emf': 'emf',
+    'image/x-wmf': 'wmf',
+}
+MIME_TYPES = {ext: mime for mime, ext in EXTENSIONS.items() if mime != 'image/jpg'}
+
+
+def store_path(store, digest, ext):
+    return os.path.join(store, digest[:2], f'{digest}.{ext}')
+
+
+def slide_url(digest, ext):
+    """store_path と同じ階層の配信URL（/slides は public/slides を配信）"""
+    return f'{URL_PREFIX}{digest[:2]}/{digest}.{ext}'
+
+
+def save_image(store, data, ext, stats):
+    """内容のSHA-256で保存し、ファイル名のハッシュを返す（既存ならスキップ）"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = store_path(store, digest, ext)
+    if os.path.exists(path):
+        stats['deduplicated'] += 1
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_output(path) as f:
+            f.write(data)
+        stats['stored'] += 1
+        stats['stored_bytes'] += len(data)
+    return digest
+
+
+def _rewrite(input_file, output_file, pattern, replace, dry_run):
+    """pattern の一致箇所を replace(match) で置き換えながらストリーム出力する"""
+    if os.path.getsize(input_file) == 0:
+        return 0, 0
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        if dry_run:
+            for m in pattern.finditer(mm):
+                replace(m)
+            return size, size
+        with atomic_output(output_file) as out:
+            view = memoryview(mm)
+            try:
+                pos = 0
+                for m in pattern.finditer(mm):
+                    replacement = replace(m)
+                    for chunk in range(pos, m.start(), COPY_CHUNK):
+                        out.write(view[chunk:min(m.start(), chunk + COPY_CHUNK)])
+                    out.write(replacement)
+                    pos = m.end()
+                for chunk in range(pos, size, COPY_CHUNK):
+                    out.write(view[chunk:min(size, chunk + COPY_CHUNK)])
+            finally:
+                view.release()
+            return size, out.tell()
+
+
+def extract_file(input_file, output_file, store, min_bytes, dry_run, stats):
+    """データURIをストアに移し、参照を /slides/... に書き換える"""
+    def replace(m):
+        mime = m.group(1).decode('ascii').lower()
+        encoded = m.group(2)
+        ext = EXTENSIONS.get(mime)
+        if ext is None or len(encoded) < min_bytes:
+            stats['skipped'] += 1
+            return m.group(0)
+        try:
+            data = base64.b64decode(encoded, validate=True)
+        except binascii.Error:
+            stats['skipped'] += 1
+            return m.group(0)
+        stats['found'] += 1
+        stats['inline_bytes'] += len(m.group(0))
+        stats['decoded_bytes'] += len(data)
+        if dry_run:
+            return m.group(0)
+        digest = save_image(store, data, ext, stats)
+        return slide_url(digest, ext).encode('ascii')
+
+    return _rewrite(input_file, output_file, DATA_URI, replace, dry_run)
+
+
+def inline_file(input_file, output_file, store, dry_run, stats):
+    """/slides/.../<sha256>.<拡張子> の参照をデータURIに戻す（オフライン配布用）"""
+    cache = {}
+
+    def replace(m):
+        digest = m.group(1).decode('ascii')
+        ext = m.group(2).decode('ascii')
+        key = (digest, ext)
+        if key not in cache:
+            path = store_path(store, digest, ext)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                print(f"⚠️ 画像が見つかりません: {path}")
+                stats['missing'] += 1
+                return m.group(0)
+            mime = MIME_TYPES.get(ext, 'application/octet-stream')
+            cache[key] = f'data:{mime};base64,'.encode('ascii') + base64.b64encode(data)
+        stats['found'] += 1
+        return cache[key]
+
+    return _rewrite(input_file, output_file, SLIDE_URL, replace, dry_run)
+
+
+def expand_inputs(patterns):
+    files = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        files.extend(m for m in matches if os.path.isfile(m))
+    return sorted(set(files))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='埋め込みスライド画像をコンテンツハッシュ名のファイルに抽出します')
+    parser.add_argument('inputs', nargs='+', help='HTML / エクスポートJSON（グロブ可）')
+    parser.add_argument('-o', '--output', help='出力ファイル（入力が1つの場合のみ。既定: 上書き）')
+    parser.add_argument('--store', default=STORE_DIR, help=f'画像の保存先（既定: {STORE_DIR}）')
+    parser.add_argument('--min-bytes', type=int, default=1024,
+                        help='これより短いデータURIは抽出しない（base64文字数, 既定: 1024）')
+    parser.add_argument('--inline', action='store_true', help='逆変換: /slides/... をデータURIに戻す')
+    parser.add_argument('--dry-run', action='store_true', help='書き込まずに集計だけ表示')
+    args = parser.parse_args()
+
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        print("❌ エラー: 対象ファイルが見つかりません")
+        sys.exit(1)
+    if args.output and len(inputs) > 1:
+        print("❌ エラー: --output は入力ファイルが1つの場合のみ指定できます")
+        sys.exit(1)
+
+    stats = {'found': 0, 'skipped': 0, 'stored': 0, 'deduplicated': 0, 'missing': 0,
+             'inline_bytes': 0, 'decoded_bytes': 0, 'stored_bytes': 0}
+    total_in = total_out = 0
+    for input_file in inputs:
+        output_file = args.output or input_file
+        if args.inline:
+            size_in, size_out = inline_file(input_file, output_file, args.store, args.dry_run, stats)
+        else:
+            size_in, size_out = extract_file(input_file, output_file, args.store,
+                                             args.min_bytes, args.dry_run, stats)
+        total_in += size_in
+        total_out += size_out
+        print(f"  {input_file}: {size_in:,} → {size_out:,} bytes")
+
+    print()
+    if args.inline:
+        print(f"✅ {stats['found']} 件の参照をデータURIに戻しました"
+              + (f"（見つからない画像 {stats['missing']} 件）" if stats['missing'] else ''))
+        sys.exit(1 if stats['missing'] else 0)
+
+    prefix = "🔍 （ドライラン）" if args.dry_run else "✅ "
+    print(f"{prefix}データURI {stats['found']} 件（スキップ {stats['skipped']} 件）")
+    if not args.dry_run:
+        print(f"   新規保存 {stats['stored']} 件 / 既存と重複 {stats['deduplicated']} 件"
+              f"（{stats['stored_bytes']:,} bytes → {args.store}）")
+    print(f"   埋め込みサイズ {stats['inline_bytes']:,} bytes / デコード後 {stats['decoded_bytes']:,} bytes")
+    print(f"   入力合計 {total_in:,} → 出力合計 {total_out:,} bytes")
+
+
+if __name__ == '__main__':
+    main()
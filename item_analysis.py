@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+確認テストの設問分析ツール
+
+/api/export 形式の JSON（pg_transfer.py の NDJSON チャンクも可）から学習記録を読み込み、
+コースごとに「記録 × 設問」の列形式の NumPy 配列にまとめて、次の指標をまとめて計算します。
+
+    - 設問ごとの正答率（難易度）と識別力（その設問を除いた正答数との相関、上位・下位27%の差）
+    - 選択肢ごとの回答数（誤答の選択肢の偏り）
+    - 得点分布・合格率・信頼性係数（KR-20）
+    - 所要時間のパーセンタイル
+    - 部署別の受講数・合格率・平均点・設問ごとの正答率
+
+結果は入力ファイル（パス・サイズ・更新時刻）のフィンガープリントごとに
+.cache/item_analysis/ に保存し、同じ入力なら再計算しません。
+
+使用方法:
+    python3 item_analysis.py backup.json.gz                 # 全コースのレポート
+    python3 item_analysis.py chunks/ --course 3             # NDJSON チャンクから、コース3のみ
+    python3 item_analysis.py backup.json --json report.json # 結果を JSON で保存
+    python3 item_analysis.py backup.json --no-cache         # キャッシュを使わず再計算
+    python3 item_analysis.py --benchmark 1000000            # 回答100万行の合成データで計測
+
+numpy が必要です: pip install numpy
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from array import array
+
+from cli_common import Phases, atomic_output
+from pg_transfer import iter_input
+
+# 集計方法を変えたら上げる（古いキャッシュを使わないため）
+ANALYSIS_VERSION = 1
+CACHE_DIR = os.path.join('.cache', 'item_analysis')
+PERCENTILES = [10, 25, 50, 75, 90, 95]
+GROUP_FRACTION = 0.27
+NO_DEPARTMENT = '（部署なし）'
+
+# 設問の注意表示のしきい値
+EASY_THRESHOLD = 0.9
+HARD_THRESHOLD = 0.2
+DISCRIMINATION_THRESHOLD = 0.2
+
+
+def require_numpy():
+    try:
+        import numpy
+    except ImportError:
+        print('❌ エラー: numpy がインストールされていません: pip install numpy')
+        sys.exit(1)
+    return numpy
+
+
+# ===========================================
+# 読み込み（レコード → 列）
+# ===========================================
+
+def parse_answers(answers):
+    """answers を [(選択肢, 正誤)] にする（-1 は未回答・不明）"""
+    if isinstance(answers, dict):
+        # 旧形式: {"0": 1, "1": 3, ...}
+        indexes = [int(key) for key in answers if str(key).isdigit()]
+        answers = [answers.get(str(i)) for i in range(max(indexes) + 1)] if indexes else []
+    parsed = []
+    for answer in answers or []:
+        if isinstance(answer, dict):
+            chosen, correct = answer.get('userAnswer'), answer.get('isCorrect')
+        else:
+            chosen, correct = answer, None
+        if not isinstance(chosen, int) or isinstance(chosen, bool) or not 0 <= chosen < 32768:
+            chosen = -1
+        parsed.append((chosen, -1 if correct is None else int(bool(correct))))
+    return parsed
+
+
+class CourseColumns:
+    """1コース分の学習記録を array で溜める（回答は記録ごとの長さ + 連結した1次元配列）"""
+
+    def __init__(self):
+        self.user_ids = array('q')
+        self.departments = array('i')
+        self.scores = array('i')
+        self.passed = array('b')
+        self.time_spent = array('i')
+        self.lengths = array('i')
+        self.chosen = array('h')
+        self.correct = array('b')
+        self.title = None
+
+    def add(self, record, department):
+        answers = parse_answers(record.get('answers'))
+        self.user_ids.append(int(record.get('userId', record.get('user_id')) or 0))
+        self.departments.append(department)
+        self.scores.append(int(record.get('score') or 0))
+        self.passed.append(1 if record.get('passed') else 0)
+        self.time_spent.append(int(record.get('timeSpent', record.get('time_spent')) or 0))
+        self.lengths.append(len(answers))
+        for chosen, correct in answers:
+            self.chosen.append(chosen)
+            self.correct.append(correct)
+        self.title = self.title or record.get('courseTitle')
+
+
+class Dataset:
+    """エクスポートを1回走査して、コースごとの列を作る"""
+
+    def __init__(self):
+        self.courses = {}
+        self.course_info = {}
+        self.user_departments = {}
+        self.department_codes = {}
+        self.records = 0
+
+    def department_code(self, name):
+        if not name:
+            return -1
+        return self.department_codes.setdefault(name, len(self.department_codes))
+
+    def add(self, key, value):
+        if key == 'users':
+            self.user_departments[value.get('id')] = value.get('department')
+        elif key == 'courses':
+            quiz = value.get('quiz') or []
+            self.course_info[value.get('id')] = {
+                'title': value.get('title'),
+                'key': [q.get('correctAnswer', -1) if isinstance(q, dict) else -1 for q in quiz],
+            }
+        elif key == 'learningRecords':
+            course_id = value.get('courseId', value.get('course_id'))
+            columns = self.courses.get(course_id)
+            if columns is None:
+                columns = self.courses[course_id] = CourseColumns()
+            columns.add(value, self.department_code(value.get('userDept')))
+            self.records += 1
+
+    def load(self, paths):
+        for key, value in iter_input(paths):
+            self.add(key, value)
+        return self
+
+    def department_names(self):
+        names = [None] * len(self.department_codes)
+        for name, code in self.department_codes.items():
+            names[code] = name
+        return names
+
+    def arrays(self, np, course_id):
+        """コースの列を NumPy 配列（記録 × 設問の行列を含む）にする"""
+        columns = self.courses[course_id]
+        info = self.course_info.get(course_id, {})
+        lengths = np.frombuffer(columns.lengths, dtype=np.int32).astype(np.int64)
+        n = len(lengths)
+        key = np.array([k if isinstance(k, int) and not isinstance(k, bool) else -1
+                        for k in info.get('key', [])], dtype=np.int64)
+        width = int(max(lengths.max() if n else 0, len(key)))
+
+        # 連結した回答を (記録, 設問) の位置に散らす
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        rows = np.repeat(np.arange(n), lengths)
+        cols = np.arange(int(lengths.sum())) - np.repeat(offsets, lengths)
+        chosen = np.full((n, width), -1, dtype=np.int16)
+        correct = np.full((n, width), -1, dtype=np.int8)
+        chosen[rows, cols] = np.frombuffer(columns.chosen, dtype=np.int16)
+        correct[rows, cols] = np.frombuffer(columns.correct, dtype=np.int8)
+
+        # 正誤が記録されていない回答はコースの正解と比べる
+        if len(key):
+            key = np.concatenate((key, np.full(width - len(key), -1, dtype=np.int64)))
+            fill = (correct < 0) & (chosen >= 0) & (key >= 0)[None, :]
+            correct[fill] = (chosen == key[None, :])[fill]
+
+        departments = np.frombuffer(columns.departments, dtype=np.int32).copy()
+        user_ids = np.frombuffer(columns.user_ids, dtype=np.int64)
+        missing = departments < 0
+        if missing.any() and self.user_departments:
+            # 学習記録に部署がなければ users から補う（ユーザー単位で1回だけ引く）
+            unique, inverse = np.unique(user_ids[missing], return_inverse=True)
+            codes = np.array([self.department_code(self.user_departments.get(int(u))) for u in unique],
+                             dtype=np.int32)
+            departments[missing] = codes[inverse]
+
+        return {
+            'title': info.get('title') or columns.title,
+            'chosen': chosen,
+            'correct': correct,
+            'scores': np.frombuffer(columns.scores, dtype=np.int32),
+            'passed': np.frombuffer(columns.passed, dtype=np.int8).astype(bool),
+            'time_spent': np.frombuffer(columns.time_spent, dtype=np.int32),
+            'departments': departments,
+        }
+
+
+# ===========================================
+# 集計（ベクトル演算）
+# ===========================================
+
+def clean(value, digits=4):
+    """JSON に書ける値にする（NaN は None）"""
+    if value is None:
+        return None
+    value = float(value)
+    if value != value or value in (float('inf'), float('-inf')):
+        return None
+    return round(value, digits)
+
+
+def item_flags(difficulty, discrimination):
+    flags = []
+    if difficulty is not None and difficulty > EASY_THRESHOLD:
+        flags.append('易しすぎ')
+    if difficulty is not None and difficulty < HARD_THRESHOLD:
+        flags.append('難しすぎ')
+    if discrimination is not None and discrimination < DISCRIMINATION_THRESHOLD:
+        flags.append('識別力が低い')
+    return flags
+
+
+def analyze_course(np, data, department_names):
+    correct = data['correct']
+    n, width = correct.shape
+    mask = correct >= 0
+    x = np.where(mask, correct, 0).astype(np.float64)
+    answered = mask.sum(axis=0)
+    total = x.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        difficulty = x.sum(axis=0) / answered
+
+        # 修正済み項目-合計相関: その設問を除いた正答数との点双列相関
+        rest = (total[:, None] - x) * mask
+        rest_mean = rest.sum(axis=0) / answered
+        covariance = (x * rest).sum(axis=0) / answered - difficulty * rest_mean
+        rest_variance = (rest * rest).sum(axis=0) / answered - rest_mean ** 2
+        discrimination = covariance / np.sqrt(difficulty * (1 - difficulty) * rest_variance)
+
+        # 上位・下位27%の正答率の差
+        upper_lower = np.full(width, np.nan)
+        group = int(round(n * GROUP_FRACTION))
+        if group and n >= 2 * group:
+            order = np.argsort(total, kind='stable')
+            lower, upper = order[:group], order[-group:]
+            upper_lower = (x[upper].sum(axis=0) / mask[upper].sum(axis=0)
+                           - x[lower].sum(axis=0) / mask[lower].sum(axis=0))
+
+        # KR-20（設問が2問以上かつ得点にばらつきがある場合）
+        total_variance = total.var()
+        kr20 = (width / (width - 1) * (1 - np.nansum(difficulty * (1 - difficulty)) / total_variance)
+                if width > 1 and total_variance > 0 else np.nan)
+
+    # 選択肢ごとの回答数: (設問, 選択肢) を1次元の番号にして bincount
+    chosen = data['chosen']
+    valid = chosen >= 0
+    options = int(chosen.max()) + 1 if valid.any() else 0
+    option_counts = np.zeros((width, options), dtype=np.int64)
+    if options:
+        flat = (np.arange(width)[None, :] * options + chosen)[valid]
+        option_counts = np.bincount(flat, minlength=width * options).reshape(width, options)
+
+    scores = np.clip(data['scores'], 0, None)
+    passed = data['passed']
+    times = data['time_spent'][data['time_spent'] > 0]
+    percentiles = np.percentile(times, PERCENTILES) if times.size else [np.nan] * len(PERCENTILES)
+
+    # 部署別: 部署番号 + 1（0 は部署なし）ごとに bincount
+    labels = [NO_DEPARTMENT] + department_names
+    codes = data['departments'].astype(np.int64) + 1
+    groups = len(labels)
+    dept_records = np.bincount(codes, minlength=groups)
+    dept_passed = np.bincount(codes, weights=passed.astype(np.float64), minlength=groups)
+    dept_scores = np.bincount(codes, weights=scores, minlength=groups)
+    cells = (codes[:, None] * width + np.arange(width)[None, :]).ravel()
+    dept_correct = np.bincount(cells, weights=x.ravel(), minlength=groups * width).reshape(groups, width)
+    dept_answered = np.bincount(cells, weights=mask.ravel().astype(np.float64), minlength=groups * width).reshape(groups, width)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dept_difficulty = dept_correct / dept_answered
+
+    items = []
+    for q in range(width):
+        item = {
+            'question': q + 1,
+            'answered': int(answered[q]),
+            'difficulty': clean(difficulty[q]),
+            'discrimination': clean(discrimination[q]),
+            'upperLower': clean(upper_lower[q]),
+            'options': option_counts[q].tolist(),
+        }
+        item['flags'] = item_flags(item['difficulty'], item['discrimination'])
+        items.append(item)
+
+    departments = []
+    for code in np.flatnonzero(dept_records):
+        count = int(dept_records[code])
+        departments.append({
+            'department': labels[code],
+            'records': count,
+            'passRate': clean(dept_passed[code] / count),
+            'meanScore': clean(dept_scores[code] / count, 2),
+            'difficulty': [clean(v) for v in dept_difficulty[code]],
+        })
+    departments.sort(key=lambda d: -d['records'])
+
+    return {
+        'title': data['title'],
+        'records': int(n),
+        'questions': int(width),
+        'answerRows': int(mask.sum()),
+        'meanScore': clean(scores.mean() if n else np.nan, 2),
+        'stdScore': clean(scores.std() if n else np.nan, 2),
+        'passRate': clean(passed.mean() if n else np.nan),
+        'kr20': clean(kr20),
+        'scoreDistribution': np.bincount(scores, minlength=width + 1).tolist() if n else [],
+        'timeSpent': {f'p{p}': clean(v, 1) for p, v in zip(PERCENTILES, percentiles)},
+        'items': items,
+        'departments': departments,
+    }
+
+
+def analyze(dataset):
+    """全コースを集計する"""
+    np = require_numpy()
+    courses = {}
+    for course_id in sorted(dataset.courses, key=lambda c: (c is None, str(c))):
+        data = dataset.arrays(np, course_id)
+        # arrays() が users から部署を補うと部署名が増えるため、名前は毎回取り直す
+        names = dataset.department_names()
+        courses[str(course_id)] = analyze_course(np, data, names)
+    return {
+        'version': ANALYSIS_VERSION,
+        'records': dataset.records,
+        'answerRows': sum(c['answerRows'] for c in courses.values()),
+        'courses': courses,
+    }
+
+
+# ===========================================
+# キャッシュ
+# ===========================================
+
+def input_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '*.ndjson')) + glob.glob(os.path.join(path, '*.ndjson.gz')))
+        else:
+            files.append(path)
+    return files
+
+
+def input_fingerprint(paths):
+    """入力ファイルのパス・サイズ・更新時刻のハッシュ（標準入力を含む場合は None）"""
+    digest = hashlib.sha256(f'item_analysis v{ANALYSIS_VERSION}\n'.encode('utf-8'))
+    for path in input_files(paths):
+        if path == '-':
+            return None
+        stat = os.stat(path)
+        digest.update(f'{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_path(fingerprint):
+    return os.path.join(CACHE_DIR, f'{fingerprint}.json')
+
+
+def load_cached(fingerprint):
+    try:
+        with open(cache_path(fingerprint), 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return result if result.get('version') == ANALYSIS_VERSION else None
+
+
+def save_cached(fingerprint, result):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with atomic_output(cache_path(fingerprint), 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+# ===========================================
+# レポート
+# ===========================================
+
+def fmt(value, pattern='{:.2f}'):
+    return '-' if value is None else pattern.format(value)
+
+
+def print_report(result, show_departments):
+    print(f"📊 学習記録 {result['records']:,} 件 / 回答 {result['answerRows']:,} 行 / "
+          f"コース {len(result['courses'])} 件")
+    for course_id, course in result['courses'].items():
+        print(f"\n📘 コース {course_id}: {course['title'] or '（タイトルなし）'}")
+        print(f"  受講 {course['records']:,} 件  平均 {fmt(course['meanScore'], '{:.2f}')} / {course['questions']} 問"
+              f"  (σ {fmt(course['stdScore'])})  合格率 {fmt(course['passRate'], '{:.1%}')}"
+              f"  KR-20 {fmt(course['kr20'])}")
+        times = course['timeSpent']
+        print('  所要時間(秒): ' + '  '.join(f'{key} {fmt(value, "{:.0f}")}' for key, value in times.items()))
+        print('  得点分布: ' + ' '.join(f'{score}:{count}' for score, count in enumerate(course['scoreDistribution'])))
+        print(f"  {'問':>4} {'回答':>8} {'正答率':>7} {'識別力':>7} {'上下差':>7}  選択肢")
+        for item in course['items']:
+            mark = '⚠️ ' + '・'.join(item['flags']) if item['flags'] else ''
+            print(f"  {item['question']:>4} {item['answered']:>8,} {fmt(item['difficulty'], '{:.1%}'):>7} "
+                  f"{fmt(item['discrimination']):>7} {fmt(item['upperLower']):>7}  "
+                  f"{item['options']}  {mark}")
+        if show_departments:
+            print(f"  {'部署':<16} {'受講':>7} {'合格率':>7} {'平均点':>6}")
+            for dept in course['departments']:
+                print(f"  {dept['department']:<16} {dept['records']:>7,} {fmt(dept['passRate'], '{:.1%}'):>7} "
+                      f"{fmt(dept['meanScore']):>6}")
+
+
+# ===========================================
+# ベンチマーク
+# ===========================================
+
+def synthetic_records(answer_rows, questions=10, courses=5, departments=12, seed=1):
+    """能力と難易度から正誤を決めた合成の学習記録（/api/export 形式）"""
+    rng = random.Random(seed)
+    difficulty = [[rng.uniform(-1.5, 1.5) for _ in range(questions)] for _ in range(courses)]
+    for i in range(answer_rows // questions):
+        course = i % courses
+        ability = rng.gauss(0, 1)
+        answers = []
+        for q in range(questions):
+            is_correct = rng.random() < 1 / (1 + 2.718281828 ** (difficulty[course][q] - ability))
+            user_answer = q % 4 if is_correct else rng.choice([a for a in range(4) if a != q % 4])
+            answers.append({'question': f'問題{q + 1}', 'userAnswer': user_answer,
+                            'correctAnswer': q % 4, 'isCorrect': is_correct})
+        score = sum(a['isCorrect'] for a in answers)
+        yield {
+            'id': i + 1, 'userId': i % 20000 + 1, 'courseId': course + 1, 'score': score,
+            'passed': score >= questions * 0.7, 'answers': answers,
+            'timeSpent': int(rng.lognormvariate(5.5, 0.5)), 'userDept': f'部署{i % departments}',
+        }
+
+
+def analyze_python(dataset):
+    """比較用: 記録ごとの Python ループで正答率と識別力を求める"""
+    results = {}
+    for course_id, columns in dataset.courses.items():
+        rows, start = [], 0
+        for length in columns.lengths:
+            rows.append(list(columns.correct[start:start + length]))
+            start += length
+        width = max((len(r) for r in rows), default=0)
+        difficulty, discrimination = [], []
+        for q in range(width):
+            pairs = [(r[q], sum(v for v in r if v > 0) - r[q]) for r in rows if q < len(r) and r[q] >= 0]
+            count = len(pairs)
+            if not count:
+                difficulty.append(None)
+                discrimination.append(None)
+                continue
+            p = sum(a for a, _ in pairs) / count
+            mean_rest = sum(b for _, b in pairs) / count
+            cov = sum(a * b for a, b in pairs) / count - p * mean_rest
+            var_rest = sum(b * b for _, b in pairs) / count - mean_rest ** 2
+            denominator = max(p * (1 - p) * var_rest, 0) ** 0.5
+            difficulty.append(p)
+            discrimination.append(cov / denominator if denominator else None)
+        results[str(course_id)] = (difficulty, discrimination)
+    return results
+
+
+def run_benchmark(answer_rows):
+    np = require_numpy()
+    phases = Phases()
+    workdir = tempfile.mkdtemp(prefix='item_analysis_')
+    try:
+        path = os.path.join(workdir, 'learningRecords.ndjson')
+
+        def write():
+            with open(path, 'w', encoding='utf-8') as f:
+                for record in synthetic_records(answer_rows):
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        phases.run('合成データ', write, count=answer_rows)
+        size = os.path.getsize(path)
+        dataset = phases.run('読み込み', lambda: Dataset().load([path]), count=lambda d: d.records)
+        result = phases.run('集計(NumPy)', lambda: analyze(dataset), count=lambda r: r['answerRows'])
+        baseline = phases.run('集計(Python)', lambda: analyze_python(dataset), count=answer_rows)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # ベクトル演算の結果がループ版と一致するか確認
+    for course_id, (difficulty, discrimination) in baseline.items():
+        items = result['courses'][course_id]['items']
+        assert np.allclose([i['difficulty'] for i in items], difficulty, atol=1e-4)
+        assert np.allclose([i['discrimination'] if i['discrimination'] is not None else np.nan for i in items],
+                           [d if d is not None else np.nan for d in discrimination], atol=1e-4, equal_nan=True)
+
+    phases.print()
+    seconds = {label: s for label, s, _ in phases.rows}
+    rows = result['answerRows']
+    print(f"\n📊 入力 {size / 1024 / 1024:.1f}MB, 回答 {rows:,} 行")
+    print(f"  読み込み   {rows / max(seconds['読み込み'], 1e-9):>12,.0f} 行/秒")
+    print(f"  集計(NumPy) {rows / max(seconds['集計(NumPy)'], 1e-9):>11,.0f} 行/秒  "
+          f"(Python ループの {seconds['集計(Python)'] / max(seconds['集計(NumPy)'], 1e-9):.1f} 倍)")
+    print('✅ NumPy の集計結果は Python ループ版と一致しました')
+
+
+# ===========================================
+# CLI
+# ===========================================
+
+def main():
+    parser = argparse.ArgumentParser(description='確認テストの設問分析（正答率・識別力・部署別）')
+    parser.add_argument('inputs', nargs='*', help='エクスポート JSON / NDJSON チャンク（ファイル・ディレクトリ, - は標準入力）')
+    parser.add_argument('--course', help='表示するコース ID')
+    parser.add_argument('--json', metavar='PATH', help='結果を JSON で保存')
+    parser.add_argument('--departments', action='store_true', help='部署別の集計を表示')
+    parser.add_argument('--no-cache', action='store_true', help='キャッシュを使わずに再計算')
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', help='回答 ROWS 行の合成データで計測')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        run_benchmark(args.benchmark)
+        return
+    if not args.inputs:
+        parser.error('入力ファイルを指定してください')
+    for path in args.inputs:
+        if path != '-' and not os.path.exists(path):
+            print(f'❌ エラー: 入力が見つかりません: {path}')
+            sys.exit(1)
+
+    started = time.time()
+    fingerprint = input_fingerprint(args.inputs)
+    result = None if args.no_cache or fingerprint is None else load_cached(fingerprint)
+    if result is not None:
+        print(f'♻️ キャッシュを使用しました: {cache_path(fingerprint)}')
+    else:
+        require_numpy()
+        result = analyze(Dataset().load(args.inputs))
+        if fingerprint is not None:
+            save_cached(fingerprint, result)
+
+    if args.course is not None:
+        if args.course not in result['courses']:
+            print(f'❌ エラー: コース {args.course} の学習記録がありません')
+            sys.exit(1)
+        result = {**result, 'courses': {args.course: result['courses'][args.course]}}
+
+    print_report(result, args.departments)
+    if args.json:
+        with atomic_output(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f'\n💾 保存しました: {args.json}')
+    print(f'\n✅ 完了（{time.time() - started:.2f}s）')
+
+
+if __name__ == '__main__':
+    main()
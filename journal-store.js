@@ -0,0 +1,262 @@
+const fs = require('fs').promises;
+const path = require('path');
+
+// ジャーナル方式のデータ保存（server.js の DATA_STORAGE=journal）
+//
+// 現在のデータはメモリに保持し、変更は1行1件のジャーナル（NDJSON）に追記します。
+// ジャーナルが大きくなったらバックグラウンドでスナップショット（database.json と
+// 同じ形式）に書き出し、ジャーナルを切り詰めます。起動時は
+// スナップショット + それより新しいジャーナルを再生します。
+
+// 差分保存で扱うコレクション
+const COLLECTIONS = ['users', 'courses', 'learningRecords'];
+
+// ジャーナルをスナップショットにまとめる目安
+const COMPACT_BYTES = 8 * 1024 * 1024;
+const COMPACT_ENTRIES = 1000;
+
+// 変更されたレコードを反映する（PATCH /api/data の changes 形式）
+function applyChanges(data, changes) {
+    for (const name of COLLECTIONS) {
+        const change = changes[name];
+        if (!change) continue;
+        const records = data[name] || [];
+        const removed = new Set((change.delete || []).map(String));
+        const updates = new Map();
+        const additions = [];
+        for (const record of change.upsert || []) {
+            if (record.id === undefined || record.id === null) {
+                additions.push(record);
+            } else {
+                updates.set(String(record.id), record);
+            }
+        }
+        const merged = [];
+        for (const record of records) {
+            const key = String(record.id);
+            if (removed.has(key)) continue;
+            if (updates.has(key)) {
+                merged.push(updates.get(key));
+                updates.delete(key);
+            } else {
+                merged.push(record);
+            }
+        }
+        data[name] = merged.concat([...updates.values()], additions);
+    }
+    return data;
+}
+
+// ディレクトリの fsync（rename を確定させる。開けない環境では何もしない）
+async function syncDirectory(dir) {
+    let handle;
+    try {
+        handle = await fs.open(dir, 'r');
+        await handle.sync();
+    } catch (error) {
+        // Windows などディレクトリを fsync できない環境
+    } finally {
+        if (handle) await handle.close();
+    }
+}
+
+// 一時ファイルに書き込み、fsync してから置き換える
+async function writeFileAtomic(file, contents) {
+    const tmpFile = `${file}.${process.pid}.tmp`;
+    const handle = await fs.open(tmpFile, 'w');
+    try {
+        await handle.writeFile(contents);
+        await handle.sync();
+    } finally {
+        await handle.close();
+    }
+    await fs.rename(tmpFile, file);
+    await syncDirectory(path.dirname(file));
+}
+
+class JournalStore {
+    constructor(snapshotFile, journalFile, options = {}) {
+        this.snapshotFile = snapshotFile;
+        this.journalFile = journalFile;
+        this.compactBytes = options.compactBytes || COMPACT_BYTES;
+        this.compactEntries = options.compactEntries || COMPACT_ENTRIES;
+        this.data = null;
+        this.revision = 0;
+        this.snapshotRevision = 0;
+        this.journalBytes = 0;
+        this.journalEntries = 0;
+        this.handle = null;
+        this.queue = Promise.resolve();
+        this.compacting = null;
+        this.tail = null;
+        this.serialized = null;
+        this.serializedRevision = -1;
+    }
+
+    // 書き込みとジャーナルの切り替えは1件ずつ順番に実行する
+    run(task) {
+        const result = this.queue.then(task, task);
+        this.queue = result.catch(() => {});
+        return result;
+    }
+
+    // スナップショット + ジャーナルを再生してメモリに読み込む
+    async open() {
+        try {
+            this.data = JSON.parse(await fs.readFile(this.snapshotFile, 'utf-8'));
+        } catch (error) {
+            if (error.code !== 'ENOENT') throw error;
+            this.data = { users: [], courses: [], learningRecords: [] };
+        }
+        this.revision = this.snapshotRevision = this.data.revision || 0;
+
+        let buffer = Buffer.alloc(0);
+        try {
+            buffer = await fs.readFile(this.journalFile);
+        } catch (error) {
+            if (error.code !== 'ENOENT') throw error;
+        }
+
+        let pos = 0;
+        let replayed = 0;
+        while (pos < buffer.length) {
+            const newline = buffer.indexOf(0x0a, pos);
+            if (newline < 0) break;
+            let entry;
+            try {
+                entry = JSON.parse(buffer.toString('utf-8', pos, newline));
+            } catch (error) {
+                break;
+            }
+            pos = newline + 1;
+            this.journalEntries++;
+            if (entry.revision <= this.revision) continue;
+            applyChanges(this.data, entry.changes);
+            this.revision = this.data.revision = entry.revision;
+            this.data.lastUpdated = entry.at;
+            replayed++;
+        }
+
+        this.handle = await fs.open(this.journalFile, 'a');
+        if (pos < buffer.length) {
+            // 書き込み途中で止まった末尾の行を切り捨てる
+            console.warn(`⚠️ ジャーナル末尾の不完全な ${buffer.length - pos} バイトを破棄しました`);
+            await this.handle.truncate(pos);
+            await this.handle.sync();
+        }
+        this.journalBytes = pos;
+        this.maybeCompact();
+        return replayed;
+    }
+
+    async close() {
+        await this.run(async () => {});
+        if (this.compacting) await this.compacting;
+        if (this.handle) {
+            await this.handle.close();
+            this.handle = null;
+        }
+    }
+
+    // GET /api/data 用（同じリビジョンの間はシリアライズ結果を使い回す）
+    json() {
+        if (this.serializedRevision !== this.revision) {
+            this.serialized = JSON.stringify(this.data);
+            this.serializedRevision = this.revision;
+        }
+        return this.serialized;
+    }
+
+    // 差分を追記して反映し、新しいリビジョンを返す
+    patch(changes) {
+        return this.run(async () => {
+            const revision = this.revision + 1;
+            const at = new Date().toISOString();
+            const line = JSON.stringify({ revision, at, changes }) + '\n';
+            await this.handle.write(line);
+            await this.handle.datasync();
+
+            applyChanges(this.data, changes);
+            this.revision = this.data.revision = revision;
+            this.data.lastUpdated = at;
+            this.journalBytes += Buffer.byteLength(line);
+            this.journalEntries++;
+            if (this.tail) this.tail.push(line);
+            this.maybeCompact();
+            return revision;
+        });
+    }
+
+    // 全データの置き換え（POST /api/data, インポート, クリア）はスナップショットに直接書く
+    replace(data) {
+        return this.run(async () => {
+            const revision = this.revision + 1;
+            data.revision = revision;
+            data.lastUpdated = new Date().toISOString();
+            await writeFileAtomic(this.snapshotFile, JSON.stringify(data));
+            await this.resetJournal('');
+            this.data = data;
+            this.revision = this.snapshotRevision = revision;
+            if (this.tail) this.tail = [];
+            return revision;
+        });
+    }
+
+    async resetJournal(contents) {
+        await this.handle.close();
+        await writeFileAtomic(this.journalFile, contents);
+        this.handle = await fs.open(this.journalFile, 'a');
+        this.journalBytes = Buffer.byteLength(contents);
+        this.journalEntries = contents ? contents.split('\n').length - 1 : 0;
+    }
+
+    maybeCompact() {
+        if (this.compacting) return;
+        if (this.journalBytes < this.compactBytes && this.journalEntries < this.compactEntries) return;
+        this.compacting = this.compact()
+            .catch(error => console.error('❌ ジャーナル圧縮エラー:', error))
+            .finally(() => { this.compacting = null; });
+    }
+
+    // 1. 現在の状態をシリアライズ（キュー内）
+    // 2. スナップショットの一時ファイルを書き込み（キュー外、書き込みは継続）
+    // 3. 置き換えて、その間に追記された分だけのジャーナルに切り替え（キュー内）
+    async compact() {
+        const started = Date.now();
+        const { contents, revision } = await this.run(async () => {
+            this.tail = [];
+            return { contents: this.json(), revision: this.revision };
+        });
+
+        const tmpFile = `${this.snapshotFile}.${process.pid}.compact`;
+        const handle = await fs.open(tmpFile, 'w');
+        try {
+            await handle.writeFile(contents);
+            await handle.sync();
+        } finally {
+            await handle.close();
+        }
+
+        await this.run(async () => {
+            const tail = this.tail;
+            this.tail = null;
+            if (this.snapshotRevision > revision) {
+                // 圧縮中に全データの置き換えがあった
+                await fs.unlink(tmpFile);
+                return;
+            }
+            await fs.rename(tmpFile, this.snapshotFile);
+            await syncDirectory(path.dirname(this.snapshotFile));
+            this.snapshotRevision = revision;
+            await this.resetJournal(tail.join(''));
+        });
+        console.log(`🗜️ ジャーナルを圧縮しました (revision ${revision}, ${Date.now() - started}ms)`);
+    }
+}
+
+module.exports = {
+    JournalStore,
+    applyChanges,
+    writeFileAtomic,
+    COLLECTIONS
+};
@@ -0,0 +1,115 @@
+// 学習記録のメンテナンスツール（PostgreSQL 版）
+//
+// /api/debug/cleanup-duplicates・keep-latest-only・reset-learning-records と同じ処理を
+// コマンドラインから実行します。処理は user_id / id の範囲ごとの短いトランザクションで
+// 行うため、サーバー稼働中でも実行できます。バッチごとに進捗と
+// 走査・削除の行数/秒を表示します。
+//
+// 使用方法:
+//     node maintenance.js dedupe --dry-run          # 削除される件数だけ確認
+//     node maintenance.js dedupe --batch-rows 10000
+//     node maintenance.js reset --yes               # 学習記録をすべて削除
+//     node maintenance.js rollups-verify            # 修了状況の集計と学習記録を照合
+//     node maintenance.js rollups-rebuild           # 集計を作り直して照合
+//
+// 接続先は環境変数 DATABASE_URL です。
+
+require('dotenv').config();
+const db = require('./database');
+
+const COMMANDS = {
+    dedupe: { label: '重複削除（ユーザー・コースごとに最新の記録を残す）', run: db.dedupeLearningRecords },
+    reset: { label: '学習記録の全削除', run: db.deleteLearningRecords },
+    'rollups-verify': { label: '修了状況の集計の照合', run: () => checkRollups(false) },
+    'rollups-rebuild': { label: '修了状況の集計の再作成', run: () => checkRollups(true) }
+};
+
+function parseArgs(argv) {
+    const options = { command: argv[0], batchRows: undefined, dryRun: false, yes: false };
+    for (let i = 1; i < argv.length; i++) {
+        if (argv[i] === '--batch-rows') {
+            options.batchRows = Number(argv[++i]);
+        } else if (argv[i] === '--dry-run') {
+            options.dryRun = true;
+        } else if (argv[i] === '--yes') {
+            options.yes = true;
+        } else {
+            console.error(`❌ エラー: 不明な引数 ${argv[i]}`);
+            process.exit(1);
+        }
+    }
+    if (!COMMANDS[options.command]) {
+        console.error('使用方法: node maintenance.js <dedupe|reset|rollups-verify|rollups-rebuild> [--dry-run] [--batch-rows N] [--yes]');
+        process.exit(1);
+    }
+    if (options.batchRows !== undefined && !(options.batchRows > 0)) {
+        console.error('❌ エラー: --batch-rows には正の整数を指定してください');
+        process.exit(1);
+    }
+    return options;
+}
+
+function perSecond(count, seconds) {
+    return Math.round(count / Math.max(seconds, 0.001)).toLocaleString();
+}
+
+function printProgress(progress) {
+    const range = progress.range ? ` ≤ ${progress.range[1]}` : '';
+    console.log(`  [${String(progress.batches).padStart(4)}]${range.padEnd(12)} ` +
+        `走査 ${progress.scanned.toLocaleString().padStart(10)} / 削除 ${progress.deleted.toLocaleString().padStart(10)}  ` +
+        `${progress.seconds.toFixed(1).padStart(7)}s  ` +
+        `(${perSecond(progress.scanned, progress.seconds)} 行/秒 走査, ${perSecond(progress.deleted, progress.seconds)} 行/秒 削除)`);
+}
+
+// 集計（course_rollups）を学習記録から計算し直した値と照合する（rebuild なら先に作り直す）
+async function checkRollups(rebuild) {
+    const started = Date.now();
+    if (rebuild) {
+        const rows = await db.rebuildRollups();
+        console.log(`  再作成: ${rows} 行（${Date.now() - started}ms）`);
+    }
+    const mismatches = await db.verifyRollups();
+    for (const row of mismatches.slice(0, 20)) {
+        console.log(`  ⚠️ ${row.department || '（部署なし）'} / コース ${row.courseId}: ` +
+            `集計 ${JSON.stringify(row.stored)} ≠ 実データ ${JSON.stringify(row.live)}`);
+    }
+    if (mismatches.length > 20) {
+        console.log(`  … ほか ${mismatches.length - 20} 件`);
+    }
+    console.log(mismatches.length
+        ? `\n❌ 集計と学習記録が ${mismatches.length} 件一致しません（rollups-rebuild で作り直せます）`
+        : `\n✅ 集計は学習記録と一致しています（${Date.now() - started}ms）`);
+    if (mismatches.length) process.exitCode = 1;
+}
+
+async function main() {
+    const options = parseArgs(process.argv.slice(2));
+    const command = COMMANDS[options.command];
+
+    if (options.command === 'reset' && !options.dryRun && !options.yes) {
+        console.error('❌ エラー: 学習記録をすべて削除します。実行する場合は --yes を指定してください');
+        process.exit(1);
+    }
+
+    console.log(`🧹 ${command.label}${options.dryRun ? '（ドライラン）' : ''}`);
+    if (options.command.startsWith('rollups-')) {
+        return command.run();
+    }
+    const result = await command.run({
+        batchRows: options.batchRows,
+        dryRun: options.dryRun,
+        onBatch: printProgress
+    });
+
+    const prefix = options.dryRun ? '🔍 （ドライラン）削除対象' : '✅ 削除';
+    console.log(`\n${prefix} ${result.deleted.toLocaleString()} 件 / 走査 ${result.scanned.toLocaleString()} 件 ` +
+        `（${result.batches} バッチ, ${result.seconds.toFixed(1)}s）`);
+    console.log(`📊 走査 ${perSecond(result.scanned, result.seconds)} 行/秒, 削除 ${perSecond(result.deleted, result.seconds)} 行/秒`);
+}
+
+main()
+    .catch(error => {
+        console.error('❌ エラー:', error);
+        process.exitCode = 1;
+    })
+    .finally(() => db.pool.end());
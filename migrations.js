@@ -0,0 +1,519 @@
+// スキーマのマイグレーション（PostgreSQL 版）
+//
+// 適用済みのバージョンを schema_migrations に記録し、未適用のものだけを
+// 番号順に1つずつトランザクションで適用します。既存のデータベース
+// （schema_migrations がない）でもそのまま適用できるように、各マイグレーションは
+// IF NOT EXISTS などで冪等に書きます。追加するときは末尾に新しい番号で追記し、
+// 適用済みのものは書き換えないでください。
+//
+// 使用方法:
+//     node migrations.js            # 未適用のマイグレーションを適用
+//     node migrations.js status     # 適用状況を表示
+//
+// サーバー起動時（database.js の initializeDatabase）にも自動で適用されます。
+
+// 複数のサーバーが同時に起動しても1つずつ適用する（pg_advisory_lock のキー）
+const MIGRATION_LOCK = 7349101;
+// /api/data の変更カウンタのスロット数（接続ごとに分けて行ロックの競合を減らす）
+const DATA_VERSION_SLOTS = 16;
+
+const MIGRATIONS = [
+    {
+        version: 1,
+        name: 'initial_schema',
+        sql: `
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username VARCHAR(100) UNIQUE NOT NULL,
+                password VARCHAR(255) NOT NULL,
+                name VARCHAR(100) NOT NULL,
+                email VARCHAR(255) UNIQUE NOT NULL,
+                role VARCHAR(20) DEFAULT 'user',
+                department VARCHAR(100),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+
+            CREATE TABLE IF NOT EXISTS courses (
+                id SERIAL PRIMARY KEY,
+                title VARCHAR(255) NOT NULL,
+                description TEXT,
+                slides JSONB,
+                quiz JSONB,
+                passing_score INTEGER DEFAULT 70,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+
+            CREATE TABLE IF NOT EXISTS learning_records (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                course_id INTEGER REFERENCES courses(id) ON DELETE CASCADE,
+                score INTEGER NOT NULL,
+                passed BOOLEAN DEFAULT FALSE,
+                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                answers JSONB,
+                time_spent INTEGER DEFAULT 0
+            );
+
+            CREATE TABLE IF NOT EXISTS progress (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                course_id INTEGER,
+                current_slide INTEGER DEFAULT 0,
+                quiz_started BOOLEAN DEFAULT FALSE,
+                quiz_answers JSONB,
+                expires_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(user_id, course_id)
+            );
+        `
+    },
+    {
+        version: 2,
+        name: 'data_revision',
+        sql: `
+            CREATE TABLE IF NOT EXISTS data_revision (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                revision BIGINT NOT NULL DEFAULT 0
+            );
+            INSERT INTO data_revision (id, revision) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+            ALTER TABLE data_revision ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+
+            -- /api/data の ETag 用: どの経路で変更されても version を進める
+            CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE data_revision SET version = version + 1 WHERE id = 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            ${['users', 'courses', 'learning_records'].map(table => `
+            DROP TRIGGER IF EXISTS ${table}_data_version ON ${table};
+            CREATE TRIGGER ${table}_data_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ${table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();`).join('\n')}
+        `
+    },
+    {
+        version: 3,
+        name: 'course_counts',
+        sql: `
+            -- 一覧用: スライド数・問題数を保存時に計算しておく（画像を読まずに済む）
+            ALTER TABLE courses ADD COLUMN IF NOT EXISTS slide_count INTEGER GENERATED ALWAYS AS (
+                CASE WHEN jsonb_typeof(slides) = 'array' THEN jsonb_array_length(slides) ELSE 0 END
+            ) STORED;
+            ALTER TABLE courses ADD COLUMN IF NOT EXISTS quiz_length INTEGER GENERATED ALWAYS AS (
+                CASE WHEN jsonb_typeof(quiz) = 'array' THEN jsonb_array_length(quiz) ELSE 0 END
+            ) STORED;
+        `
+    },
+    {
+        version: 4,
+        name: 'users_active',
+        sql: `
+            -- 名簿同期（roster_sync.py）で退職者などを無効化する
+            ALTER TABLE users ADD COLUMN IF NOT EXISTS active BOOLEAN NOT NULL DEFAULT TRUE;
+        `
+    },
+    {
+        version: 5,
+        name: 'learning_records_progress_indexes',
+        sql: `
+            -- getLearningRecordsByUserId: user_id で絞り込み completed_at の降順
+            CREATE INDEX IF NOT EXISTS idx_learning_records_user_completed
+                ON learning_records (user_id, completed_at DESC);
+            -- getLearningRecords: 全件を completed_at の降順（並べ替えを索引で省く）
+            CREATE INDEX IF NOT EXISTS idx_learning_records_completed
+                ON learning_records (completed_at DESC, id DESC);
+            -- 重複削除（dedupeLearningRecords）の user_id 範囲バッチ・最新記録の判定用
+            CREATE INDEX IF NOT EXISTS idx_learning_records_user_course
+                ON learning_records (user_id, course_id, completed_at DESC);
+            -- コース削除時の ON DELETE CASCADE
+            CREATE INDEX IF NOT EXISTS idx_learning_records_course
+                ON learning_records (course_id);
+            -- cleanupExpiredProgress: 期限付きの進捗だけ
+            CREATE INDEX IF NOT EXISTS idx_progress_expires
+                ON progress (expires_at) WHERE expires_at IS NOT NULL;
+        `
+    },
+    {
+        version: 6,
+        name: 'completion_rollups',
+        sql: `
+            -- 受講者・コースごとの集計（部署は記録時点の users.department）
+            CREATE TABLE IF NOT EXISTS course_user_stats (
+                user_id INTEGER NOT NULL,
+                course_id INTEGER NOT NULL,
+                department VARCHAR(100) NOT NULL DEFAULT '',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                passes INTEGER NOT NULL DEFAULT 0,
+                score_sum BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, course_id)
+            );
+
+            -- 部署・コースごとの集計（ダッシュボード用）
+            CREATE TABLE IF NOT EXISTS course_rollups (
+                department VARCHAR(100) NOT NULL,
+                course_id INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                passes INTEGER NOT NULL DEFAULT 0,
+                score_sum BIGINT NOT NULL DEFAULT 0,
+                learners INTEGER NOT NULL DEFAULT 0,
+                completed_learners INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (department, course_id)
+            );
+
+            -- 学習記録の増減（user_id, course_id, attempts, passes, score_sum の配列）を集計に反映する
+            CREATE OR REPLACE FUNCTION apply_learning_record_deltas(deltas JSONB) RETURNS void AS $$
+            BEGIN
+                WITH d AS (
+                    SELECT user_id, course_id, SUM(attempts)::int AS attempts,
+                           SUM(passes)::int AS passes, SUM(score_sum)::bigint AS score_sum
+                    FROM jsonb_to_recordset(deltas) AS t(user_id INTEGER, course_id INTEGER, attempts INTEGER, passes INTEGER, score_sum BIGINT)
+                    GROUP BY user_id, course_id
+                ), current_stats AS (
+                    SELECT d.*, COALESCE(s.department, u.department, '') AS department,
+                           COALESCE(s.attempts, 0) AS old_attempts, COALESCE(s.passes, 0) AS old_passes
+                    FROM d
+                    LEFT JOIN course_user_stats s ON s.user_id = d.user_id AND s.course_id = d.course_id
+                    LEFT JOIN users u ON u.id = d.user_id
+                ), stats AS (
+                    INSERT INTO course_user_stats AS s (user_id, course_id, department, attempts, passes, score_sum)
+                    SELECT user_id, course_id, department, attempts, passes, score_sum FROM current_stats
+                    ON CONFLICT (user_id, course_id) DO UPDATE SET
+                        attempts = s.attempts + EXCLUDED.attempts,
+                        passes = s.passes + EXCLUDED.passes,
+                        score_sum = s.score_sum + EXCLUDED.score_sum
+                )
+                INSERT INTO course_rollups AS r (department, course_id, attempts, passes, score_sum, learners, completed_learners)
+                SELECT department, course_id, SUM(attempts), SUM(passes), SUM(score_sum),
+                       SUM((old_attempts + attempts > 0)::int - (old_attempts > 0)::int),
+                       SUM((old_passes + passes > 0)::int - (old_passes > 0)::int)
+                FROM current_stats
+                GROUP BY department, course_id
+                ON CONFLICT (department, course_id) DO UPDATE SET
+                    attempts = r.attempts + EXCLUDED.attempts,
+                    passes = r.passes + EXCLUDED.passes,
+                    score_sum = r.score_sum + EXCLUDED.score_sum,
+                    learners = r.learners + EXCLUDED.learners,
+                    completed_learners = r.completed_learners + EXCLUDED.completed_learners,
+                    updated_at = CURRENT_TIMESTAMP;
+
+                DELETE FROM course_user_stats s
+                USING jsonb_to_recordset(deltas) AS t(user_id INTEGER, course_id INTEGER)
+                WHERE s.user_id = t.user_id AND s.course_id = t.course_id AND s.attempts <= 0;
+                DELETE FROM course_rollups WHERE attempts <= 0;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            -- learning_records の INSERT / UPDATE / DELETE（文単位、変更行をまとめて反映）
+            CREATE OR REPLACE FUNCTION learning_records_rollup() RETURNS trigger AS $$
+            DECLARE
+                added JSONB;
+                removed JSONB;
+            BEGIN
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    SELECT jsonb_agg(r) INTO added FROM (
+                        SELECT COALESCE(user_id, 0) AS user_id, COALESCE(course_id, 0) AS course_id,
+                               COUNT(*) AS attempts, COUNT(*) FILTER (WHERE passed) AS passes, SUM(score) AS score_sum
+                        FROM new_records GROUP BY 1, 2
+                    ) r;
+                END IF;
+                IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                    SELECT jsonb_agg(r) INTO removed FROM (
+                        SELECT COALESCE(user_id, 0) AS user_id, COALESCE(course_id, 0) AS course_id,
+                               -COUNT(*) AS attempts, -COUNT(*) FILTER (WHERE passed) AS passes, -SUM(score) AS score_sum
+                        FROM old_records GROUP BY 1, 2
+                    ) r;
+                END IF;
+                IF added IS NOT NULL OR removed IS NOT NULL THEN
+                    PERFORM apply_learning_record_deltas(COALESCE(added, '[]') || COALESCE(removed, '[]'));
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE OR REPLACE FUNCTION learning_records_rollup_truncate() RETURNS trigger AS $$
+            BEGIN
+                TRUNCATE course_user_stats, course_rollups;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            -- 部署の異動: その受講者の集計を旧部署から新部署へ移す
+            CREATE OR REPLACE FUNCTION users_rollup_department() RETURNS trigger AS $$
+            BEGIN
+                WITH previous AS (
+                    SELECT course_id, department, attempts, passes, score_sum
+                    FROM course_user_stats WHERE user_id = NEW.id
+                ), moved AS (
+                    UPDATE course_user_stats SET department = COALESCE(NEW.department, '') WHERE user_id = NEW.id
+                ), removed AS (
+                    UPDATE course_rollups r SET
+                        attempts = r.attempts - o.attempts,
+                        passes = r.passes - o.passes,
+                        score_sum = r.score_sum - o.score_sum,
+                        learners = r.learners - 1,
+                        completed_learners = r.completed_learners - (o.passes > 0)::int,
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM previous o
+                    WHERE r.department = o.department AND r.course_id = o.course_id
+                )
+                INSERT INTO course_rollups AS r (department, course_id, attempts, passes, score_sum, learners, completed_learners)
+                SELECT COALESCE(NEW.department, ''), course_id, attempts, passes, score_sum, 1, (passes > 0)::int
+                FROM previous
+                ON CONFLICT (department, course_id) DO UPDATE SET
+                    attempts = r.attempts + EXCLUDED.attempts,
+                    passes = r.passes + EXCLUDED.passes,
+                    score_sum = r.score_sum + EXCLUDED.score_sum,
+                    learners = r.learners + EXCLUDED.learners,
+                    completed_learners = r.completed_learners + EXCLUDED.completed_learners,
+                    updated_at = CURRENT_TIMESTAMP;
+                DELETE FROM course_rollups WHERE attempts <= 0;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            -- 集計を学習記録から作り直す（maintenance.js rollups-rebuild）
+            CREATE OR REPLACE FUNCTION rebuild_course_rollups() RETURNS void AS $$
+            BEGIN
+                -- 再集計中の学習記録の追加・削除は待たせる（読み取りは可）
+                LOCK TABLE learning_records IN SHARE MODE;
+                TRUNCATE course_user_stats, course_rollups;
+                INSERT INTO course_user_stats (user_id, course_id, department, attempts, passes, score_sum)
+                SELECT COALESCE(lr.user_id, 0), COALESCE(lr.course_id, 0), COALESCE(MAX(u.department), ''),
+                       COUNT(*), COUNT(*) FILTER (WHERE lr.passed), SUM(lr.score)
+                FROM learning_records lr
+                LEFT JOIN users u ON u.id = lr.user_id
+                GROUP BY 1, 2;
+                INSERT INTO course_rollups (department, course_id, attempts, passes, score_sum, learners, completed_learners)
+                SELECT department, course_id, SUM(attempts), SUM(passes), SUM(score_sum),
+                       COUNT(*), COUNT(*) FILTER (WHERE passes > 0)
+                FROM course_user_stats
+                GROUP BY department, course_id;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS learning_records_rollup_insert ON learning_records;
+            CREATE TRIGGER learning_records_rollup_insert
+                AFTER INSERT ON learning_records REFERENCING NEW TABLE AS new_records
+                FOR EACH STATEMENT EXECUTE FUNCTION learning_records_rollup();
+            DROP TRIGGER IF EXISTS learning_records_rollup_update ON learning_records;
+            CREATE TRIGGER learning_records_rollup_update
+                AFTER UPDATE ON learning_records REFERENCING OLD TABLE AS old_records NEW TABLE AS new_records
+                FOR EACH STATEMENT EXECUTE FUNCTION learning_records_rollup();
+            DROP TRIGGER IF EXISTS learning_records_rollup_delete ON learning_records;
+            CREATE TRIGGER learning_records_rollup_delete
+                AFTER DELETE ON learning_records REFERENCING OLD TABLE AS old_records
+                FOR EACH STATEMENT EXECUTE FUNCTION learning_records_rollup();
+            DROP TRIGGER IF EXISTS learning_records_rollup_truncate ON learning_records;
+            CREATE TRIGGER learning_records_rollup_truncate
+                AFTER TRUNCATE ON learning_records
+                FOR EACH STATEMENT EXECUTE FUNCTION learning_records_rollup_truncate();
+            DROP TRIGGER IF EXISTS users_rollup_department ON users;
+            CREATE TRIGGER users_rollup_department
+                AFTER UPDATE OF department ON users
+                FOR EACH ROW WHEN (OLD.department IS DISTINCT FROM NEW.department)
+                EXECUTE FUNCTION users_rollup_department();
+
+            SELECT rebuild_course_rollups();
+        `
+    },
+    {
+        version: 7,
+        name: 'rollup_learner_transitions',
+        sql: `
+            -- 受講者数（learners / completed_learners）の増減は course_user_stats の upsert の
+            -- RETURNING（行ロックを取った後の値）から求める。upsert の前に読んだ値では、同じ受講者・
+            -- コースの最初の記録が同時に追加されたとき、両方のトランザクションが新しい受講者と数える
+            CREATE OR REPLACE FUNCTION apply_learning_record_deltas(deltas JSONB) RETURNS void AS $$
+            BEGIN
+                WITH d AS (
+                    SELECT user_id, course_id, SUM(attempts)::int AS attempts,
+                           SUM(passes)::int AS passes, SUM(score_sum)::bigint AS score_sum
+                    FROM jsonb_to_recordset(deltas) AS t(user_id INTEGER, course_id INTEGER, attempts INTEGER, passes INTEGER, score_sum BIGINT)
+                    GROUP BY user_id, course_id
+                ), stats AS (
+                    INSERT INTO course_user_stats AS s (user_id, course_id, department, attempts, passes, score_sum)
+                    SELECT d.user_id, d.course_id, COALESCE(u.department, ''), d.attempts, d.passes, d.score_sum
+                    FROM d
+                    LEFT JOIN users u ON u.id = d.user_id
+                    ON CONFLICT (user_id, course_id) DO UPDATE SET
+                        attempts = s.attempts + EXCLUDED.attempts,
+                        passes = s.passes + EXCLUDED.passes,
+                        score_sum = s.score_sum + EXCLUDED.score_sum
+                    RETURNING s.user_id, s.course_id, s.department, s.attempts, s.passes
+                )
+                INSERT INTO course_rollups AS r (department, course_id, attempts, passes, score_sum, learners, completed_learners)
+                SELECT s.department, s.course_id, SUM(d.attempts), SUM(d.passes), SUM(d.score_sum),
+                       SUM((s.attempts > 0)::int - (s.attempts - d.attempts > 0)::int),
+                       SUM((s.passes > 0)::int - (s.passes - d.passes > 0)::int)
+                FROM stats s
+                JOIN d ON d.user_id = s.user_id AND d.course_id = s.course_id
+                GROUP BY s.department, s.course_id
+                ON CONFLICT (department, course_id) DO UPDATE SET
+                    attempts = r.attempts + EXCLUDED.attempts,
+                    passes = r.passes + EXCLUDED.passes,
+                    score_sum = r.score_sum + EXCLUDED.score_sum,
+                    learners = r.learners + EXCLUDED.learners,
+                    completed_learners = r.completed_learners + EXCLUDED.completed_learners,
+                    updated_at = CURRENT_TIMESTAMP;
+
+                DELETE FROM course_user_stats s
+                USING jsonb_to_recordset(deltas) AS t(user_id INTEGER, course_id INTEGER)
+                WHERE s.user_id = t.user_id AND s.course_id = t.course_id AND s.attempts <= 0;
+                DELETE FROM course_rollups WHERE attempts <= 0;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            -- 以前の版で数え違えた受講者数を直す
+            SELECT rebuild_course_rollups();
+        `
+    },
+    {
+        version: 8,
+        name: 'data_version_slots',
+        sql: `
+            -- /api/data の ETag 用の変更カウンタを data_revision の1行から接続ごとのスロットに分ける。
+            -- 1行の UPDATE だと、すべての書き込みがその行ロック（applyDataPatch の FOR UPDATE を含む）で
+            -- コミットまで直列になる。値はスロットの合計（コミット済みの増分だけが見える）。
+            -- nextval() のシーケンスはコミット前に値が進み、変更が見える前の ETag で 304 を返しうるため使わない
+            CREATE TABLE IF NOT EXISTS data_version_slots (
+                slot INTEGER PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0
+            );
+            INSERT INTO data_version_slots (slot, version)
+            SELECT slot, 0 FROM generate_series(0, ${DATA_VERSION_SLOTS - 1}) AS slot
+            ON CONFLICT (slot) DO NOTHING;
+            -- これまでの値を引き継ぐ（ETag が前の値に戻らないように）
+            UPDATE data_version_slots SET version = version + (SELECT version FROM data_revision WHERE id = 1)
+            WHERE slot = 0;
+
+            -- 行が変わらなかった文（何も削除しない保守バッチなど）では進めない
+            CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+                        RETURN NULL;
+                    END IF;
+                ELSIF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    IF NOT EXISTS (SELECT 1 FROM old_rows) THEN
+                        RETURN NULL;
+                    END IF;
+                END IF;
+                UPDATE data_version_slots SET version = version + 1
+                WHERE slot = pg_backend_pid() % ${DATA_VERSION_SLOTS};
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            ${['users', 'courses', 'learning_records'].map(table => `
+            DROP TRIGGER IF EXISTS ${table}_data_version ON ${table};
+            DROP TRIGGER IF EXISTS ${table}_data_version_insert ON ${table};
+            CREATE TRIGGER ${table}_data_version_insert
+                AFTER INSERT ON ${table} REFERENCING NEW TABLE AS changed_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+            DROP TRIGGER IF EXISTS ${table}_data_version_update ON ${table};
+            CREATE TRIGGER ${table}_data_version_update
+                AFTER UPDATE ON ${table} REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+            DROP TRIGGER IF EXISTS ${table}_data_version_delete ON ${table};
+            CREATE TRIGGER ${table}_data_version_delete
+                AFTER DELETE ON ${table} REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();
+            DROP TRIGGER IF EXISTS ${table}_data_version_truncate ON ${table};
+            CREATE TRIGGER ${table}_data_version_truncate
+                AFTER TRUNCATE ON ${table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version();`).join('\n')}
+        `
+    }
+];
+
+// 未適用のマイグレーションを適用し、適用したものを返す
+async function migrate(client, { log = console.log } = {}) {
+    // 管理テーブルの作成も含めてロック内で行う（同時に起動したインスタンスが
+    // CREATE TABLE IF NOT EXISTS で競合しないように）
+    await client.query('SELECT pg_advisory_lock($1)', [MIGRATION_LOCK]);
+    try {
+        await client.query(`
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        `);
+        const result = await client.query('SELECT version FROM schema_migrations');
+        const applied = new Set(result.rows.map(row => row.version));
+        const done = [];
+        for (const migration of MIGRATIONS) {
+            if (applied.has(migration.version)) continue;
+            const started = Date.now();
+            try {
+                await client.query('BEGIN');
+                // インデックス作成・集計の初期化は PG_STATEMENT_TIMEOUT_MS の対象外
+                await client.query('SET LOCAL statement_timeout = 0');
+                await client.query(migration.sql);
+                await client.query(
+                    'INSERT INTO schema_migrations (version, name) VALUES ($1, $2)',
+                    [migration.version, migration.name]
+                );
+                await client.query('COMMIT');
+            } catch (error) {
+                await client.query('ROLLBACK');
+                error.message = `マイグレーション ${migration.version} (${migration.name}) に失敗しました: ${error.message}`;
+                throw error;
+            }
+            log(`  ✓ ${migration.version} ${migration.name} (${Date.now() - started}ms)`);
+            done.push(migration);
+        }
+        return done;
+    } finally {
+        await client.query('SELECT pg_advisory_unlock($1)', [MIGRATION_LOCK]);
+    }
+}
+
+// 適用状況（適用済みは applied_at 付き）
+async function status(client) {
+    const result = await client.query('SELECT version, applied_at FROM schema_migrations').catch(error => {
+        if (error.code === '42P01') return { rows: [] };  // schema_migrations がまだない
+        throw error;
+    });
+    const applied = new Map(result.rows.map(row => [row.version, row.applied_at]));
+    return MIGRATIONS.map(({ version, name }) => ({ version, name, appliedAt: applied.get(version) || null }));
+}
+
+module.exports = {
+    MIGRATIONS,
+    migrate,
+    status
+};
+
+if (require.main === module) {
+    require('dotenv').config();
+    const db = require('./database');
+    (async () => {
+        const client = await db.pool.connect();
+        try {
+            if (process.argv[2] === 'status') {
+                for (const row of await status(client)) {
+                    const mark = row.appliedAt ? '✅' : '⏳';
+                    const when = row.appliedAt ? new Date(row.appliedAt).toISOString() : '未適用';
+                    console.log(`${mark} ${String(row.version).padStart(3)} ${row.name.padEnd(36)} ${when}`);
+                }
+            } else {
+                console.log('📊 マイグレーションを適用しています...');
+                const done = await migrate(client);
+                console.log(done.length ? `✅ ${done.length} 件適用しました` : '✅ すべて適用済みです');
+            }
+        } finally {
+            client.release();
+            await db.pool.end();
+        }
+    })().catch(error => {
+        console.error('❌ エラー:', error.message);
+        process.exit(1);
+    });
+}
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL 版データのインポート / エクスポートツール
+
+/api/export と同じ形式の JSON を、全体をメモリに載せずに1レコードずつ読み書きします。
+インポートは COPY で一時テーブルに流し込み、最後に1トランザクションで
+本番テーブルを TRUNCATE して INSERT … SELECT で書き戻します。
+
+制限: TRUNCATE は users / courses / learning_records / progress の
+ACCESS EXCLUSIVE ロックを取り、そのロックは書き戻しのコピーが終わって
+コミットするまで保持されます。ファイルの読み込み（COPY）中はロックしませんが、
+書き戻しの間はこれらのテーブルへの読み書きがすべて待たされるため、
+大きなデータの復元はメンテナンス時間帯に実行してください。
+
+使用方法:
+    python3 pg_transfer.py export -o backup.json.gz           # gzip でストリーム出力
+    python3 pg_transfer.py import backup.json.gz              # COPY で一括インポート
+    python3 pg_transfer.py import chunks/                     # NDJSON チャンクから
+    python3 pg_transfer.py to-ndjson backup.json -o chunks/ --chunk-rows 5000
+    python3 pg_transfer.py import backup.json --dry-run       # 件数の確認のみ
+
+接続先は --database-url または環境変数 DATABASE_URL です。
+import / export には psycopg (v3) が必要です: pip install "psycopg[binary]"（または pip install -r requirements.txt）
+"""
+
+import argparse
+import glob
+import gzip
+import io
+import itertools
+import json
+import os
+import sys
+import time
+
+from cli_common import atomic_output
+
+READ_CHUNK = 1024 * 1024
+DEFAULT_CHUNK_ROWS = 10000
+
+# エクスポートのキー → (テーブル, 一時テーブルの列, レコード → 行)
+STAGES = {
+    'users': ('users', [
+        ('id', 'integer'), ('username', 'text'), ('password', 'text'), ('name', 'text'),
+        ('email', 'text'), ('role', 'text'), ('department', 'text'),
+        ('active', 'boolean'), ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ], lambda u: (
+        u.get('id'), u.get('username'), u.get('password'), u.get('name'),
+        u.get('email'), u.get('role'), u.get('department'),
+        u.get('active'), u.get('created_at'), u.get('updated_at'),
+    )),
+    'courses': ('courses', [
+        ('id', 'integer'), ('title', 'text'), ('description', 'text'), ('slides', 'jsonb'),
+        ('quiz', 'jsonb'), ('passing_score', 'integer'),
+        ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ], lambda c: (
+        c.get('id'), c.get('title'), c.get('description'),
+        json.dumps(c.get('slides') or c.get('slideImages') or [], ensure_ascii=False),
+        json.dumps(c.get('quiz') or [], ensure_ascii=False), c.get('passing_score'),
+        c.get('created_at'), c.get('updated_at'),
+    )),
+    'learningRecords': ('learning_records', [
+        ('id', 'integer'), ('user_id', 'integer'), ('course_id', 'integer'), ('score', 'integer'),
+        ('passed', 'boolean'), ('answers', 'jsonb'), ('time_spent', 'integer'),
+        ('completed_at', 'timestamp'),
+    ], lambda r: (
+        r.get('id'), r.get('userId', r.get('user_id')), r.get('courseId', r.get('course_id')),
+        r.get('score'), r.get('passed'), json.dumps(r.get('answers') or [], ensure_ascii=False),
+        r.get('timeSpent', r.get('time_spent')), r.get('completedAt', r.get('completed_at')),
+    )),
+}
+
+# 一時テーブル → 本番テーブル（TRUNCATE と同じトランザクション内で実行）
+SWAP_SQL = {
+    'users': '''
+        INSERT INTO users (id, username, password, name, email, role, department, active, created_at, updated_at)
+        SELECT id, username, password, name, email, COALESCE(role, 'user'), department, COALESCE(active, TRUE),
+               COALESCE(created_at, CURRENT_TIMESTAMP), COALESCE(updated_at, CURRENT_TIMESTAMP)
+        FROM stage_users''',
+    'courses': '''
+        INSERT INTO courses (id, title, description, slides, quiz, passing_score, created_at, updated_at)
+        SELECT id, title, description, COALESCE(slides, '[]'::jsonb), COALESCE(quiz, '[]'::jsonb),
+               COALESCE(passing_score, 70),
+               COALESCE(created_at, CURRENT_TIMESTAMP), COALESCE(updated_at, CURRENT_TIMESTAMP)
+        FROM stage_courses''',
+    # 存在しないユーザー・コースを参照する学習記録は取り込まない
+    'learningRecords': '''
+        INSERT INTO learning_records (id, user_id, course_id, score, passed, answers, time_spent, completed_at)
+        SELECT id, user_id, course_id, COALESCE(score, 0), COALESCE(passed, FALSE), answers,
+               COALESCE(time_spent, 0), COALESCE(completed_at, CURRENT_TIMESTAMP)
+        FROM stage_learning_records s
+        WHERE (s.user_id IS NULL OR EXISTS (SELECT 1 FROM users u WHERE u.id = s.user_id))
+          AND (s.course_id IS NULL OR EXISTS (SELECT 1 FROM courses c WHERE c.id = s.course_id))''',
+}
+
+# エクスポート（1行 = 1レコードのJSONテキスト。/api/export と同じ列）
+EXPORT_SQL = {
+    'users': 'SELECT row_to_json(u)::text FROM users u ORDER BY id',
+    'courses': 'SELECT row_to_json(c)::text FROM courses c ORDER BY id',
+    'learningRecords': '''
+        SELECT row_to_json(r)::text FROM (
+            SELECT
+                lr.id,
+                lr.user_id as "userId",
+                lr.course_id as "courseId",
+                lr.score,
+                lr.passed,
+                lr.completed_at as "completedAt",
+                lr.answers,
+                lr.time_spent as "timeSpent",
+                u.name as "userName",
+                u.department as "userDept",
+                c.title as "courseTitle",
+                CASE WHEN lr.passed = true THEN 'completed' ELSE 'failed' END as status,
+                lr.score as "correctCount",
+                CASE WHEN c.quiz IS NOT NULL THEN jsonb_array_length(c.quiz) ELSE 10 END as "totalQuestions",
+                lr.completed_at as "completedDate"
+            FROM learning_records lr
+            LEFT JOIN users u ON lr.user_id = u.id
+            LEFT JOIN courses c ON lr.course_id = c.id
+            ORDER BY lr.completed_at DESC
+        ) r''',
+}
+
+# サーバー側カーソルで一度に取得する行数（コースは画像を含むため少なく）
+FETCH_ROWS = {'users': 1000, 'courses': 4, 'learningRecords': 5000}
+
+
+# ===========================================
+# ストリーミング読み込み
+# ===========================================
+
+class JsonStream:
+    """テキストストリームから JSON の値を1つずつ取り出す"""
+
+    def __init__(self, stream, chunk=READ_CHUNK):
+        self.stream = stream
+        self.chunk = chunk
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size):
+        if self.pos > self.chunk:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        data = self.stream.read(size)
+        if not data:
+            self.eof = True
+        self.text += data
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.text) or self.eof:
+                return self.text[self.pos:self.pos + 1]
+            self._fill(self.chunk)
+
+    def take(self, expected=None):
+        c = self.peek()
+        if not c or (expected and c not in expected):
+            raise ValueError(f"JSON の形式が不正です: '{expected}' が必要です（'{c}'）")
+        self.pos += 1
+        return c
+
+    def value(self):
+        c = self.peek()
+        size = self.chunk
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.text, self.pos)
+                # 数値などはバッファ末尾で切れている可能性があるので続きを確認する
+                if end < len(self.text) or self.eof or c in '{["':
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # 大きなレコード（画像入りのコース）は読み込み量を倍々にして再試行
+            self._fill(size)
+            size *= 2
+
+
+def iter_export(stream, chunk=READ_CHUNK):
+    """/api/export 形式の JSON から (キー, 値, 配列要素か) を順に返す"""
+    reader = JsonStream(stream, chunk)
+    reader.take('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.take(':')
+        if reader.peek() == '[':
+            reader.take('[')
+            if reader.peek() == ']':
+                reader.take(']')
+            else:
+                while True:
+                    yield key, reader.value(), True
+                    if reader.take(',]') == ']':
+                        break
+        else:
+            yield key, reader.value(), False
+        if reader.take(',}') == '}':
+            return
+
+
+def open_text(path):
+    """gzip かどうかを先頭バイトで判定して開く（- は標準入力）"""
+    raw = sys.stdin.buffer if path == '-' else open(path, 'rb')
+    if raw.peek(2)[:2] == b'\x1f\x8b':
+        raw = gzip.GzipFile(fileobj=raw)
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+def ndjson_key(path):
+    """users-0001.ndjson.gz → users"""
+    return os.path.basename(path).split('.')[0].rsplit('-', 1)[0]
+
+
+def iter_input(paths):
+    """JSON / NDJSON チャンク（ファイル・ディレクトリ）から (キー, レコード) を返す"""
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '*.ndjson')) + glob.glob(os.path.join(path, '*.ndjson.gz')))
+            yield from iter_input(files)
+        elif '.ndjson' in os.path.basename(path):
+            key = ndjson_key(path)
+            with open_text(path) as f:
+                for line in f:
+                    if line.strip():
+                        yield key, json.loads(line)
+        else:
+            with open_text(path) as f:
+                for key, value, item in iter_export(f):
+                    if item:
+                        yield key, value
+
+
+def _open_output(path, gzip_output):
+    """出力先を開く（- は標準出力、.gz または --gzip は gzip 圧縮）"""
+    if path == '-':
+        return _NoClose(sys.stdout.buffer), gzip_output
+    return atomic_output(path), gzip_output or path.endswith('.gz')
+
+
+class _NoClose:
+    def __init__(self, f):
+        self.f = f
+
+    def __enter__(self):
+        return self.f
+
+    def __exit__(self, *exc):
+        self.f.flush()
+
+
+# ===========================================
+# NDJSON 変換
+# ===========================================
+
+def to_ndjson(paths, output_dir, chunk_rows, gzip_output):
+    os.makedirs(output_dir, exist_ok=True)
+    counts = {}
+    writers = {}
+    suffix = '.ndjson.gz' if gzip_output else '.ndjson'
+
+    def close(key):
+        context, f, _ = writers.pop(key)
+        if f is not None:
+            f.close()
+        context.__exit__(None, None, None)
+
+    try:
+        for key, record in iter_input(paths):
+            count = counts.get(key, 0)
+            if count % chunk_rows == 0:
+                if key in writers:
+                    close(key)
+                path = os.path.join(output_dir, f'{key}-{count // chunk_rows + 1:04d}{suffix}')
+                context = atomic_output(path)
+                raw = context.__enter__()
+                f = gzip.GzipFile(fileobj=raw, mode='wb') if gzip_output else None
+                writers[key] = (context, f, f or raw)
+            writers[key][2].write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+            counts[key] = count + 1
+    finally:
+        for key in list(writers):
+            close(key)
+    return counts
+
+
+# ===========================================
+# PostgreSQL
+# ===========================================
+
+def connect(database_url):
+    try:
+        import psycopg
+    except ImportError:
+        print('❌ エラー: psycopg がインストールされていません: pip install "psycopg[binary]"')
+        sys.exit(1)
+    if not database_url:
+        print('❌ エラー: --database-url または環境変数 DATABASE_URL を指定してください')
+        sys.exit(1)
+    return psycopg.connect(database_url)
+
+
+def import_data(conn, paths):
+    """COPY で一時テーブルに読み込み、1トランザクションで本番テーブルを置き換える
+
+    TRUNCATE から COMMIT まで（書き戻しのコピー全体）対象テーブルは
+    ACCESS EXCLUSIVE でロックされる。
+    """
+    counts = {key: 0 for key in STAGES}
+    started = time.time()
+    with conn.cursor() as cur:
+        for key, (table, columns, _) in STAGES.items():
+            column_defs = ', '.join(f'{name} {sql_type}' for name, sql_type in columns)
+            cur.execute(f'CREATE TEMP TABLE stage_{table} ({column_defs}) ON COMMIT PRESERVE ROWS')
+        conn.commit()
+
+        # 同じキーが続く間は1つの COPY にまとめる
+        for key, group in itertools.groupby(iter_input(paths), key=lambda kr: kr[0]):
+            if key not in STAGES:
+                continue
+            table, columns, to_row = STAGES[key]
+            names = ', '.join(name for name, _ in columns)
+            with cur.copy(f'COPY stage_{table} ({names}) FROM STDIN') as copy:
+                for _, record in group:
+                    copy.write_row(to_row(record))
+                    counts[key] += 1
+                    if counts[key] % 50000 == 0:
+                        print(f'  … {key}: {counts[key]:,} 件')
+        conn.commit()
+        loaded = time.time() - started
+        print(f'📥 一時テーブルに読み込みました（{loaded:.1f}秒）: '
+              + ', '.join(f'{key} {count:,}' for key, count in counts.items()))
+
+        # ID のないレコード（古いエクスポート）には既存の最大値の続きを振る
+        for table, _, _ in STAGES.values():
+            cur.execute(f'''
+                UPDATE stage_{table} s SET id = n.new_id
+                FROM (SELECT ctid, (SELECT COALESCE(max(id), 0) FROM stage_{table})
+                                   + row_number() OVER () AS new_id
+                      FROM stage_{table} WHERE id IS NULL) n
+                WHERE s.ctid = n.ctid''')
+
+        # ここから COMMIT まで4テーブルとも ACCESS EXCLUSIVE ロック中
+        swap_started = time.time()
+        cur.execute('TRUNCATE users, courses, learning_records, progress RESTART IDENTITY CASCADE')
+        inserted = {}
+        for key, sql in SWAP_SQL.items():
+            cur.execute(sql)
+            inserted[key] = cur.rowcount
+        for table, _, _ in STAGES.values():
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                        f"COALESCE((SELECT max(id) FROM {table}), 0) + 1, false)")
+        cur.execute("SELECT to_regclass('data_revision') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute('UPDATE data_revision SET revision = revision + 1 WHERE id = 1')
+        conn.commit()
+        print(f'🔁 本番テーブルを置き換えました（ロック保持 {time.time() - swap_started:.2f}秒）')
+
+    skipped = counts['learningRecords'] - inserted['learningRecords']
+    if skipped:
+        print(f'⚠️ 存在しないユーザー・コースを参照する学習記録 {skipped:,} 件を除外しました')
+    return inserted
+
+
+def export_data(conn, out):
+    """サーバー側カーソルで1行ずつ読み、/api/export 形式で書き出す"""
+    counts = {}
+    out.write(b'{\n')
+    for key, sql in EXPORT_SQL.items():
+        out.write(f'  "{key}": ['.encode('utf-8'))
+        count = 0
+        with conn.cursor(name=f'export_{key}') as cur:
+            cur.itersize = FETCH_ROWS[key]
+            cur.execute(sql)
+            for (row,) in cur:
+                out.write((',\n    ' if count else '\n    ').encode('utf-8'))
+                out.write(row.encode('utf-8'))
+                count += 1
+        out.write(('\n  ],\n' if count else '],\n').encode('utf-8'))
+        counts[key] = count
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('data_revision') IS NOT NULL")
+        revision = 0
+        if cur.fetchone()[0]:
+            cur.execute('SELECT revision FROM data_revision WHERE id = 1')
+            row = cur.fetchone()
+            revision = int(row[0]) if row else 0
+    conn.commit()
+    last_updated = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+    out.write(f'  "revision": {revision},\n  "lastUpdated": "{last_updated}"\n}}\n'.encode('utf-8'))
+    return counts
+
+
+# ===========================================
+# CLI
+# ===========================================
+
+def main():
+    parser = argparse.ArgumentParser(description='PostgreSQL 版データのインポート / エクスポート')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                        help='接続先（既定: 環境変数 DATABASE_URL）')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('export', help='/api/export 形式でストリーム出力')
+    p.add_argument('-o', '--output', default='-', help='出力ファイル（.gz で gzip, 既定: 標準出力）')
+    p.add_argument('--gzip', action='store_true', help='gzip で圧縮する')
+
+    p = sub.add_parser('import', help='JSON / NDJSON チャンクを COPY で一括インポート')
+    p.add_argument('inputs', nargs='+', help='エクスポートJSON（.gz 可）、NDJSON ファイルまたはディレクトリ')
+    p.add_argument('--dry-run', action='store_true', help='読み込んで件数だけ表示')
+
+    p = sub.add_parser('to-ndjson', help='エクスポートJSONを NDJSON チャンクに変換')
+    p.add_argument('inputs', nargs='+', help='エクスポートJSON（.gz 可、- は標準入力）')
+    p.add_argument('-o', '--output', required=True, help='出力ディレクトリ')
+    p.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                   help=f'1ファイルあたりの件数（既定: {DEFAULT_CHUNK_ROWS}）')
+    p.add_argument('--gzip', action='store_true', help='チャンクを gzip で圧縮する')
+    args = parser.parse_args()
+
+    started = time.time()
+    inputs = getattr(args, 'inputs', [])
+    missing = [path for path in inputs if path != '-' and not os.path.exists(path)]
+    if missing:
+        print(f"❌ エラー: 入力が見つかりません: {', '.join(missing)}")
+        sys.exit(1)
+    # 標準出力にエクスポートする場合は JSON を汚さないよう標準エラーに表示
+    log = sys.stderr if args.command == 'export' and args.output == '-' else sys.stdout
+
+    if args.command == 'to-ndjson':
+        counts = to_ndjson(inputs, args.output, args.chunk_rows, args.gzip)
+        print(f"✅ NDJSON に変換しました → {args.output}: "
+              + ', '.join(f'{key} {count:,}' for key, count in counts.items()))
+
+    elif args.command == 'import' and args.dry_run:
+        counts = {}
+        for key, _ in iter_input(inputs):
+            counts[key] = counts.get(key, 0) + 1
+        print("🔍 （ドライラン）" + ', '.join(f'{key} {count:,}' for key, count in counts.items()))
+
+    elif args.command == 'import':
+        with connect(args.database_url) as conn:
+            inserted = import_data(conn, inputs)
+        print("✅ インポートが完了しました: " + ', '.join(f'{key} {count:,}' for key, count in inserted.items()))
+
+    else:
+        context, gzip_output = _open_output(args.output, args.gzip)
+        with connect(args.database_url) as conn, context as raw:
+            out = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) if gzip_output else raw
+            try:
+                counts = export_data(conn, out)
+            finally:
+                if out is not raw:
+                    out.close()
+        print("✅ エクスポートが完了しました: " + ', '.join(f'{key} {count:,}' for key, count in counts.items()),
+              file=log)
+
+    print(f"⏱️ {time.time() - started:.1f}秒", file=log)
+
+if __name__ == '__main__':
+    main()
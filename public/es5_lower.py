@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+ES5 互換への書き換え（オプショナルチェーニングとアロー関数）
+
+patch_engine.py が互換性版（compatible ターゲット）を出力するときに、修正で
+差し替えるテキストを変換します。以前の互換性版テンプレートと同じく、古いブラウザで
+構文エラーになる次の2つだけを書き換え、それ以外（const / let、テンプレート
+リテラルなど）はそのまま残します。
+
+    a?.b.c          →  (a == null ? undefined : a.b.c)
+    a?.[i] / a?.()  →  (a == null ? undefined : a[i]) / (a == null ? undefined : a())
+    c => c.id       →  function(c) { return c.id; }
+    () => { ... }   →  function() { ... }    （this を使う場合は (function() { ... }).bind(this)）
+
+文字列・コメント・正規表現・テンプレートリテラルの中は書き換えません。
+変換結果はテキストごとにキャッシュします（同じテンプレートは1プロセスで1回だけ変換）。
+
+    from es5_lower import lower
+    lower("const course = AppData.courses.find(c => c.id === id);")
+"""
+
+import functools
+import re
+
+# 変換の規則を変えたら上げる（patch_engine のキャッシュの版に含める）
+VERSION = 1
+
+_SPECIAL = re.compile(r'[{}()\[\]\'"`/]')
+_TEMPLATE_SPECIAL = re.compile(r'[`\\$]')
+_STRING_END = {
+    "'": re.compile(r"[\\'\n]"),
+    '"': re.compile(r'[\\"\n]'),
+}
+_IDENT_BEFORE = re.compile(r'([A-Za-z_$][\w$]*)\s*$')
+_ASYNC_BEFORE = re.compile(r'\basync\s+$')
+_THIS = re.compile(r'\bthis\b')
+_ARGUMENTS = re.compile(r'\barguments\b')
+
+# `/` の直前がこれらなら正規表現リテラル（patch_engine.py と同じ判定）
+_REGEX_PREFIX_CHARS = set('(,=:[!&|?{};+-*%<>~^')
+_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw',
+             'yield', 'await', 'instanceof', 'if', 'while', 'for', 'switch', 'catch', 'with'}
+
+# 改行の前後がこれらなら式が次の行に続く
+_CONTINUE_BEFORE = set('+-*/%=&|^<>!?:,.(')
+_CONTINUE_AFTER = set('.?:+-*/%&|^=<>')
+
+
+class LoweringError(ValueError):
+    """変換できない構文（arguments を使うアロー関数、呼び出しを含む ?. の左辺など）"""
+
+
+def _is_ident(ch):
+    return ch.isalnum() or ch in '_$'
+
+
+def _prev_nonspace(text, pos):
+    pos -= 1
+    while pos >= 0 and text[pos] in ' \t\r\n':
+        pos -= 1
+    return pos
+
+
+def _next_nonspace(text, pos):
+    n = len(text)
+    while pos < n and text[pos] in ' \t\r\n':
+        pos += 1
+    return pos
+
+
+def _is_regex_start(text, pos):
+    prev = _prev_nonspace(text, pos)
+    if prev < 0 or text[prev] in _REGEX_PREFIX_CHARS:
+        return True
+    if _is_ident(text[prev]):
+        m = _IDENT_BEFORE.search(text, max(0, prev - 16), prev + 1)
+        return bool(m and m.group(1) in _KEYWORDS)
+    return False
+
+
+def _skip_regex(text, pos):
+    i = pos + 1
+    n = len(text)
+    in_class = False
+    while i < n:
+        ch = text[i]
+        if ch == '\\':
+            i += 2
+            continue
+        if ch == '\n':
+            return i
+        if in_class:
+            if ch == ']':
+                in_class = False
+        elif ch == '[':
+            in_class = True
+        elif ch == '/':
+            return i + 1
+        i += 1
+    return n
+
+
+def _scan(text):
+    """(コード部分のマスク, 括弧の対応) を返す
+
+    マスクは文字列・コメント・正規表現・テンプレートリテラルの本文が 0、それ以外が 1。
+    括弧の対応は開き → 閉じ、閉じ → 開きの両方向（テンプレートの ${ } も含む）。
+    """
+    n = len(text)
+    code = bytearray(b'\x01') * n
+    match = {}
+    stack = []      # (テンプレートの ${ か, 開き括弧の位置)
+    pos = 0
+    in_template = False
+
+    def blank(start, end):
+        end = min(end, n)
+        code[start:end] = bytes(end - start)
+
+    while pos < n:
+        if in_template:
+            m = _TEMPLATE_SPECIAL.search(text, pos)
+            if not m:
+                blank(pos, n)
+                break
+            i = m.start()
+            ch = m.group()
+            if ch == '\\':
+                blank(pos, i + 2)
+                pos = i + 2
+            elif ch == '`':
+                blank(pos, i + 1)
+                in_template = False
+                pos = i + 1
+            elif text.startswith('${', i):
+                blank(pos, i + 1)
+                stack.append((True, i + 1))
+                in_template = False
+                pos = i + 2
+            else:
+                blank(pos, i + 1)
+                pos = i + 1
+            continue
+
+        m = _SPECIAL.search(text, pos)
+        if not m:
+            break
+        i = m.start()
+        ch = m.group()
+        if ch in '\'"':
+            pattern = _STRING_END[ch]
+            j = i + 1
+            while True:
+                sm = pattern.search(text, j)
+                if not sm:
+                    end = n
+                    break
+                if sm.group() == '\\':
+                    j = sm.start() + 2
+                    continue
+                end = sm.start() + 1
+                break
+            blank(i, end)
+            pos = end
+        elif ch == '`':
+            blank(i, i + 1)
+            in_template = True
+            pos = i + 1
+        elif ch == '/':
+            nxt = text[i + 1:i + 2]
+            if nxt == '/':
+                eol = text.find('\n', i)
+                end = n if eol < 0 else eol
+            elif nxt == '*':
+                close = text.find('*/', i + 2)
+                end = n if close < 0 else close + 2
+            elif _is_regex_start(text, i):
+                end = _skip_regex(text, i)
+            else:
+                end = i
+            if end > i:
+                blank(i, end)
+                pos = end
+            else:
+                pos = i + 1
+        elif ch in '([{':
+            stack.append((False, i))
+            pos = i + 1
+        else:
+            if stack:
+                in_substitution, open_pos = stack.pop()
+                match[open_pos] = i
+                match[i] = open_pos
+                in_template = in_substitution
+            pos = i + 1
+    return code, match
+
+
+def _find_code(text, code, needle, reverse=False):
+    """コード部分にある needle の位置（reverse なら最後のもの）。なければ -1"""
+    if reverse:
+        i = text.rfind(needle)
+        while i >= 0 and not code[i]:
+            i = text.rfind(needle, 0, i)
+        return i
+    i = text.find(needle)
+    while i >= 0 and not code[i]:
+        i = text.find(needle, i + 1)
+    return i
+
+
+# ===========================================
+# アロー関数
+# ===========================================
+
+def _continues(text, start, pos):
+    """pos の改行で式が終わらず、次の行に続くか"""
+    prev = _prev_nonspace(text, pos)
+    if prev >= start and text[prev] in _CONTINUE_BEFORE:
+        return True
+    nxt = _next_nonspace(text, pos)
+    return nxt < len(text) and text[nxt] in _CONTINUE_AFTER
+
+
+def _expression_end(text, code, match, pos):
+    """pos から始まる式（アロー関数の本体）の終わりの位置"""
+    n = len(text)
+    i = pos
+    while i < n:
+        if not code[i]:
+            i += 1
+            continue
+        ch = text[i]
+        if ch in '([{':
+            close = match.get(i)
+            if close is None:
+                return n
+            i = close + 1
+            continue
+        if ch in ')]};,':
+            return i
+        if ch == '\n' and not _continues(text, pos, i):
+            return i
+        i += 1
+    return n
+
+
+def _in_code(pattern, text, code, start, end):
+    """start〜end のコード部分に pattern があるか"""
+    return any(code[m.start()] for m in pattern.finditer(text, start, end))
+
+
+def _lower_arrow(text, code, match, arrow):
+    """arrow（`=>` の位置）のアロー関数を function 式にしたテキストを返す"""
+    p = _prev_nonspace(text, arrow)
+    if p >= 0 and text[p] == ')' and p in match:
+        params_start = match[p]
+        params = text[params_start + 1:p]
+    elif p >= 0 and _is_ident(text[p]):
+        params_start = p
+        while params_start > 0 and _is_ident(text[params_start - 1]):
+            params_start -= 1
+        params = text[params_start:p + 1]
+    else:
+        raise LoweringError(f'アロー関数の引数を特定できません: {text[max(0, arrow - 40):arrow + 2]!r}')
+    prefix = ''
+    m = _ASYNC_BEFORE.search(text, max(0, params_start - 16), params_start)
+    if m:
+        params_start = m.start()
+        prefix = 'async '
+
+    b = _next_nonspace(text, arrow + 2)
+    if text[b:b + 1] == '{' and b in match:
+        end = match[b] + 1
+        body = text[b:end]
+        function = f'{prefix}function({params}) {body}'
+    else:
+        end = _expression_end(text, code, match, b)
+        body = text[b:end].rstrip()
+        end = b + len(body)
+        function = f'{prefix}function({params}) {{ return {body}; }}'
+
+    if _in_code(_ARGUMENTS, text, code, b, end) and 'function' not in body:
+        raise LoweringError(f'arguments を使うアロー関数は変換できません: {text[params_start:end]!r}')
+    if _in_code(_THIS, text, code, b, end):
+        function = f'({function}).bind(this)'
+    return text[:params_start] + function + text[end:]
+
+
+def _lower_arrows(text):
+    # 最後の `=>` から変換する（本体に未変換のアロー関数が残らない）
+    while True:
+        code, match = _scan(text)
+        arrow = _find_code(text, code, '=>', reverse=True)
+        if arrow < 0:
+            return text
+        text = _lower_arrow(text, code, match, arrow)
+
+
+# ===========================================
+# オプショナルチェーニング
+# ===========================================
+
+def _find_optional(text, code):
+    """コード部分の `?.`（`x ?.5 : y` の三項演算子は除く）の位置。なければ -1"""
+    i = _find_code(text, code, '?.')
+    while i >= 0 and text[i + 2:i + 3].isdigit():
+        i = text.find('?.', i + 1)
+        while i >= 0 and not code[i]:
+            i = text.find('?.', i + 1)
+    return i
+
+
+def _chain_start(text, match, pos):
+    """pos の直前にあるメンバー式（a.b[0].c など）の開始位置"""
+    start = pos
+    while True:
+        p = _prev_nonspace(text, start)
+        if p < 0:
+            return start
+        ch = text[p]
+        if _is_ident(ch):
+            s = p
+            while s > 0 and _is_ident(text[s - 1]):
+                s -= 1
+            start = s
+            d = _prev_nonspace(text, s)
+            if d >= 0 and text[d] == '.' and text[d - 1:d] != '.':
+                start = d
+                continue
+            return start
+        if ch in ')]' and p in match:
+            o = match[p]
+            start = o
+            # a[0] / f(x) は左へ続く。(x || y) や return (x) はここまで
+            d = _prev_nonspace(text, o)
+            if d >= 0 and (text[d] in ')]' or _is_ident(text[d])):
+                m = _IDENT_BEFORE.search(text, max(0, d - 16), d + 1)
+                if not (m and m.group(1) in _KEYWORDS):
+                    continue
+            return start
+        return start
+
+
+def _chain_end(text, match, pos):
+    """`?.` の直後 pos から続くアクセス（.b[0].c() など）の終わりの位置"""
+    n = len(text)
+    i = pos
+    while True:
+        if i < n and text[i] in '[(' and i in match:
+            i = match[i] + 1
+        elif i < n and _is_ident(text[i]):
+            while i < n and _is_ident(text[i]):
+                i += 1
+        else:
+            raise LoweringError(f'?. の後のアクセスを特定できません: {text[max(0, pos - 40):pos + 20]!r}')
+        # 続くアクセス（改行をはさんだ .then() なども含む）
+        while True:
+            j = _next_nonspace(text, i)
+            if text.startswith('?.', j) and not text[j + 2:j + 3].isdigit():
+                i = j + 2
+                break
+            if text[j:j + 1] == '.' and text[j + 1:j + 2] != '.':
+                i = _next_nonspace(text, j + 1)
+                break
+            if i < n and text[i] in '[(' and i in match:
+                i = match[i] + 1
+                continue
+            return i
+
+
+def _lower_optionals(text):
+    # 最初の `?.` から変換する（後ろの `?.` は else 側に1回だけ現れる）
+    while True:
+        code, match = _scan(text)
+        q = _find_optional(text, code)
+        if q < 0:
+            return text
+        start = _chain_start(text, match, q)
+        if start == q:
+            raise LoweringError(f'?. の左辺を特定できません: {text[max(0, q - 40):q + 20]!r}')
+        base = text[start:q]
+        if any(code[start + i] for i, ch in enumerate(base) if ch == '('):
+            # 左辺を2回評価すると副作用が変わる
+            raise LoweringError(f'呼び出しを含む ?. の左辺は変換できません: {base!r}')
+        end = _chain_end(text, match, q + 2)
+        access = text[q + 2:end]
+        if access[:1] not in ('[', '('):
+            access = '.' + access
+        text = text[:start] + f'({base} == null ? undefined : {base}{access})' + text[end:]
+
+
+@functools.lru_cache(maxsize=512)
+def lower(source):
+    """?. とアロー関数を ES5 の形に書き換えたテキストを返す（該当なしならそのまま）"""
+    if '=>' not in source and '?.' not in source:
+        return source
+    return _lower_optionals(_lower_arrows(source))
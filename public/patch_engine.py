@@ -0,0 +1,1685 @@
+#!/usr/bin/env python3
+"""
+eラーニングシステム index.html パッチエンジン
+
+apply_complete_fix.py / apply_fix_compatible.py 共通の修正エンジンです。
+インライン <script> を1回だけ走査して関数（メソッド）の範囲を索引化し、
+各関数の修正 + debugCourseInfo の追加をオフセット単位の差し替えとして
+1回の連結で適用します。renderTrainingScreen の画像は SlideLoader
+（表示中 + 先読み分だけ取得する遅延ローダー）経由で読み込むように書き換えます。
+ユーザー・コース・学習記録を ID などで探す AppData の find / filter は、
+AppIndex（Database.load() 後に作成し、AppData の更新経路で破棄して作り直す Map の索引）の
+参照にします。探索がない（または関数がない）ファイルでは、これらの修正は「該当なし」です。
+
+    from patch_engine import apply_fixes
+    fixed = apply_fixes(html_content, target='modern')
+
+出力ターゲット（TARGETS）:
+    modern      テンプレートのまま
+    compatible  置換テキストの ?. とアロー関数を es5_lower.py で ES5 の形に変換（古いブラウザ用）
+
+索引作成と修正箇所の照合は入力ごとに1回で、ターゲットごとに行うのは置換テキストの
+変換と連結だけです。1回の実行で両方を出力できます:
+    python3 apply_complete_fix.py index.html --targets modern,compatible
+
+複数ファイルの一括処理（プロセスプールで並列実行）:
+    python3 apply_complete_fix.py --batch 'index.html.backup.*' tenants/ -j 4
+
+修正ごとのプロファイル表示と時間制限（既定 30 秒 / 修正）:
+    python3 apply_complete_fix.py index.html --profile --budget 5
+
+適用した修正には版とハッシュのマーカー（patch_state.py）を埋め込み、再実行時は
+対象が変わった修正だけを適用し直します。変更のないファイルは内容ハッシュの
+キャッシュで判定し、索引作成も省略します。
+"""
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import signal
+import sys
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from es5_lower import VERSION as LOWERING_VERSION, LoweringError, lower
+from patch_state import (PatchCache, file_hash, find_markers, is_intact, marker,
+                         patch_set_version, strip_markers, text_hash)
+from snapshot_store import snapshot
+
+# 索引対象のコメントマーカー
+BOOTSTRAP_MARKER = 'アプリ起動'
+
+# 修正1件あたりの既定の制限時間（秒）
+DEFAULT_BUDGET = 30.0
+
+_SCRIPT_OPEN = re.compile(r'<script\b([^>]*)>', re.IGNORECASE)
+_SCRIPT_CLOSE = re.compile(r'</script\s*>', re.IGNORECASE)
+_CODE_SPECIAL = re.compile(r'[{}()\[\];\'"`/]')
+_TEMPLATE_SPECIAL = re.compile(r'[`\\$]')
+_STRING_END = {
+    "'": re.compile(r"[\\'\n]"),
+    '"': re.compile(r'[\\"\n]'),
+}
+_IDENT_BEFORE = re.compile(r'([A-Za-z_$][\w$]*)\s*$')
+_WORD_BEFORE_PAREN = re.compile(r'(?:(async|function)\s+)?([A-Za-z_$][\w$]*)\s*$')
+
+# `/` の直前がこれらの文字なら正規表現リテラルとみなす
+_REGEX_PREFIX_CHARS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_PREFIX_WORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw', 'yield', 'await'}
+_NON_METHOD_WORDS = {'if', 'for', 'while', 'switch', 'catch', 'with', 'function', 'return', 'typeof'}
+
+
+class PatchError(Exception):
+    """パッチ適用に失敗した場合の例外"""
+
+
+class PatchTimeout(PatchError):
+    """修正1件の処理が制限時間を超えた場合の例外"""
+
+    def __init__(self, label, seconds):
+        super().__init__(f'{label} の処理が制限時間 {seconds:g} 秒を超えたため中断しました')
+        self.label = label
+        self.seconds = seconds
+
+
+@contextmanager
+def time_budget(seconds, label):
+    """seconds 秒を超えたら PatchTimeout を送出する（メインスレッドのみ有効）"""
+    if (not seconds or not hasattr(signal, 'setitimer')
+            or threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+
+    def on_timeout(signum, frame):
+        raise PatchTimeout(label, seconds)
+
+    previous = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+@dataclass
+class MethodSpan:
+    """メソッド / 関数宣言の範囲（すべて HTML 全体での絶対オフセット）"""
+    name: str
+    start: int          # ヘッダー（async / function を含む）の開始位置
+    body_start: int     # 本体の `{` の位置
+    body_end: int       # 本体の `}` の位置
+    is_async: bool = False
+
+
+@dataclass
+class ScriptIndex:
+    """インラインスクリプトの走査結果"""
+    text: str
+    methods: dict = field(default_factory=dict)
+    pairs: dict = field(default_factory=dict)
+    opens: list = field(default_factory=list)
+    semicolons: list = field(default_factory=list)
+    markers: dict = field(default_factory=dict)
+    regions: list = field(default_factory=list)
+    fallbacks: set = field(default_factory=set)
+
+    def method(self, name):
+        """最初に定義された name のメソッドを返す（なければ None）"""
+        spans = self.methods.get(name)
+        return spans[0] if spans else None
+
+    def find_method(self, name):
+        """索引から name を探し、なければファイル全体を走査して探す"""
+        span = self.method(name)
+        if span:
+            return span
+        if name not in self.text:
+            return None
+        self.fallbacks.add(name)
+        gap = r'(?:\s|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)*'
+        pattern = re.compile(r'(?:\b(async)\s+)?\b' + re.escape(name) + r'\s*\([^()]*\)' + gap + r'\{')
+        for m in pattern.finditer(self.text):
+            brace = m.end() - 1
+            if brace in self.pairs:
+                return MethodSpan(name, m.start(), brace, self.pairs[brace], bool(m.group(1)))
+        return None
+
+    def statement_end(self, pos, limit=None):
+        """pos から始まる文の終端 `;` の位置を返す（括弧の中はスキップ）"""
+        limit = len(self.text) if limit is None else limit
+        while pos < limit:
+            i = bisect_left(self.semicolons, pos)
+            semi = self.semicolons[i] if i < len(self.semicolons) else limit
+            j = bisect_left(self.opens, pos)
+            opener = self.opens[j] if j < len(self.opens) else limit
+            if semi < opener:
+                return semi if semi < limit else -1
+            if opener >= limit:
+                return -1
+            pos = self.pairs.get(opener, limit) + 1
+        return -1
+
+    def block_end(self, brace_pos):
+        """if ブロックの `}` の位置を返す（続く else / else if も含める）"""
+        end = self.pairs.get(brace_pos)
+        if end is None:
+            return -1
+        text = self.text
+        while True:
+            k = _skip_ws(text, end + 1)
+            if not text.startswith('else', k):
+                return end
+            k = _skip_ws(text, k + 4)
+            if text.startswith('if', k):
+                k = text.find('{', k)
+                if k < 0:
+                    return end
+            elif text[k:k + 1] != '{':
+                return end
+            nxt = self.pairs.get(k)
+            if nxt is None:
+                return end
+            end = nxt
+
+
+def _skip_ws(text, pos):
+    n = len(text)
+    while pos < n and text[pos] in ' \t\r\n':
+        pos += 1
+    return pos
+
+
+def _prev_significant(text, pos, floor):
+    """pos より前の空白以外の位置を返す"""
+    pos -= 1
+    while pos >= floor and text[pos] in ' \t\r\n':
+        pos -= 1
+    return pos
+
+
+def _is_regex_start(text, pos, floor):
+    prev = _prev_significant(text, pos, floor)
+    if prev < floor:
+        return True
+    ch = text[prev]
+    if ch in _REGEX_PREFIX_CHARS:
+        return True
+    if ch.isalnum() or ch in '_$':
+        m = _IDENT_BEFORE.search(text, max(floor, prev - 16), prev + 1)
+        return bool(m and m.group(1) in _REGEX_PREFIX_WORDS)
+    return False
+
+
+def _skip_regex(text, pos, end):
+    """正規表現リテラルの終端の次の位置を返す"""
+    i = pos + 1
+    in_class = False
+    while i < end:
+        ch = text[i]
+        if ch == '\\':
+            i += 2
+            continue
+        if ch == '\n':
+            return i
+        if in_class:
+            if ch == ']':
+                in_class = False
+        elif ch == '[':
+            in_class = True
+        elif ch == '/':
+            return i + 1
+        i += 1
+    return end
+
+
+def _inline_script_regions(html):
+    """src 属性を持たない <script> の本文範囲を列挙する"""
+    regions = []
+    pos = 0
+    while True:
+        m = _SCRIPT_OPEN.search(html, pos)
+        if not m:
+            return regions
+        close = _SCRIPT_CLOSE.search(html, m.end())
+        end = close.start() if close else len(html)
+        if 'src=' not in m.group(1).lower():
+            regions.append((m.end(), end))
+        pos = close.end() if close else len(html)
+
+
+def build_index(html):
+    """インラインスクリプトを1回走査し、メソッド範囲と括弧対応を索引化する"""
+    index = ScriptIndex(text=html, regions=_inline_script_regions(html))
+    for start, end in index.regions:
+        _scan_region(index, start, end)
+    return index
+
+
+def _scan_region(index, start, end):
+    text = index.text
+    pairs = index.pairs
+    opens = index.opens
+    # スタック要素: (種類, 位置, メソッド情報)
+    #   種類 'code' = 通常の括弧, 'tmpl' = テンプレートリテラルの ${
+    stack = []
+    pos = start
+    in_template = False
+    last_closed = (-1, -1)
+
+    while pos < end:
+        if in_template:
+            m = _TEMPLATE_SPECIAL.search(text, pos, end)
+            if not m:
+                return
+            ch = m.group()
+            i = m.start()
+            if ch == '\\':
+                pos = i + 2
+            elif ch == '`':
+                in_template = False
+                pos = i + 1
+            elif text.startswith('${', i):
+                stack.append(('tmpl', i + 1, None))
+                in_template = False
+                pos = i + 2
+            else:
+                pos = i + 1
+            continue
+
+        m = _CODE_SPECIAL.search(text, pos, end)
+        if not m:
+            return
+        ch = m.group()
+        i = m.start()
+
+        if ch in '\'"':
+            pattern = _STRING_END[ch]
+            j = i + 1
+            while True:
+                sm = pattern.search(text, j, end)
+                if not sm:
+                    pos = end
+                    break
+                if sm.group() == '\\':
+                    j = sm.start() + 2
+                    continue
+                pos = sm.start() + 1
+                break
+        elif ch == '`':
+            in_template = True
+            pos = i + 1
+        elif ch == '/':
+            nxt = text[i + 1:i + 2]
+            if nxt == '/':
+                eol = text.find('\n', i, end)
+                eol = end if eol < 0 else eol
+                if text[i + 2:eol].strip() == BOOTSTRAP_MARKER:
+                    index.markers.setdefault(BOOTSTRAP_MARKER, []).append(i)
+                pos = eol
+            elif nxt == '*':
+                close = text.find('*/', i + 2, end)
+                pos = end if close < 0 else close + 2
+            elif _is_regex_start(text, i, start):
+                pos = _skip_regex(text, i, end)
+            else:
+                pos = i + 1
+        elif ch in '({[':
+            info = None
+            if ch == '{':
+                info = _method_header(text, i, start, last_closed)
+            stack.append(('code', i, info))
+            opens.append(i)
+            pos = i + 1
+        elif ch in ')]}':
+            if stack:
+                kind, open_pos, info = stack.pop()
+                if kind == 'tmpl':
+                    in_template = True
+                else:
+                    pairs[open_pos] = i
+                    last_closed = (i, open_pos)
+                    if info is not None:
+                        name, header_start, is_async = info
+                        index.methods.setdefault(name, []).append(
+                            MethodSpan(name, header_start, open_pos, i, is_async))
+            pos = i + 1
+        else:  # ';'
+            index.semicolons.append(i)
+            pos = i + 1
+
+
+def _method_header(text, brace_pos, floor, last_closed):
+    """`{` の直前が `name(...)` なら (名前, ヘッダー開始, async) を返す"""
+    prev = _prev_significant(text, brace_pos, floor)
+    close_pos, paren_open = last_closed
+    if prev < floor or prev != close_pos or text[prev] != ')':
+        return None
+    m = _WORD_BEFORE_PAREN.search(text, max(floor, paren_open - 64), paren_open)
+    if not m:
+        return None
+    name = m.group(2)
+    if name in _NON_METHOD_WORDS:
+        return None
+    return name, m.start(), m.group(1) == 'async'
+
+
+def line_indent(text, pos):
+    """pos を含む行のインデントを返す"""
+    line_start = text.rfind('\n', 0, pos) + 1
+    i = line_start
+    while i < len(text) and text[i] in ' \t':
+        i += 1
+    return text[line_start:i]
+
+
+def line_start(text, pos):
+    return text.rfind('\n', 0, pos) + 1
+
+
+def reindent(block, indent):
+    """テンプレート（インデント0で記述）を indent に合わせる。先頭行はそのまま"""
+    lines = block.strip('\n').split('\n')
+    return lines[0] + ''.join('\n' + (indent + line if line.strip() else '') for line in lines[1:])
+
+
+# ===========================================
+# 修正テンプレート
+# ===========================================
+
+TEMPLATES = {
+    'login': '''// 🔧 修正: 進行状況を読み込んでからコースを設定
+const progress = await Database.loadProgress(user.id);
+if (progress) {
+    AppData.savedProgress = progress;
+    // 進行状況にコースIDがある場合、そのコースを優先的に設定
+    if (progress.courseId) {
+        const course = AppData.courses.find(c => c.id === progress.courseId);
+        if (course) {
+            AppData.currentCourse = course;
+            console.log('✅ 進行状況からコースを復元:', course.title,
+                       '画像数:', course.slideImages?.length || 0);
+        }
+    }
+}
+
+// コースが設定されていない場合、デフォルトで最初のコースを設定
+if (!AppData.currentCourse && AppData.courses.length > 0) {
+    AppData.currentCourse = AppData.courses[0];
+    console.log('✅ デフォルトコースを設定:', AppData.currentCourse.title,
+               '画像数:', AppData.currentCourse.slideImages?.length || 0);
+}''',
+    'switchToLearning': '''if (AppData.courses.length > 0 && !AppData.currentCourse) {
+    AppData.currentCourse = AppData.courses[0];
+    console.log('✅ 学習画面: コースを設定:', AppData.currentCourse.title,
+               '画像数:', AppData.currentCourse.slideImages?.length || 0);
+}''',
+    'resumeLearning': '''// 🔧 修正: コース復元のログを追加
+if (AppData.savedProgress.courseId) {
+    const course = AppData.courses.find(c => c.id === AppData.savedProgress.courseId);
+    if (course) {
+        AppData.currentCourse = course;
+        console.log('✅ 学習再開: コースを復元:', course.title,
+                   '画像数:', course.slideImages?.length || 0,
+                   '現在のスライド:', AppData.learningState.slideIndex + 1);
+    } else {
+        console.warn('⚠️ 警告: 進行状況のコースID', AppData.savedProgress.courseId,
+                    'が見つかりません');
+        // フォールバック: デフォルトコースを使用
+        if (AppData.courses.length > 0) {
+            AppData.currentCourse = AppData.courses[0];
+            console.log('✅ デフォルトコースを使用:', AppData.currentCourse.title);
+        }
+    }
+} else {
+    console.warn('⚠️ 警告: 進行状況にcourseIdがありません');
+    if (!AppData.currentCourse && AppData.courses.length > 0) {
+        AppData.currentCourse = AppData.courses[0];
+        console.log('✅ デフォルトコースを設定:', AppData.currentCourse.title);
+    }
+}''',
+    'renderTrainingScreen': '''console.log('🖼️ スライド表示:', {
+    slideIndex: state.slideIndex + 1,
+    totalSlides: totalSlides,
+    hasCourse: !!AppData.currentCourse,
+    courseTitle: AppData.currentCourse?.title || 'なし',
+    courseImageCount: courseImages.length,
+    willShowCourseImage: courseImages.length > state.slideIndex,
+    willShowDemoImage: slideImages.length > state.slideIndex
+});''',
+    'startFromBeginning': '''// 🔧 修正: コース設定の確認とログ追加
+if (!AppData.currentCourse && AppData.courses.length > 0) {
+    AppData.currentCourse = AppData.courses[0];
+    console.log('✅ 最初から開始: コースを設定:', AppData.currentCourse.title,
+               '画像数:', AppData.currentCourse.slideImages?.length || 0);
+} else if (AppData.currentCourse) {
+    console.log('✅ 最初から開始: 既存コースを使用:', AppData.currentCourse.title,
+               '画像数:', AppData.currentCourse.slideImages?.length || 0);
+} else {
+    console.error('❌ エラー: 利用可能なコースがありません');
+    alert('エラー: 利用可能なコースがありません。管理者に連絡してください。');
+    return;
+}''',
+    'startTraining': '''// 🔧 修正: コース確認とログ追加
+if (!AppData.currentCourse && AppData.courses.length > 0) {
+    AppData.currentCourse = AppData.courses[0];
+    console.log('✅ 研修開始: コースを設定:', AppData.currentCourse.title,
+               '画像数:', AppData.currentCourse.slideImages?.length || 0);
+} else if (!AppData.currentCourse) {
+    console.error('❌ エラー: 利用可能なコースがありません');
+    alert('エラー: 利用可能なコースがありません。管理者に連絡してください。');
+    return;
+} else {
+    console.log('✅ 研修開始: 既存コースを使用:', AppData.currentCourse.title,
+               '画像数:', AppData.currentCourse.slideImages?.length || 0);
+}''',
+    'debugCourseInfo': '''function debugCourseInfo() {
+    console.log('=== コース情報 ===');
+    console.log('現在のコース:', AppData.currentCourse?.title || '未設定');
+    console.log('コースID:', AppData.currentCourse?.id || '未設定');
+    console.log('総コース数:', AppData.courses.length);
+    console.log('スライド画像数:', AppData.currentCourse?.slideImages?.length || 0);
+
+    if (AppData.currentCourse?.slideImages?.length > 0) {
+        console.log('画像1サンプル:', AppData.currentCourse.slideImages[0].data?.substring(0, 50) + '...');
+    }
+
+    console.log('現在のユーザー:', AppData.currentUser?.name || '未ログイン');
+    console.log('学習状態:', AppData.learningState.screen);
+    console.log('現在のスライド:', AppData.learningState.slideIndex + 1);
+
+    return '✅ デバッグ情報をコンソールに出力しました';
+}''',
+}
+
+# 出力ターゲット → 差し替えテキストの変換（None は変換なし）
+# compatible は es5_lower.py で ?. とアロー関数を ES5 の形に書き換える（古いブラウザ用）
+TARGETS = {
+    'modern': None,
+    'compatible': lower,
+}
+
+# スライド画像の遅延読み込み（modern / compatible 共通。アロー関数・?. は使わない）
+# 表示中のスライドと次の LOOKAHEAD 枚だけを取得し、デコード済み画像を
+# 最大 CACHE_SIZE 件の LRU に保持する。範囲外になった取得は中断する。
+SLIDE_LOADER = '''const SlideLoader = {
+    LOOKAHEAD: 2,
+    CACHE_SIZE: 6,
+    cache: new Map(),      // キー → objectURL またはデータURI（挿入順 = LRU順）
+    pending: new Map(),    // キー → { index, controller }
+    courseId: null,
+
+    key(course, index) {
+        return course.id + ':' + index;
+    },
+
+    count(course) {
+        if (!course) return 0;
+        if (course.slideImages && course.slideImages.length > 0) return course.slideImages.length;
+        return course.slideCount || 0;
+    },
+
+    // 表示する画像のURLを返す（未取得なら null）。あわせて先読みを更新する
+    show(course, index, total) {
+        if (!course) return null;
+        if (this.courseId !== course.id) {
+            this.reset();
+            this.courseId = course.id;
+        }
+        this.prefetch(course, index, Math.min(total || this.count(course), this.count(course)));
+
+        const key = this.key(course, index);
+        if (this.cache.has(key)) {
+            const src = this.cache.get(key);
+            this.cache.delete(key);
+            this.cache.set(key, src);
+            return src;
+        }
+        const slide = course.slideImages && course.slideImages[index];
+        if (slide && slide.data && !this.isRemote(slide.data)) {
+            return slide.data;
+        }
+        // 取得前のURL画像はそのまま表示（ブラウザキャッシュを共有する）
+        return slide && slide.data ? slide.data : null;
+    },
+
+    isRemote(src) {
+        return src.indexOf('data:') !== 0 && src.indexOf('blob:') !== 0;
+    },
+
+    prefetch(course, index, total) {
+        const last = Math.min(index + this.LOOKAHEAD, total - 1);
+        // 先読み範囲外の取得を中断（スライドを飛ばした場合）
+        const self = this;
+        this.pending.forEach(function(entry, key) {
+            if (entry.index < index || entry.index > last) {
+                entry.controller.abort();
+                self.pending.delete(key);
+            }
+        });
+        for (let i = index; i <= last; i++) {
+            this.load(course, i, i === index);
+        }
+    },
+
+    load(course, index, isCurrent) {
+        const key = this.key(course, index);
+        if (this.cache.has(key) || this.pending.has(key)) return;
+
+        const slide = course.slideImages && course.slideImages[index];
+        let url;
+        if (slide && slide.data) {
+            if (!this.isRemote(slide.data)) return;
+            url = slide.data;
+        } else if (course.slideCount) {
+            const base = typeof Database !== 'undefined' && Database.API_BASE ? Database.API_BASE : '';
+            url = base + '/api/courses/' + course.id + '/slides/' + index + '?format=image';
+        } else {
+            return;
+        }
+
+        const controller = typeof AbortController !== 'undefined' ? new AbortController() : { abort: function() {}, signal: undefined };
+        const self = this;
+        this.pending.set(key, { index: index, controller: controller });
+        fetch(url, { signal: controller.signal })
+            .then(function(response) {
+                if (!response.ok) throw new Error('HTTP ' + response.status);
+                return response.blob();
+            })
+            .then(function(blob) {
+                const src = URL.createObjectURL(blob);
+                const image = new Image();
+                image.src = src;
+                const decoded = image.decode ? image.decode() : Promise.resolve();
+                return decoded.then(function() { return src; }, function() { return src; });
+            })
+            .then(function(src) {
+                if (self.pending.get(key) === undefined || self.courseId !== course.id) {
+                    URL.revokeObjectURL(src);
+                    return;
+                }
+                self.pending.delete(key);
+                self.store(key, src);
+                self.refresh(course, index, src);
+            })
+            .catch(function(error) {
+                self.pending.delete(key);
+                if (error.name !== 'AbortError') {
+                    console.warn('⚠️ スライド画像の取得に失敗:', index + 1, error.message);
+                }
+            });
+    },
+
+    store(key, src) {
+        this.cache.set(key, src);
+        while (this.cache.size > this.CACHE_SIZE) {
+            const oldest = this.cache.keys().next().value;
+            this.release(this.cache.get(oldest));
+            this.cache.delete(oldest);
+        }
+    },
+
+    // 表示中のスライドの読み込みが終わったら画像だけ差し替える
+    refresh(course, index, src) {
+        const state = AppData.learningState;
+        if (!state || state.slideIndex !== index || AppData.currentCourse !== course) return;
+        const img = document.querySelector('img.slide-image');
+        if (img) {
+            img.src = src;
+        } else if (typeof App !== 'undefined' && App.render) {
+            App.render();
+        }
+    },
+
+    release(src) {
+        if (src && src.indexOf('blob:') === 0) URL.revokeObjectURL(src);
+    },
+
+    reset() {
+        const self = this;
+        this.pending.forEach(function(entry) { entry.controller.abort(); });
+        this.pending.clear();
+        this.cache.forEach(function(src) { self.release(src); });
+        this.cache.clear();
+    }
+};'''
+
+# renderTrainingScreen の画像参照を SlideLoader 経由にする
+EAGER_CONDITION = 'if (courseImages.length > state.slideIndex) {'
+LAZY_CONDITION = 'if (SlideLoader.count(AppData.currentCourse) > state.slideIndex) {'
+EAGER_READ = 'imageToShow = courseImages[state.slideIndex].data;'
+LAZY_READ = 'imageToShow = SlideLoader.show(AppData.currentCourse, state.slideIndex, totalSlides);'
+
+# AppData の索引（modern / compatible 共通。アロー関数・?. は使わない）
+# コレクションの配列ごとに フィールド → Map(値 → [レコード]) を作り、find / filter の線形探索を
+# 置き換える。Database.load() の後に作成し、AppData を書き換える経路（save() の呼び出し時と
+# 完了時、update_html.py 版 Database の apply() と採番IDの反映）で invalidate() して、次の参照で
+# 作り直す。配列の差し替えと件数の変化も作り直しの契機にするが、件数の変わらない変更
+# （キーの書き換え・削除と追加）は invalidate() で検出する。
+APP_INDEX = '''const AppIndex = {
+    // コレクション → 索引を作るフィールド（INDEXED_FIELDS と合わせる）
+    FIELDS: {
+        users: ['id', 'username'],
+        courses: ['id'],
+        learningRecords: ['userId', 'courseId']
+    },
+    indexes: {},    // コレクション → { list, count, maps: フィールド → Map }
+
+    // 索引を作り直す（name を省略するとすべて）
+    build(name) {
+        if (!name) {
+            for (const each in this.FIELDS) this.build(each);
+            return;
+        }
+        const list = AppData[name] || [];
+        const fields = this.FIELDS[name];
+        const maps = {};
+        fields.forEach(function(field) { maps[field] = new Map(); });
+        for (let i = 0; i < list.length; i++) {
+            const record = list[i];
+            for (let j = 0; j < fields.length; j++) {
+                const value = record[fields[j]];
+                const bucket = maps[fields[j]].get(value);
+                if (bucket) {
+                    bucket.push(record);
+                } else {
+                    maps[fields[j]].set(value, [record]);
+                }
+            }
+        }
+        this.indexes[name] = { list: list, count: list.length, maps: maps };
+    },
+
+    // 索引を破棄する（name を省略するとすべて）。次の参照で作り直す
+    invalidate(name) {
+        if (name) {
+            delete this.indexes[name];
+        } else {
+            this.indexes = {};
+        }
+    },
+
+    // 索引を返す（破棄済み・配列の差し替え・件数の変化があれば作り直す）
+    ensure(name) {
+        const index = this.indexes[name];
+        const list = AppData[name] || [];
+        if (!index || index.list !== list || index.count !== list.length) {
+            this.build(name);
+        }
+        return this.indexes[name];
+    },
+
+    // AppData[name].find(r => r[field] === value) と同じ結果
+    find(name, field, value) {
+        const bucket = this.ensure(name).maps[field].get(value);
+        return bucket ? bucket[0] : undefined;
+    },
+
+    // AppData[name].filter(r => r[field] === value) と同じ結果（新しい配列）
+    filter(name, field, value) {
+        const bucket = this.ensure(name).maps[field].get(value);
+        return bucket ? bucket.slice() : [];
+    },
+
+    // load() の後に作成する。save() は呼び出し時（直前の AppData の変更）と
+    // 完了時（サーバーが採番したIDの反映）に破棄する（import() は load() を呼ぶ）
+    attach(database) {
+        const self = this;
+        ['load', 'save'].forEach(function(method) {
+            const original = database[method];
+            if (typeof original !== 'function' || original.indexed) return;
+            const wrapped = function() {
+                if (method === 'save') self.invalidate();
+                const result = original.apply(this, arguments);
+                const update = function() {
+                    if (method === 'load') {
+                        self.build();
+                    } else {
+                        self.invalidate();
+                    }
+                };
+                Promise.resolve(result).then(update, update);
+                return result;
+            };
+            wrapped.indexed = true;
+            database[method] = wrapped;
+        });
+    }
+};
+if (typeof Database !== 'undefined') {
+    AppIndex.attach(Database);
+}'''
+
+# AppIndex で引けるフィールド（APP_INDEX の FIELDS と合わせる）
+INDEXED_FIELDS = {
+    'users': ('id', 'username'),
+    'courses': ('id',),
+    'learningRecords': ('userId', 'courseId'),
+}
+
+# AppData.<コレクション>.find / filter(x => x.<フィールド> === <値> [&& 残りの条件])
+_LINEAR_LOOKUP = re.compile(
+    r'AppData\.(users|courses|learningRecords)\.(find|filter)\(\s*([A-Za-z_$][\w$]*)\s*=>\s*'
+    r'\3\.([A-Za-z_$][\w$]*)\s*===\s*([A-Za-z_$][\w$]*(?:\.[A-Za-z_$][\w$]*)*)\s*(\)|&&)')
+# 索引化の対象（置き換え前の線形探索と置き換え後の AppIndex 呼び出し）
+_LOOKUP_SITE = re.compile(r'AppData\.(?:users|courses|learningRecords)\.(?:find|filter)\(|AppIndex\.(?:find|filter)\(')
+_CHAINED_LOOKUP = re.compile(r'\.(?:find|filter)\(')
+
+# 特定関数の戻り値: 修正の対象がない（不一致ではない）
+NOT_APPLICABLE = 'not-applicable'
+
+DEBUG_COMMENT = '// デバッグユーティリティ'
+DEBUG_EXPORT = '''
+// グローバルスコープに追加
+if (typeof window !== 'undefined') {
+    window.debugCourseInfo = debugCourseInfo;
+}'''
+
+
+# ===========================================
+# 修正箇所の特定（すべて (開始, 終了, 置換テキスト) を返す）
+# ===========================================
+
+def _locate_login(index, template):
+    m = index.find_method('login')
+    if not m:
+        return None
+    text = index.text
+    anchor = 'AppData.currentUser = user;'
+    a = text.find(anchor, m.body_start, m.body_end)
+    if a < 0:
+        return None
+    region_start = a + len(anchor)
+    b = -1
+    for quote in ("'", '"'):
+        b = text.find(f'if (user.role === {quote}admin{quote})', region_start, m.body_end)
+        if b >= 0:
+            break
+    if b < 0:
+        return None
+    # 間に挟まったコメント行も含めて置き換える
+    region_end = line_start(text, b)
+    indent = line_indent(text, b)
+    replacement = ('\n' + indent + '\n' + indent + reindent(_indexed(index, template), indent)
+                   + '\n' + indent + '\n')
+    if not m.is_async:
+        # テンプレートは await を使うため、同期版の login() は async にする
+        return m.start, region_end, 'async ' + _indexed(index, text[m.start:region_start]) + replacement
+    # ユーザーの検索（AppData.users.find）も索引の参照にする
+    span = _lookup_span(index, m.body_start, a) if _has_index_site(index) else None
+    if span:
+        return span[0], region_end, index_lookups(text[span[0]:region_start]) + replacement
+    return region_start, region_end, replacement
+
+
+def _locate_if_block(method_name, anchor):
+    def locate(index, template):
+        m = index.find_method(method_name)
+        if not m:
+            return None
+        text = index.text
+        a = text.find(anchor, m.body_start, m.body_end)
+        if a < 0:
+            return None
+        # 直前の「🔧 修正」コメント行も置き換え対象に含める
+        start = a
+        prev_line = line_start(text, line_start(text, a) - 1)
+        if text.startswith('// 🔧 修正', _skip_ws(text, prev_line)) and prev_line < line_start(text, a):
+            start = _skip_ws(text, prev_line)
+        end = index.block_end(a + len(anchor) - 1)
+        if end < 0:
+            return None
+        indent = line_indent(text, a)
+        return start, end + 1, reindent(_indexed(index, template), indent)
+    return locate
+
+
+def _locate_lookups(method_name):
+    # 索引化は任意の修正: 関数・索引化できる探索がない、または AppIndex を定義できない
+    # （debugCourseInfo の追加先がない）ファイルでは NOT_APPLICABLE
+    def locate(index, template):
+        if not _has_index_site(index):
+            return NOT_APPLICABLE
+        m = index.find_method(method_name)
+        if not m:
+            return NOT_APPLICABLE
+        span = _lookup_span(index, m.body_start, m.body_end)
+        if not span:
+            return NOT_APPLICABLE
+        start, end = span
+        return start, end, index_lookups(index.text[start:end])
+    return locate
+
+
+def _locate_render(index, template):
+    m = index.find_method('renderTrainingScreen')
+    if not m:
+        return None
+    text = index.text
+    a = text.find('const courseImages = ', m.body_start, m.body_end)
+    if a < 0:
+        return None
+    end = index.statement_end(a, m.body_end)
+    if end < 0:
+        return None
+    indent = line_indent(text, a)
+    statement = text[a:end + 1]
+    replacement = ('// 🔧 修正: デバッグ情報を追加\n' + indent + statement
+                   + '\n' + indent + '\n' + indent + reindent(template, indent))
+    # 直後の画像選択の if チェーンも SlideLoader 経由に書き換える
+    b = text.find(EAGER_CONDITION, end, m.body_end) if _has_loader_site(index) else -1
+    if b < 0:
+        return a, end + 1, replacement
+    chain_end = index.block_end(b + len(EAGER_CONDITION) - 1)
+    r = text.find(EAGER_READ, b, chain_end)
+    if chain_end < 0 or r < 0:
+        return a, end + 1, replacement
+    replacement += (text[end + 1:b]
+                    + '// 🔧 修正: 表示中と先読み分のスライド画像だけを読み込む\n' + indent
+                    + LAZY_CONDITION + text[b + len(EAGER_CONDITION):r]
+                    + LAZY_READ + text[r + len(EAGER_READ):chain_end + 1])
+    return a, chain_end + 1, replacement
+
+
+def _can_define(index, definition):
+    """definition がある（または debugCourseInfo と一緒に追加できる）ファイルか"""
+    return bool(definition in index.text or index.method('debugCourseInfo')
+                or index.markers.get(BOOTSTRAP_MARKER))
+
+
+def _has_loader_site(index):
+    """SlideLoader を定義できる（または定義済みの）ファイルか"""
+    return _can_define(index, 'const SlideLoader = {')
+
+
+def _has_index_site(index):
+    """AppIndex を定義できる（または定義済みの）ファイルか"""
+    return _can_define(index, 'const AppIndex = {')
+
+
+def _indexed(index, code):
+    """AppIndex を使えるファイルなら code の線形探索を索引の参照にする"""
+    return index_lookups(code) if _has_index_site(index) else code
+
+
+def _call_end(code, open_pos):
+    """open_pos の `(` に対応する `)` の位置を返す（文字列は読み飛ばす。なければ -1）"""
+    depth = 0
+    i = open_pos
+    n = len(code)
+    while i < n:
+        ch = code[i]
+        if ch in '\'"`':
+            i += 1
+            while i < n and code[i] != ch:
+                i += 2 if code[i] == '\\' else 1
+        elif ch in '([{':
+            depth += 1
+        elif ch in ')]}':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+
+def _indexable(m):
+    """_LINEAR_LOOKUP の一致が索引で引けるか（値が引数自身を参照するものは除く）"""
+    collection, _, param, field, value, _ = m.groups()
+    return field in INDEXED_FIELDS[collection] and value.split('.')[0] != param
+
+
+def index_lookups(code):
+    """索引のあるフィールドの一致で探す AppData の find / filter を AppIndex の参照にする
+
+    条件が x.<フィールド> === <値> だけなら AppIndex.find / filter に、&& で条件が続く場合は
+    AppIndex.filter で絞ってから元の find / filter で残りの条件を判定する（結果と順序は同じ）。
+    """
+    parts = []
+    pos = 0
+    while True:
+        m = _LINEAR_LOOKUP.search(code, pos)
+        if not m:
+            break
+        collection, method, param, field, value, tail = m.groups()
+        if not _indexable(m):
+            parts.append(code[pos:m.end()])
+            pos = m.end()
+            continue
+        if tail == ')':
+            lookup = f"AppIndex.{method}('{collection}', '{field}', {value})"
+            end = m.end()
+        else:
+            close = _call_end(code, m.end(2))
+            if close < 0:
+                parts.append(code[pos:m.end()])
+                pos = m.end()
+                continue
+            rest = index_lookups(code[m.end():close].strip())
+            lookup = f"AppIndex.filter('{collection}', '{field}', {value}).{method}({param} => {rest})"
+            end = close + 1
+        parts.append(code[pos:m.start()] + lookup)
+        pos = end
+    parts.append(code[pos:])
+    return ''.join(parts)
+
+
+def _lookup_span(index, start, end):
+    """start〜end にある索引化できる探索（置き換え済みの AppIndex 呼び出しを含む）全体の範囲
+
+    AppIndex.filter(...).find(...) のように続く呼び出しも含める。なければ None
+    """
+    text = index.text
+    first = last = -1
+    for m in _LOOKUP_SITE.finditer(text, start, end):
+        if text.startswith('AppData', m.start()):
+            linear = _LINEAR_LOOKUP.match(text, m.start())
+            if not linear or not _indexable(linear):
+                continue
+        close = index.pairs.get(m.end() - 1)
+        if close is None:
+            continue
+        chained = _CHAINED_LOOKUP.match(text, close + 1)
+        while chained and chained.end() - 1 in index.pairs:
+            close = index.pairs[chained.end() - 1]
+            chained = _CHAINED_LOOKUP.match(text, close + 1)
+        if first < 0:
+            first = m.start()
+        last = max(last, close)
+    return (first, last + 1) if first >= 0 else None
+
+
+# debugCourseInfo と一緒に追加する定義 (直前のコメント, 定義の先頭, 定義)
+DEFINITIONS = [
+    ('// スライド画像の遅延読み込み', 'const SlideLoader = {', SLIDE_LOADER),
+    ('// AppData の索引（ユーザー・コース・学習記録の参照）', 'const AppIndex = {', APP_INDEX),
+]
+ATTACH_GUARD = "if (typeof Database !== 'undefined') {"
+
+
+def _bootstrap_definitions(text):
+    """まだ定義されていない SlideLoader / AppIndex の定義"""
+    return ''.join(comment + '\n' + definition + '\n\n'
+                   for comment, head, definition in DEFINITIONS if head not in text)
+
+
+def _definitions_end(index, pos):
+    """pos から DEFINITIONS の定義（コメント付き）だけが並ぶ範囲の終わり（続かなければ pos）"""
+    text = index.text
+    while True:
+        k = _skip_ws(text, pos)
+        for comment, head, _ in DEFINITIONS:
+            if text.startswith(comment + '\n', k):
+                break
+        else:
+            return pos
+        k = _skip_ws(text, k + len(comment) + 1)
+        close = index.pairs.get(k + len(head) - 1) if text.startswith(head, k) else None
+        if close is None or text[close + 1:close + 2] != ';':
+            return pos
+        pos = close + 2
+        k = _skip_ws(text, pos)
+        if text.startswith(ATTACH_GUARD, k) and k + len(ATTACH_GUARD) - 1 in index.pairs:
+            pos = index.pairs[k + len(ATTACH_GUARD) - 1] + 1
+
+
+def _previous_definitions(index, start):
+    """start の直前に以前追加した SlideLoader / AppIndex の定義があればその先頭（なければ start）
+
+    修正の版が上がったとき、古い定義を残さずに新しい定義で置き換えるため
+    """
+    text = index.text
+    first = start
+    for comment, _, _ in DEFINITIONS:
+        c = text.rfind(comment + '\n', 0, start)
+        if c >= 0 and _skip_ws(text, _definitions_end(index, c)) == start:
+            first = min(first, c)
+    return first
+
+
+def _locate_bootstrap(index, template):
+    text = index.text
+    existing = index.method('debugCourseInfo')
+    if existing:
+        indent = line_indent(text, existing.start)
+        start = existing.start
+        block = template
+        # 追加する定義は直前の「デバッグユーティリティ」コメントより前に置く
+        prev_line = line_start(text, line_start(text, start) - 1)
+        if text.startswith(DEBUG_COMMENT + '\n', _skip_ws(text, prev_line)) and prev_line < line_start(text, start):
+            start = _skip_ws(text, prev_line)
+            block = DEBUG_COMMENT + '\n' + template
+        start = _previous_definitions(index, start)
+        end = existing.body_end + 1
+        return start, end, reindent(_bootstrap_definitions(text[:start] + text[end:]) + block, indent)
+    markers = index.markers.get(BOOTSTRAP_MARKER)
+    if not markers:
+        return None
+    c = markers[-1]
+    indent = line_indent(text, c)
+    block = _bootstrap_definitions(text) + DEBUG_COMMENT + '\n' + template + '\n' + DEBUG_EXPORT
+    return c, c, reindent(block, indent) + '\n\n' + indent
+
+
+# (キー, 表示ラベル, 特定関数)
+FIXES = [
+    ('login', 'login関数', _locate_login),
+    ('switchToLearning', 'switchToLearning関数',
+     _locate_if_block('switchToLearning', 'if (AppData.courses.length > 0 && !AppData.currentCourse) {')),
+    ('resumeLearning', 'resumeLearning関数',
+     _locate_if_block('resumeLearning', 'if (AppData.savedProgress.courseId) {')),
+    ('renderTrainingScreen', 'renderTrainingScreen関数', _locate_render),
+    ('startFromBeginning', 'startFromBeginning関数',
+     _locate_if_block('startFromBeginning', 'if (!AppData.currentCourse && AppData.courses.length > 0) {')),
+    ('startTraining', 'startTraining関数',
+     _locate_if_block('startTraining', 'if (!AppData.currentCourse && AppData.courses.length > 0) {')),
+    ('startLearning', 'startLearning関数', _locate_lookups('startLearning')),
+    ('addLearner', 'addLearner関数', _locate_lookups('addLearner')),
+    ('renderLearners', 'renderLearners関数', _locate_lookups('renderLearners')),
+    ('viewLearnerDetail', 'viewLearnerDetail関数', _locate_lookups('viewLearnerDetail')),
+    ('viewCertificate', 'viewCertificate関数', _locate_lookups('viewCertificate')),
+    ('debugCourseInfo', 'debugCourseInfo関数', _locate_bootstrap),
+]
+
+# 修正ごとの版（テンプレートや特定方法を変えたら上げる。古いマーカーの修正は適用し直す）
+FIX_VERSIONS = {
+    'login': 2,
+    'switchToLearning': 1,
+    'resumeLearning': 2,
+    'renderTrainingScreen': 1,
+    'startFromBeginning': 1,
+    'startTraining': 1,
+    'startLearning': 1,
+    'addLearner': 1,
+    'renderLearners': 1,
+    'viewLearnerDetail': 1,
+    'viewCertificate': 1,
+    'debugCourseInfo': 3,
+}
+
+
+def marker_key(key, target):
+    """マーカーに書く修正キー（modern 以外はターゲット名を付け、適用済みをターゲットごとに判定する）"""
+    return key if target == 'modern' else f'{key}-{target}'
+
+
+def _applied_marker(html_content, markers, key, target):
+    """key の修正の有効なマーカーを探し (マーカーのキー, 変換が必要か) を返す（なければ None）
+
+    target 自身のマーカーを優先する。他のターゲットが適用済みの場合、変換なし（modern）の
+    置換テキストは target の変換をかければよい。変換済みのもの（compatible）は modern でも
+    そのまま動くため適用済みとして扱う。
+    """
+    sources = [target] + [other for other in TARGETS if other != target]
+    for source in sources:
+        name = marker_key(key, source)
+        if is_intact(html_content, markers.get(name), FIX_VERSIONS[key]):
+            return name, source != target and TARGETS[source] is None and TARGETS[target] is not None
+    return None
+
+
+def cache_version(target):
+    """キャッシュのキーに使うパッチセットの版（修正の版 + テンプレートの内容 + 変換の版）"""
+    source = ''.join(TEMPLATES.get(key, '') for key, _, _ in FIXES) + SLIDE_LOADER + APP_INDEX
+    lowering = f':lower{LOWERING_VERSION}' if TARGETS[target] else ''
+    return patch_set_version(f'patch_engine-{target}', FIX_VERSIONS) + ':' + text_hash(source)[:12] + lowering
+
+
+@dataclass
+class FixResult:
+    """各修正の適用結果"""
+    key: str
+    label: str
+    matched: bool
+    start: int = -1
+    end: int = -1
+    old_bytes: int = 0
+    new_bytes: int = 0
+    seconds: float = 0.0
+    fallback: bool = False
+    intact: bool = False
+    converted: bool = False
+    applicable: bool = True     # False: 対象がない（matched は True、不一致とは区別する）
+
+
+@dataclass
+class LocatedFix:
+    """修正箇所の照合結果（ターゲット共通。found の置換テキストは変換前）"""
+    key: str
+    label: str
+    found: tuple = None     # (開始, 終了, 置換テキスト)
+    seconds: float = 0.0
+    fallback: bool = False
+    intact: bool = False
+    converted: bool = False     # 他のターゲットが適用済みの範囲（マーカーごと置き換える）
+    applicable: bool = True
+
+
+@dataclass
+class TargetOutput:
+    """ターゲットごとの出力"""
+    target: str
+    html: str
+    results: list
+    seconds: float = 0.0        # 生成（変換 + 連結）
+    lower_seconds: float = 0.0  # うち変換
+
+
+def apply_splices(text, splices):
+    """(開始, 終了, 置換テキスト) のリストを1回の連結で適用する"""
+    parts = []
+    pos = 0
+    for start, end, replacement in sorted(splices, key=lambda s: (s[0], s[1])):
+        if start < pos:
+            raise PatchError(f'修正箇所が重なっています: offset {start}')
+        parts.append(text[pos:start])
+        parts.append(replacement)
+        pos = end
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+
+def locate_fixes(index, intact=frozenset(), budget=None, applied=None):
+    """intact 以外の修正箇所を索引から特定する（[LocatedFix]）
+
+    applied: {修正キー: (マーカー開始, マーカー終了, 版, 長さ, ハッシュ)}。他のターゲットが
+    適用済みの修正は照合せず、マーカーと置換テキストの範囲をそのまま使う
+    """
+    located = []
+    applied = applied or {}
+    for key, label, locate in FIXES:
+        if key in intact:
+            located.append(LocatedFix(key, label, intact=True))
+            continue
+        if key in applied:
+            marker_start, marker_end, _, length, _ = applied[key]
+            region = index.text[marker_end:marker_end + length]
+            located.append(LocatedFix(key, label, (marker_start, marker_end + length, region), converted=True))
+            continue
+        started = time.perf_counter()
+        with time_budget(budget, label):
+            found = locate(index, TEMPLATES.get(key))
+        applicable = found is not NOT_APPLICABLE
+        located.append(LocatedFix(key, label, found if applicable else None, time.perf_counter() - started,
+                                  key in index.fallbacks, applicable=applicable))
+    return located
+
+
+def emit_target(text, located, target):
+    """照合結果から target の修正後HTMLを作る（変換するのは置換テキストだけ）"""
+    started = time.perf_counter()
+    transform = TARGETS[target]
+    lower_seconds = 0.0
+    splices = []
+    results = []
+    for fix in located:
+        if fix.intact:
+            results.append(FixResult(fix.key, fix.label, True, intact=True))
+            continue
+        if not fix.applicable:
+            results.append(FixResult(fix.key, fix.label, True, seconds=fix.seconds, fallback=fix.fallback,
+                                     applicable=False))
+            continue
+        if fix.found is None:
+            results.append(FixResult(fix.key, fix.label, False, seconds=fix.seconds, fallback=fix.fallback))
+            continue
+        start, end, replacement = fix.found
+        if fix.converted and not transform:
+            results.append(FixResult(fix.key, fix.label, True, intact=True))
+            continue
+        if transform:
+            lowering_started = time.perf_counter()
+            try:
+                replacement = transform(replacement)
+            except LoweringError as e:
+                raise PatchError(f'{fix.label}を {target} 向けに変換できません: {e}') from e
+            lower_seconds += time.perf_counter() - lowering_started
+        # 行頭から始まる置換はマーカーを独立した行にする（適用済みの範囲は改行込み）
+        if not fix.converted and not text[line_start(text, start):start].strip():
+            replacement = '\n' + line_indent(text, start) + replacement
+        splices.append((start, end, marker(marker_key(fix.key, target), FIX_VERSIONS[fix.key], replacement)
+                        + replacement))
+        results.append(FixResult(fix.key, fix.label, True, start, end, end - start, len(replacement),
+                                 fix.seconds, fix.fallback, converted=fix.converted))
+    fixed = apply_splices(text, splices)
+    return TargetOutput(target, fixed, results, time.perf_counter() - started, lower_seconds)
+
+
+def patch_targets(html_content, targets=('modern',), index=None, budget=None, profile=None):
+    """入力を1回だけ索引化・照合し、{ターゲット: TargetOutput} を返す
+
+    マーカーの版とハッシュが一致する修正は適用済みとして照合を省略する（intact）。
+    modern が適用済みの修正を compatible で出力するときは、照合せずにマーカーの範囲を
+    変換する（converted）。適用済みの修正と取り除くマーカーが同じターゲットは索引と
+    照合結果を共有する（未修正のファイルならすべてのターゲットで1回）。
+    照合する修正がなければ索引も作らない。
+
+    index: 作成済みの索引（古いマーカーを取り除く場合は作り直す）
+    budget: 修正1件あたりの制限時間（秒）。超えた場合は PatchTimeout
+    profile: dict を渡すと索引作成の所要時間などを書き込む
+    """
+    markers = find_markers(html_content)
+    plans = {}
+    for target in targets:
+        intact, convert, keep = set(), {}, set()
+        for key, _, _ in FIXES:
+            applied = _applied_marker(html_content, markers, key, target)
+            if applied is None:
+                continue
+            name, needs_conversion = applied
+            keep.add(name)
+            if needs_conversion:
+                convert[key] = name
+            else:
+                intact.add(key)
+        # 変更された修正と使わないマーカーは外して照合し直す
+        stale = frozenset(name for name in markers if name not in keep)
+        plans.setdefault((stale, frozenset(intact), frozenset(convert.items())), []).append(target)
+
+    if profile is not None:
+        profile.update(index_seconds=0.0, regions=0, parses=0, locate_seconds=0.0)
+    outputs = {}
+    for (stale, intact, convert), group in plans.items():
+        text = html_content
+        group_index = index
+        if stale:
+            # オフセットが変わるので索引も作り直す
+            text = strip_markers(html_content, stale)
+            group_index = None
+        applied = {}
+        if convert:
+            found = find_markers(text)
+            applied = {key: found[name] for key, name in convert}
+        if group_index is None and len(intact) + len(applied) < len(FIXES):
+            started = time.perf_counter()
+            with time_budget(budget, '索引作成'):
+                group_index = build_index(text)
+            if profile is not None:
+                profile['index_seconds'] += time.perf_counter() - started
+                profile['regions'] = len(group_index.regions)
+                profile['parses'] += 1
+        started = time.perf_counter()
+        if group_index is None:
+            group_index = ScriptIndex(text=text)
+        located = locate_fixes(group_index, intact, budget, applied)
+        if profile is not None:
+            profile['locate_seconds'] += time.perf_counter() - started
+        for target in group:
+            outputs[target] = emit_target(text, located, target)
+    return outputs
+
+
+def patch_html(html_content, target='modern', index=None, budget=None, profile=None):
+    """修正を適用し (修正後HTML, [FixResult]) を返す（1ターゲット）"""
+    output = patch_targets(html_content, [target], index, budget, profile)[target]
+    return output.html, output.results
+
+
+def print_profile(results, profile):
+    """修正ごとのプロファイルを表示する"""
+    print(f"\n📊 プロファイル（索引作成 {profile.get('index_seconds', 0) * 1000:.2f}ms × {profile.get('parses', 0)} 回 / "
+          f"スクリプト {profile.get('regions', 0)} ブロック / "
+          f"照合 {profile.get('locate_seconds', 0) * 1000:.2f}ms）")
+    print(f"  {_pad('修正', 22)}  {_pad('照合', 9, True)}  {_pad('範囲', 21)}  "
+          f"{_pad('置換 (旧→新)', 19)}  走査")
+    for r in results:
+        if r.intact:
+            print(f"  {_pad(r.key, 22)}  {_pad('-', 9, True)}  {_pad('（適用済み）', 21)}  {_pad('-', 19)}  マーカー")
+            continue
+        if not r.applicable:
+            print(f"  {_pad(r.key, 22)}  {r.seconds * 1000:>7.2f}ms  {_pad('（該当なし）', 21)}  {_pad('-', 19)}  "
+                  + ('ファイル全体' if r.fallback else '索引'))
+            continue
+        span = f"{r.start}-{r.end}" if r.matched else '（不一致）'
+        size = f"{r.old_bytes:,} → {r.new_bytes:,}" if r.matched else '-'
+        scan = 'マーカー' if r.converted else 'ファイル全体' if r.fallback else '索引'
+        print(f"  {_pad(r.key, 22)}  {r.seconds * 1000:>7.2f}ms  {_pad(span, 21)}  "
+              f"{_pad(size, 19)}  {scan}")
+
+
+def report_fixes(results, profile=None):
+    """修正ごとの適用状況（profile を渡すとプロファイルも）を表示する"""
+    total = len(results) - 1
+    for n, result in enumerate(results, 1):
+        prefix, verb = (f"  {n}/{total}", '修正') if n <= total else ("  ➕", '追加')
+        status = ("  （適用済み）" if result.intact else "  （適用済みの修正を変換）" if result.converted
+                  else "  （該当なし）" if not result.applicable
+                  else "" if result.matched else "  ⚠️ 該当箇所が見つかりません（スキップ）")
+        print(f"{prefix} {result.label}を{verb}...{status}")
+
+    if profile is not None:
+        print_profile(results, profile)
+
+    if all(r.matched for r in results):
+        print("✅ すべての修正が完了しました！")
+    else:
+        print("⚠️ 一部の修正は適用されませんでした")
+
+
+def apply_fixes(html_content, target='modern', budget=DEFAULT_BUDGET, profile=False):
+    """すべての関数に修正を適用（進行状況を表示）"""
+    print("🔧 修正を適用中..." if target == 'modern' else "🔧 修正を適用中（互換性版）...")
+
+    stats = {}
+    fixed, results = patch_html(html_content, target, budget=budget, profile=stats)
+    report_fixes(results, stats if profile else None)
+    return fixed
+
+
+# ===========================================
+# 内容ハッシュのキャッシュ（ファイル単位）
+# ===========================================
+
+def cached_result(path, output, target='modern', digest=None):
+    """(入力ハッシュ, 記録) を返す。記録があるのは修正を省略できる場合だけ
+
+    入力が前回と同じで出力も前回のままのとき、または入力が修正済み（前回の出力
+    そのもの）のとき。後者で出力が異なる場合は入力を出力にコピーする。
+    digest: 計算済みの入力ハッシュ（複数ターゲットで共有する）
+    """
+    cache = PatchCache(cache_version(target))
+    digest = digest or file_hash(path)
+    entry = cache.lookup(digest)
+    if entry is None:
+        return digest, None
+    if os.path.exists(output) and file_hash(output) == entry['output']:
+        return digest, entry
+    if entry['output'] == digest:
+        shutil.copyfile(path, output)
+        return digest, entry
+    return digest, None
+
+
+def remember(digests, target='modern'):
+    """[(入力ハッシュ, 出力ハッシュ, 照合結果のリスト)] をキャッシュに記録する"""
+    cache = PatchCache(cache_version(target))
+    for input_digest, output_digest, matched in digests:
+        cache.record(input_digest, output_digest, {'matched': matched})
+    cache.save()
+
+
+# ===========================================
+# 単一ファイルモード
+# ===========================================
+
+# 出力ファイル（カレントディレクトリに出力）
+OUTPUT_FILES = {
+    'modern': 'index_fixed_complete.html',
+    'compatible': 'index_fixed_compatible.html',
+}
+
+TARGET_LABELS = {
+    'modern': '修正版',
+    'compatible': '互換性版（?. とアロー関数なし）',
+}
+
+
+def print_targets(rows, profile):
+    """ターゲットごとの出力サイズと生成時間を表示する"""
+    parses = profile.get('parses', 0)
+    print(f"\n📦 ターゲット別の出力（索引作成 {parses} 回 {profile.get('index_seconds', 0) * 1000:.2f}ms / "
+          f"照合 {profile.get('locate_seconds', 0) * 1000:.2f}ms）")
+    width = max(len(row['output']) for row in rows)
+    print(f"  {_pad('ターゲット', 12)}  {_pad('出力ファイル', width)}  {_pad('サイズ', 12, True)}  生成")
+    for row in rows:
+        if row['cached']:
+            timing = '（変更なし）'
+        else:
+            timing = f"{row['seconds'] * 1000:.2f}ms"
+            if row['lower_seconds']:
+                timing += f"（うち変換 {row['lower_seconds'] * 1000:.2f}ms）"
+        print(f"  {_pad(row['target'], 12)}  {_pad(row['output'], width)}  {row['bytes']:>12,}  {timing}")
+
+
+def run_single(path, targets=('modern',), budget=DEFAULT_BUDGET, profile=False, use_cache=True,
+               use_snapshot=True):
+    """1ファイルを1回の索引化で targets の各出力に修正し、ターゲット別の結果を表示する
+
+    書き込んだ出力ファイルのリストを返す（すべて修正済みなら空）。エラー時は終了する。
+    """
+    print(f"\n📖 ファイルを読み込み中: {path}")
+    rows = []
+    pending = []
+    digest = None
+    try:
+        for target in targets:
+            output = OUTPUT_FILES[target]
+            if use_cache:
+                # 前回と同じ入力・出力なら修正を省略（内容ハッシュのキャッシュ）
+                digest, cached = cached_result(path, output, target, digest)
+                if cached is not None:
+                    rows.append({'target': target, 'output': output, 'bytes': os.path.getsize(output),
+                                 'cached': True})
+                    continue
+            pending.append(target)
+        if not pending:
+            print(f"\n✅ 変更はありません（{', '.join(OUTPUT_FILES[t] for t in targets)} は修正済みです）")
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+    except FileNotFoundError:
+        print(f"❌ エラー: ファイルが見つかりません: {path}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ エラー: ファイル読み込みに失敗: {e}")
+        sys.exit(1)
+
+    print(f"   元のファイルサイズ: {len(html_content):,} bytes")
+    print("🔧 修正を適用中..." if pending == ['modern'] else f"🔧 修正を適用中（{', '.join(pending)}）...")
+    stats = {}
+    try:
+        outputs = patch_targets(html_content, pending, budget=budget, profile=stats)
+    except PatchTimeout as e:
+        print(f"❌ エラー: {e}")
+        sys.exit(2)
+    except PatchError as e:
+        print(f"❌ エラー: {e}")
+        sys.exit(1)
+    report_fixes(outputs[pending[0]].results, stats if profile else None)
+
+    written = []
+    for target in pending:
+        output = OUTPUT_FILES[target]
+        result = outputs[target]
+        print(f"\n💾 {TARGET_LABELS[target]}を保存中: {output}")
+        try:
+            with open(output, 'w', encoding='utf-8') as f:
+                f.write(result.html)
+        except Exception as e:
+            print(f"❌ エラー: ファイル保存に失敗: {e}")
+            sys.exit(1)
+        if digest is not None:
+            remember([(digest, text_hash(result.html), [r.matched for r in result.results])], target)
+        if use_snapshot:
+            saved = snapshot(output, SNAPSHOT_SCRIPTS[target])
+            if saved:
+                print(f"   スナップショット: {saved}")
+        rows.append({'target': target, 'output': output, 'bytes': len(result.html.encode('utf-8')),
+                     'cached': False, 'seconds': result.seconds, 'lower_seconds': result.lower_seconds})
+        written.append(output)
+
+    rows.sort(key=lambda row: targets.index(row['target']))
+    print_targets(rows, stats)
+    return written
+
+
+# ===========================================
+# 一括処理モード
+# ===========================================
+
+# 出力ファイル名の接尾辞（入力ファイルと同じディレクトリに出力）
+OUTPUT_SUFFIXES = {
+    'modern': '.fixed_complete.html',
+    'compatible': '.fixed_compatible.html',
+}
+
+# スナップショットに記録するスクリプト名
+SNAPSHOT_SCRIPTS = {
+    'modern': 'apply_complete_fix',
+    'compatible': 'apply_fix_compatible',
+}
+
+
+def parse_cli(args, prog=None, target='modern'):
+    """apply_* スクリプト共通のコマンドライン解析
+
+    複数ファイル・グロブ・ディレクトリ・--batch・-j のいずれかで一括処理モードになる
+    target: --targets を省略したときのターゲット
+    """
+    parser = argparse.ArgumentParser(prog=prog, description='index.html を修正します')
+    parser.add_argument('patterns', nargs='+', help='ファイル / グロブ / ディレクトリ')
+    parser.add_argument('--targets', default=target,
+                        help=f'出力するターゲット（カンマ区切り: {", ".join(TARGETS)}, 既定: {target}）。'
+                             '複数指定しても索引作成・照合は1回')
+    parser.add_argument('--batch', action='store_true', help='一括処理モード（複数指定時は自動）')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='並列プロセス数（既定: CPU数）')
+    parser.add_argument('--profile', action='store_true', help='修正ごとのプロファイルを表示')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help=f'修正1件あたりの制限時間（秒, 0で無制限, 既定: {DEFAULT_BUDGET:g}）')
+    parser.add_argument('--no-cache', action='store_true', help='内容ハッシュのキャッシュを使わない')
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help='出力を snapshot_store.py のスナップショットに保存しない')
+    options = parser.parse_args(args)
+    options.targets = list(dict.fromkeys(t.strip() for t in options.targets.split(',') if t.strip()))
+    unknown = [t for t in options.targets if t not in TARGETS]
+    if unknown or not options.targets:
+        parser.error(f"不明なターゲット: {', '.join(unknown) or '（なし）'}（{', '.join(TARGETS)} から指定）")
+    options.batch = (options.batch or options.jobs is not None
+                     or len(options.patterns) > 1
+                     or any(glob.has_magic(p) or os.path.isdir(p) for p in options.patterns))
+    return options
+
+
+def expand_inputs(patterns):
+    """グロブ・ディレクトリを展開して入力ファイルの一覧を返す（出力ファイルは除外）"""
+    skip = tuple(OUTPUT_SUFFIXES.values())
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '**', 'index*.html*'), recursive=True)
+        else:
+            matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        found.extend(m for m in matches if not m.endswith(skip) and not os.path.isdir(m))
+    return sorted(set(found))
+
+
+def patch_file(path, targets=('modern',), budget=DEFAULT_BUDGET, use_cache=True, use_snapshot=True):
+    """1ファイルを1回の索引化で targets の各出力に修正し、集計用の dict を返す（プロセスプールのワーカー）
+
+    キャッシュへの記録は親プロセスがまとめて行う（ターゲットごとの digests）
+    """
+    started = time.perf_counter()
+    stat = {'path': path, 'bytes_in': 0, 'error': None, 'seconds': 0.0, 'targets': []}
+    try:
+        stat['bytes_in'] = os.path.getsize(path)
+        digest = file_hash(path) if use_cache else None
+        pending = []
+        for target in targets:
+            output = path + OUTPUT_SUFFIXES[target]
+            entry = cached_result(path, output, target, digest)[1] if use_cache else None
+            if entry is None:
+                pending.append(target)
+                continue
+            stat['targets'].append({
+                'target': target, 'output': output, 'bytes_out': os.path.getsize(output),
+                'matched': entry['info'].get('matched') or [True] * len(FIXES),
+                'cached': True, 'seconds': 0.0, 'digests': None,
+            })
+        if pending:
+            with open(path, 'r', encoding='utf-8') as f:
+                html_content = f.read()
+            outputs = patch_targets(html_content, pending, budget=budget)
+            for target in pending:
+                output = path + OUTPUT_SUFFIXES[target]
+                result = outputs[target]
+                with open(output, 'w', encoding='utf-8') as f:
+                    f.write(result.html)
+                if use_snapshot:
+                    snapshot(output, SNAPSHOT_SCRIPTS[target])
+                matched = [r.matched for r in result.results]
+                stat['targets'].append({
+                    'target': target, 'output': output, 'bytes_out': len(result.html.encode('utf-8')),
+                    'matched': matched, 'cached': False, 'seconds': result.seconds,
+                    'digests': (digest, text_hash(result.html), matched) if digest else None,
+                })
+        stat['targets'].sort(key=lambda t: list(targets).index(t['target']))
+    except Exception as e:
+        stat['error'] = str(e)
+    stat['seconds'] = time.perf_counter() - started
+    return stat
+
+
+def _pad(text, width, right=False):
+    """全角文字を2桁として桁揃えする"""
+    cells = sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+    space = ' ' * max(0, width - cells)
+    return space + text if right else text + space
+
+
+def _format_matched(matched):
+    """[True, False, ...] を「10/11+」形式（適用数/修正数 + debugCourseInfo）で表示する
+
+    該当なしの修正（FixResult.applicable が False）は True として数える
+    """
+    if not matched:
+        return '-'
+    return f"{sum(matched[:-1])}/{len(matched) - 1}" + ('+' if matched[-1] else '-')
+
+
+def _unmatched_names(matched):
+    """適用されなかった修正の名前（FIXES のキー）を FIXES の順に返す"""
+    return [key for (key, _label, _locate), ok in zip(FIXES, matched) if not ok]
+
+
+def run_batch(patterns, targets=('modern',), workers=None, budget=DEFAULT_BUDGET, use_cache=True,
+              use_snapshot=True):
+    """複数ファイルを並列に修正し、ファイル・ターゲットごとの結果表を表示する。終了コードを返す"""
+    inputs = expand_inputs(patterns)
+    if not inputs:
+        print("❌ エラー: 対象ファイルが見つかりません")
+        return 1
+
+    targets = list(targets)
+    print(f"\n📦 一括処理: {len(inputs)} ファイル（{', '.join(targets)}）")
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        stats = list(pool.map(patch_file, inputs, [targets] * len(inputs), [budget] * len(inputs),
+                              [use_cache] * len(inputs), [use_snapshot] * len(inputs)))
+    elapsed = time.perf_counter() - started
+    for target in targets:
+        remember([t['digests'] for s in stats for t in s['targets']
+                  if t['target'] == target and t['digests']], target)
+
+    width = max(len(s['path']) for s in stats)
+    print(f"\n{_pad('ファイル', width)}  {_pad('ターゲット', 10)}  {_pad('入力', 10, True)}  "
+          f"{_pad('出力', 10, True)}  {_pad('修正', 8)}  {_pad('生成', 8, True)}  {_pad('時間', 8, True)}")
+    failed = 0
+    for s in stats:
+        if s['error']:
+            failed += 1
+            print(f"{s['path'].ljust(width)}  ❌ {s['error']}")
+            continue
+        for n, t in enumerate(s['targets']):
+            if not all(t['matched']):
+                failed += 1
+            path, size, total = (s['path'], f"{s['bytes_in']:,}", f"{s['seconds'] * 1000:.1f}ms") if n == 0 else ('', '', '')
+            generated = '-' if t['cached'] else f"{t['seconds'] * 1000:.1f}ms"
+            print(f"{path.ljust(width)}  {t['target']:<10}  {size:>10}  {t['bytes_out']:>10,}  "
+                  f"{_format_matched(t['matched']):<8}  {generated:>8}  {total:>8}"
+                  + ('  （変更なし）' if t['cached'] else ''))
+            if not all(t['matched']):
+                print(f"{''.ljust(width)}  ↳ 未適用: {', '.join(_unmatched_names(t['matched']))}")
+
+    print(f"\n⏱️  合計 {elapsed:.2f} 秒")
+    if failed:
+        print(f"⚠️ {failed} 件の出力で一部の修正が適用されませんでした")
+        return 1
+    print("✅ すべてのファイルですべての修正が適用されました")
+    return 0
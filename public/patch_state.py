@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+パッチの適用状態（マーカーとキャッシュ）
+
+patch_engine.py（apply_* スクリプト）と update_html.py の共通部品です。
+
+マーカー:
+    修正ごとに、置き換えたテキストの直前へ次のコメントを埋め込みます。
+
+        /* @patch <修正キー> v<版> <長さ>:<ハッシュ> */
+
+    長さ・ハッシュはマーカー直後の置換テキストのものです。再実行時に
+    版とハッシュが一致する修正は「適用済み」として照合自体を省略し、
+    対象の関数が変更された（ハッシュが一致しない）修正だけを適用し直します。
+
+キャッシュ:
+    入力ファイルの内容ハッシュ + パッチセットの版をキーに、出力の内容ハッシュを
+    .cache/patch_state.json に記録します。修正済みの出力自身も「変更なし」として
+    記録するため、修正済みのファイルに再実行してもハッシュ計算だけで終わります。
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+CACHE_FILE = os.path.join('.cache', 'patch_state.json')
+CACHE_ENTRIES = 256
+HASH_LENGTH = 12
+READ_CHUNK = 1024 * 1024
+
+MARKER_PATTERN = re.compile(r'/\* @patch ([\w-]+) v(\d+) (\d+):([0-9a-f]{%d}) \*/' % HASH_LENGTH)
+MARKER_PREFIX = '/* @patch '
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def file_hash(path):
+    """ファイルの内容ハッシュ（全体を読み込まずに計算）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def patch_set_version(name, versions):
+    """修正キー → 版 の dict からパッチセットの版を作る（どれかの版が上がれば変わる）"""
+    return name + ':' + ','.join(f'{key}{version}' for key, version in sorted(versions.items()))
+
+
+# ===========================================
+# マーカー
+# ===========================================
+
+def marker(key, version, region):
+    """region（マーカー直後に置くテキスト）の長さとハッシュを含むマーカー"""
+    return f'/* @patch {key} v{version} {len(region)}:{text_hash(region)[:HASH_LENGTH]} */'
+
+
+def find_markers(text):
+    """{修正キー: (マーカー開始, マーカー終了, 版, 長さ, ハッシュ)}（同じキーは最初のもの）"""
+    found = {}
+    if MARKER_PREFIX not in text:
+        return found
+    for m in MARKER_PATTERN.finditer(text):
+        found.setdefault(m.group(1), (m.start(), m.end(), int(m.group(2)), int(m.group(3)), m.group(4)))
+    return found
+
+
+def is_intact(text, found, version):
+    """マーカーの版が現在と同じで、直後のテキストが適用時から変わっていないか"""
+    if found is None:
+        return False
+    _, end, applied_version, length, digest = found
+    return (applied_version == version
+            and text_hash(text[end:end + length])[:HASH_LENGTH] == digest)
+
+
+def strip_markers(text, keys):
+    """keys のマーカーをすべて取り除く（適用し直す修正の古いマーカー）
+
+    独立した行に置いたマーカーは、続く改行と字下げも取り除く（空行を残さない）
+    """
+    keys = set(keys)
+    if not keys or MARKER_PREFIX not in text:
+        return text
+    parts = []
+    pos = 0
+    for m in MARKER_PATTERN.finditer(text):
+        if m.group(1) not in keys:
+            continue
+        end = m.end()
+        indent = text[text.rfind('\n', 0, m.start()) + 1:m.start()]
+        if not indent.strip() and text.startswith('\n' + indent, end):
+            end += 1 + len(indent)
+        parts.append(text[pos:m.start()])
+        pos = end
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+
+# ===========================================
+# キャッシュ
+# ===========================================
+
+class PatchCache:
+    """入力の内容ハッシュ → 出力の内容ハッシュ（パッチセットの版ごと）"""
+
+    def __init__(self, version, path=CACHE_FILE):
+        self.version = version
+        self.path = path
+        self._entries = None
+        self._dirty = False
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _key(self, digest):
+        return f'{self.version}:{digest}'
+
+    def lookup(self, digest):
+        """記録があれば {'output': 出力ハッシュ, 'info': {...}} を返す"""
+        return self.entries.get(self._key(digest))
+
+    def record(self, input_digest, output_digest, info=None):
+        """info: 表示用の付加情報（修正ごとの照合結果など）"""
+        now = time.time()
+        self.entries[self._key(input_digest)] = {'output': output_digest, 'info': info or {}, 'at': now}
+        # 出力をもう一度修正しても変わらない（修正済み）
+        self.entries[self._key(output_digest)] = {'output': output_digest, 'info': info or {}, 'at': now}
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        entries = self.entries
+        if len(entries) > CACHE_ENTRIES:
+            keep = sorted(entries, key=lambda k: entries[k].get('at', 0), reverse=True)[:CACHE_ENTRIES]
+            entries = {k: entries[k] for k in keep}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.patch_state.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        self._dirty = False
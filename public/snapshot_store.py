@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+index.html のスナップショット保存（重複排除 + 圧縮）
+
+修正スクリプトが index.html.backup.* のような全体コピーを public/ に作る代わりに、
+ファイルを内容で区切ったチャンク（行単位、行のハッシュで区切り位置を決める）に分け、
+同じチャンクは1回だけ zlib 圧縮して保存します。スナップショットごとの
+マニフェストには日時・スクリプト・適用済みの修正（patch_state.py のマーカー）と
+チャンクの並びを記録し、元のファイルをバイト単位で復元できます。
+
+保存先は既定でリポジトリ直下の .snapshots/ です（public/ の外なので配信されません）。
+
+    .snapshots/manifests/<ID>.json   スナップショットごとのマニフェスト
+    .snapshots/packs/<ID>.pack       そのスナップショットで初めて現れたチャンク
+
+使用方法:
+    python3 public/snapshot_store.py save public/index.html --script manual
+    python3 public/snapshot_store.py list
+    python3 public/snapshot_store.py diff <ID> [<ID> | ファイル]   # 既定は現在のファイルと比較
+    python3 public/snapshot_store.py restore <ID> [-o 出力先]      # 既定は元の場所（上書き前に保存）
+    python3 public/snapshot_store.py import                        # public/index.html.backup.* などを取り込む
+    python3 public/snapshot_store.py import --delete               # 復元を確認してから元ファイルを削除
+    python3 public/snapshot_store.py stats                         # 節約した容量
+
+ID は先頭の一部だけでも指定できます（一意に決まる場合）。
+"""
+
+import argparse
+import difflib
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+
+from patch_state import find_markers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORE_DIR = os.path.join(ROOT, '.snapshots')
+IMPORT_PATTERNS = [os.path.join('public', 'index.html.backup.*'), os.path.join('public', 'index.html.20*')]
+
+# チャンクの区切り: 行の CRC の下位ビットが 0 の行の後（平均 約32行）。極端な大きさは避ける
+BOUNDARY_MASK = 0x1F
+MIN_CHUNK = 512
+MAX_CHUNK = 32 * 1024
+CHUNK_ID_LENGTH = 32
+COMPRESS_LEVEL = 9
+
+
+class SnapshotError(Exception):
+    """スナップショットの指定・復元に失敗した場合の例外"""
+
+
+def chunk_bytes(data):
+    """data を内容で決まる区切りのチャンクに分ける（挿入・削除があっても前後の区切りは変わらない）"""
+    chunks = []
+    current = []
+    size = 0
+    for line in data.splitlines(keepends=True):
+        # スライド画像の data URI など長い行は固定長で分ける
+        while len(line) > MAX_CHUNK:
+            if current:
+                chunks.append(b''.join(current))
+                current, size = [], 0
+            chunks.append(line[:MAX_CHUNK])
+            line = line[MAX_CHUNK:]
+        current.append(line)
+        size += len(line)
+        if size >= MAX_CHUNK or (size >= MIN_CHUNK and zlib.crc32(line) & BOUNDARY_MASK == 0):
+            chunks.append(b''.join(current))
+            current, size = [], 0
+    if current:
+        chunks.append(b''.join(current))
+    return chunks
+
+
+def chunk_id(chunk):
+    return hashlib.sha256(chunk).hexdigest()[:CHUNK_ID_LENGTH]
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class SnapshotStore:
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        self.manifest_dir = os.path.join(path, 'manifests')
+        self.pack_dir = os.path.join(path, 'packs')
+        self._manifests = None
+
+    # ---------- マニフェスト ----------
+
+    def manifests(self):
+        """すべてのマニフェスト（作成日時順）"""
+        if self._manifests is None:
+            manifests = []
+            for name in glob.glob(os.path.join(self.manifest_dir, '*.json')):
+                with open(name, 'r', encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+            self._manifests = sorted(manifests, key=lambda m: (m['created'], m['id']))
+        return self._manifests
+
+    def resolve(self, prefix):
+        """ID（先頭の一部でも可）からマニフェストを返す"""
+        matches = [m for m in self.manifests() if m['id'].startswith(prefix)]
+        if not matches:
+            raise SnapshotError(f'スナップショットが見つかりません: {prefix}')
+        if len(matches) > 1:
+            raise SnapshotError(f'ID が一意ではありません: {prefix}（{len(matches)} 件）')
+        return matches[0]
+
+    def locations(self):
+        """チャンク ID → (パック ID, オフセット, 長さ)"""
+        found = {}
+        for manifest in self.manifests():
+            for cid, (offset, length) in manifest.get('pack', {}).items():
+                found.setdefault(cid, (manifest['id'], offset, length))
+        return found
+
+    # ---------- 保存・復元 ----------
+
+    def save(self, path, script, fixes=None, source=None, created=None, original=None):
+        """path の内容をスナップショットとして保存し、マニフェストを返す
+
+        fixes を省略した場合はファイル内の patch_state マーカーから求める
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if fixes is None:
+            fixes = sorted(find_markers(data.decode('utf-8', errors='replace')))
+        created = created or time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime())
+        snapshot_id = re.sub(r'\D', '', created)[:14] + '-' + digest[:8]
+        for existing in self.manifests():
+            if existing['id'] == snapshot_id:
+                # 同じ秒に同じ内容を保存した場合は既存のものを使う
+                return existing
+
+        known = self.locations()
+        order = []
+        pack = {}
+        packed = []
+        offset = 0
+        for chunk in chunk_bytes(data):
+            cid = chunk_id(chunk)
+            order.append(cid)
+            if cid in known or cid in pack:
+                continue
+            compressed = zlib.compress(chunk, COMPRESS_LEVEL)
+            pack[cid] = (offset, len(compressed))
+            packed.append(compressed)
+            offset += len(compressed)
+
+        manifest = {
+            'id': snapshot_id,
+            'created': created,
+            'script': script,
+            'source': os.path.relpath(os.path.abspath(source or path), ROOT),
+            'original': original,
+            'fixes': fixes,
+            'size': len(data),
+            'sha256': digest,
+            'chunks': order,
+            'pack': pack,
+        }
+        # パックを先に書き、マニフェストを最後に置く（途中で止まっても参照されないパックが残るだけ）
+        if packed:
+            _write_atomic(os.path.join(self.pack_dir, f'{snapshot_id}.pack'), b''.join(packed))
+        _write_atomic(os.path.join(self.manifest_dir, f'{snapshot_id}.json'),
+                      json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+        if self._manifests is not None:
+            self._manifests.append(manifest)
+        return manifest
+
+    def read(self, manifest):
+        """スナップショットの内容をバイト単位で復元する（SHA-256 で検証）"""
+        locations = self.locations()
+        packs = {}
+        parts = []
+        try:
+            for cid in manifest['chunks']:
+                if cid not in locations:
+                    raise SnapshotError(f"チャンク {cid} が見つかりません（{manifest['id']}）")
+                pack_id, offset, length = locations[cid]
+                if pack_id not in packs:
+                    packs[pack_id] = open(os.path.join(self.pack_dir, f'{pack_id}.pack'), 'rb')
+                f = packs[pack_id]
+                f.seek(offset)
+                parts.append(zlib.decompress(f.read(length)))
+        finally:
+            for f in packs.values():
+                f.close()
+        data = b''.join(parts)
+        if hashlib.sha256(data).hexdigest() != manifest['sha256']:
+            raise SnapshotError(f"復元した内容のハッシュが一致しません（{manifest['id']}）")
+        return data
+
+    # ---------- 容量 ----------
+
+    def usage(self):
+        """(論理サイズ合計, 実際の使用量, スナップショット数)"""
+        manifests = self.manifests()
+        logical = sum(m['size'] for m in manifests)
+        physical = 0
+        for directory in (self.manifest_dir, self.pack_dir):
+            for name in glob.glob(os.path.join(directory, '*')):
+                physical += os.path.getsize(name)
+        return logical, physical, len(manifests)
+
+
+def snapshot(path, script, store=None):
+    """修正スクリプト用: path を保存して ID を返す（保存に失敗しても修正は続ける）"""
+    try:
+        manifest = (store or SnapshotStore()).save(path, script)
+    except (OSError, ValueError) as e:
+        print(f'⚠️ スナップショットを保存できませんでした: {e}')
+        return None
+    return manifest['id']
+
+
+# ===========================================
+# 取り込み（public/index.html.backup.* など）
+# ===========================================
+
+# index.html.backup.<スクリプト>_<日時> / index.html.backup.<日時> / index.html.<日時>
+_BACKUP_NAME = re.compile(r'^index\.html\.(?:backup\.)?(?:(?P<script>[a-z][a-z0-9_]*?)_)?(?P<stamp>\d[\dT_:-]*\d)')
+
+
+def parse_backup_name(path):
+    """ファイル名から (スクリプト名, 作成日時) を推定する（分からなければ更新時刻）"""
+    name = os.path.basename(path)
+    m = _BACKUP_NAME.match(name)
+    script = 'backup'
+    digits = ''
+    if m:
+        script = m.group('script') or 'backup'
+        digits = re.sub(r'\D', '', m.group('stamp'))
+    if len(digits) >= 12:
+        digits = (digits + '00')[:14]
+        created = (f'{digits[0:4]}-{digits[4:6]}-{digits[6:8]}T'
+                   f'{digits[8:10]}:{digits[10:12]}:{digits[12:14]}')
+    else:
+        created = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(os.path.getmtime(path)))
+    return script, created
+
+
+def import_backups(store, patterns, delete=False):
+    paths = sorted({p for pattern in patterns for p in glob.glob(os.path.join(ROOT, pattern))
+                    if os.path.isfile(p)})
+    if not paths:
+        print('⚠️ 取り込むバックアップがありません')
+        return 0
+    imported = {m.get('original') for m in store.manifests()}
+    before = store.usage()[1]
+    total = 0
+    for path in paths:
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        if name in imported:
+            print(f'  ⏭️  {name}（取り込み済み）')
+        else:
+            script, created = parse_backup_name(path)
+            manifest = store.save(path, script, source=os.path.join(ROOT, 'public', 'index.html'),
+                                  created=created, original=name)
+            new_bytes = sum(length for _, length in manifest['pack'].values())
+            print(f"  📥 {name:<58} {manifest['id']}  {size:>9,} → 新規 {new_bytes:>7,} バイト")
+            total += size
+        if delete:
+            # 復元結果が元ファイルと完全に一致する場合だけ削除する
+            manifest = next(m for m in store.manifests() if m.get('original') == name)
+            with open(path, 'rb') as f:
+                if store.read(manifest) != f.read():
+                    raise SnapshotError(f'{name} の復元結果が一致しないため削除しません')
+            os.unlink(path)
+    after = store.usage()[1]
+    added = after - before
+    print(f'\n📊 取り込み {total:,} バイト → 保存 {added:,} バイト'
+          + (f'（{(1 - added / total) * 100:.1f}% 削減）' if total else ''))
+    if delete:
+        print(f'🧹 元のファイル {len(paths)} 件を削除しました')
+    return 0
+
+
+# ===========================================
+# CLI
+# ===========================================
+
+def print_list(store):
+    manifests = store.manifests()
+    if not manifests:
+        print('（スナップショットはありません）')
+        return
+    print(f"{'ID':<24} {'作成日時':<19} {'スクリプト':<20} {'サイズ':>9}  修正 / 元ファイル")
+    for m in manifests:
+        new_bytes = sum(length for _, length in m.get('pack', {}).values())
+        fixes = ','.join(m['fixes']) or '-'
+        origin = f"  ({m['original']})" if m.get('original') else ''
+        print(f"{m['id']:<24} {m['created']:<19} {m['script']:<20} {m['size']:>9,}  "
+              f"{fixes}{origin}  [新規 {new_bytes:,}]")
+
+
+def load_side(store, spec):
+    """diff の比較対象（スナップショット ID またはファイル）を (表示名, 行) で返す"""
+    if os.path.isfile(spec):
+        with open(spec, 'rb') as f:
+            data = f.read()
+        label = spec
+    else:
+        manifest = store.resolve(spec)
+        data = store.read(manifest)
+        label = f"{manifest['id']} ({manifest['script']})"
+    return label, data.decode('utf-8', errors='replace').splitlines(keepends=True)
+
+
+def print_stats(store):
+    logical, physical, count = store.usage()
+    chunks = len(store.locations())
+    print(f'📊 スナップショット {count} 件 / チャンク {chunks:,} 個')
+    print(f'   元のサイズ合計 {logical:,} バイト → 保存 {physical:,} バイト'
+          + (f'（{(1 - physical / logical) * 100:.1f}% 削減）' if logical else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='index.html のスナップショット（重複排除 + 圧縮）')
+    parser.add_argument('--store', default=STORE_DIR, help=f'保存先（既定: {STORE_DIR}）')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    save = commands.add_parser('save', help='ファイルを保存する')
+    save.add_argument('file')
+    save.add_argument('--script', default='manual', help='記録するスクリプト名')
+
+    commands.add_parser('list', help='スナップショットの一覧')
+
+    diff = commands.add_parser('diff', help='スナップショット同士、またはファイルとの差分')
+    diff.add_argument('a')
+    diff.add_argument('b', nargs='?', help='既定: a の元ファイル（現在の内容）')
+    diff.add_argument('-U', '--context', type=int, default=3)
+
+    restore = commands.add_parser('restore', help='スナップショットを復元する')
+    restore.add_argument('id')
+    restore.add_argument('-o', '--output', help='出力先（既定: 元の場所。上書き前の内容も保存）')
+
+    import_cmd = commands.add_parser('import', help='public/ の既存バックアップを取り込む')
+    import_cmd.add_argument('patterns', nargs='*', default=IMPORT_PATTERNS,
+                            help='リポジトリ直下からのグロブ（既定: public/index.html.backup.* など）')
+    import_cmd.add_argument('--delete', action='store_true', help='復元を確認できたら元ファイルを削除')
+
+    commands.add_parser('stats', help='容量の集計')
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.store)
+    try:
+        if args.command == 'save':
+            manifest = store.save(args.file, args.script)
+            print(f"✅ 保存しました: {manifest['id']}（{manifest['size']:,} バイト, "
+                  f"新規チャンク {len(manifest['pack'])} / {len(manifest['chunks'])}）")
+        elif args.command == 'list':
+            print_list(store)
+        elif args.command == 'diff':
+            label_a, lines_a = load_side(store, args.a)
+            label_b, lines_b = load_side(store, args.b or os.path.join(ROOT, store.resolve(args.a)['source']))
+            sys.stdout.writelines(difflib.unified_diff(lines_a, lines_b, label_a, label_b, n=args.context))
+        elif args.command == 'restore':
+            manifest = store.resolve(args.id)
+            data = store.read(manifest)
+            output = args.output or os.path.join(ROOT, manifest['source'])
+            if not args.output and os.path.exists(output):
+                with open(output, 'rb') as f:
+                    if f.read() == data:
+                        print(f'✅ 変更はありません（{output} はスナップショットと同じです）')
+                        return
+                saved = store.save(output, 'restore')
+                print(f"📦 上書き前の内容を保存しました: {saved['id']}")
+            _write_atomic(os.path.abspath(output), data)
+            print(f"✅ 復元しました: {manifest['id']} → {output}（{len(data):,} バイト, SHA-256 一致）")
+        elif args.command == 'import':
+            sys.exit(import_backups(store, args.patterns, args.delete))
+        elif args.command == 'stats':
+            print_stats(store)
+    except (SnapshotError, OSError) as e:
+        print(f'❌ エラー: {e}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
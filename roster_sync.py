@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+社員名簿と users テーブルの同期ツール
+
+CSV / NDJSON の名簿を users テーブルと比較し、差分（追加・更新・無効化）だけを
+まとめた複数行の INSERT / UPDATE で反映します。比較は username（なければ email）で
+対応付け、氏名・メール・部署・権限・有効状態のハッシュ（フィンガープリント）が
+異なる行だけを更新します。DB 側のフィンガープリントは PostgreSQL で計算するため、
+既存ユーザーの全列を読み込むことはありません。
+
+使用方法:
+    python3 roster_sync.py roster.csv --dry-run            # 差分の確認のみ
+    python3 roster_sync.py roster.csv --default-password 'Welcome!2026'
+    python3 roster_sync.py roster.ndjson --no-deactivate
+
+名簿の列: username, email, name, department, role, password（新規ユーザーのみ）
+role が空欄（または列がない）の場合、新規ユーザーは user、既存ユーザーは現在の権限のままです。
+名簿にない一般ユーザー（role = user）は無効化されます（管理者は対象外）。
+username / email を入れ替える更新は、一時的な値を経由する別パスで反映します。
+users.active 列はサーバーのマイグレーション（users_active）で作成されている必要があります。
+接続先は --database-url または環境変数 DATABASE_URL です。psycopg (v3) が必要です（接続は pg_transfer.py と共通）。
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+
+from cli_common import Phases
+from pg_transfer import connect
+
+BATCH_SIZE = 500
+FIELD_SEP = '\x1f'
+
+# フィンガープリントに含める列（順序は SQL と同じ）
+FINGERPRINT_COLUMNS = ['name', 'email', 'department', 'role', 'active']
+
+DB_FINGERPRINTS_SQL = '''
+    SELECT id, username, email, role, active,
+           md5(concat_ws(E'\\x1f', COALESCE(name, ''), COALESCE(email, ''),
+                         COALESCE(department, ''), COALESCE(role, ''), active::text)) AS fingerprint
+    FROM users
+'''
+
+
+def fingerprint(row):
+    """DB_FINGERPRINTS_SQL と同じ規則のハッシュ"""
+    values = []
+    for column in FINGERPRINT_COLUMNS:
+        value = row.get(column)
+        if column == 'active':
+            value = 'true' if value else 'false'
+        values.append('' if value is None else str(value))
+    return hashlib.md5(FIELD_SEP.join(values).encode('utf-8')).hexdigest()
+
+
+def read_roster(path):
+    """名簿を読み込み、username ごとの行（dict）を返す"""
+    if path.endswith('.ndjson') or path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        # Excel で保存した CSV の BOM を除く
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    roster = {}
+    problems = []
+    for number, row in enumerate(rows, start=1):
+        row = {key.strip(): (value.strip() if isinstance(value, str) else value)
+               for key, value in row.items() if key}
+        username = row.get('username')
+        if not username or not row.get('email') or not row.get('name'):
+            problems.append(f'{number}行目: username / email / name は必須です')
+            continue
+        if username in roster:
+            problems.append(f'{number}行目: username が重複しています: {username}')
+            continue
+        roster[username] = {
+            'username': username,
+            'email': row['email'],
+            'name': row['name'],
+            'department': row.get('department') or None,
+            # 空欄は「変更しない」（新規ユーザーは user）
+            'role': row.get('role') or None,
+            'password': row.get('password') or None,
+            'active': True,
+        }
+    return roster, problems
+
+
+def plan(roster, existing, deactivate):
+    """(inserts, updates, deactivations, conflicts) を返す"""
+    by_username = {row['username']: row for row in existing}
+    by_email = {row['email']: row for row in existing if row['email']}
+    inserts, updates, conflicts = [], [], []
+    matched = set()
+
+    def released(owner, email):
+        # 名簿でそのユーザーのメールが変わる（同じ同期でメールが空く）
+        moved = roster.get(owner['username'])
+        return moved is not None and moved['email'] != email
+
+    for username, wanted in roster.items():
+        current = by_username.get(username)
+        owner = by_email.get(wanted['email'])
+        if current is None and owner is not None and owner['username'] not in roster:
+            # username が変わった社員（メールで対応付け）
+            current = owner
+        elif owner is not None and owner is not current and not released(owner, wanted['email']):
+            conflicts.append(f"{username}: email {wanted['email']} は別のユーザー {owner['username']} が使用中です")
+            if current is not None:
+                matched.add(current['id'])
+            continue
+        if current is None:
+            inserts.append(wanted)
+            continue
+        matched.add(current['id'])
+        compared = wanted if wanted['role'] else {**wanted, 'role': current['role']}
+        if current['username'] != username or current['fingerprint'] != fingerprint(compared):
+            updates.append({**wanted, 'id': current['id'], 'old_username': current['username'],
+                            'old_email': current['email']})
+
+    deactivations = []
+    if deactivate:
+        # 管理者は名簿になくても無効化しない
+        deactivations = [row for row in existing
+                         if row['id'] not in matched and row['role'] == 'user' and row['active']]
+    return inserts, updates, deactivations, conflicts
+
+
+def split_swaps(updates):
+    """(通常の更新, 入れ替えを含む更新) に分ける
+
+    別の更新対象が現在使っている username / email に変わる行（入れ替え・玉突き）は、
+    1つの UPDATE で反映すると途中で一意制約に違反するため、別パスで反映する。
+    """
+    held = {}
+    for row in updates:
+        held[('username', row['old_username'])] = row['id']
+        if row['old_email']:
+            held[('email', row['old_email'])] = row['id']
+    chained = set()
+    for row in updates:
+        for key in (('username', row['username']), ('email', row['email'])):
+            holder = held.get(key)
+            if holder is not None and holder != row['id']:
+                chained.update((row['id'], holder))
+    return ([row for row in updates if row['id'] not in chained],
+            [row for row in updates if row['id'] in chained])
+
+
+def batches(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def apply_inserts(cur, inserts, default_password):
+    for batch in batches(inserts):
+        values = ', '.join(['(%s, %s, %s, %s, %s, %s, TRUE)'] * len(batch))
+        params = []
+        for row in batch:
+            params += [row['username'], row['password'] or default_password, row['name'],
+                       row['email'], row['role'] or 'user', row['department']]
+        cur.execute('INSERT INTO users (username, password, name, email, role, department, active) '
+                    f'VALUES {values}', params)
+
+
+def apply_updates(cur, updates):
+    # role が NULL（名簿で空欄）の行は現在の権限を残す
+    for batch in batches(updates):
+        values = ', '.join(['(%s::int, %s::text, %s::text, %s::text, %s::text, %s::text)'] * len(batch))
+        params = []
+        for row in batch:
+            params += [row['id'], row['username'], row['name'], row['email'], row['role'], row['department']]
+        cur.execute(f'''
+            UPDATE users u SET username = v.username, name = v.name, email = v.email,
+                               role = COALESCE(v.role, u.role), department = v.department, active = TRUE,
+                               updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES {values}) AS v(id, username, name, email, role, department)
+            WHERE u.id = v.id''', params)
+
+
+def apply_swaps(cur, swaps):
+    """入れ替えを含む更新: いったん一意な仮の値に退避してから反映する（同じトランザクション内）"""
+    for batch in batches(swaps):
+        cur.execute('''
+            UPDATE users SET username = '~roster_sync~' || id, email = '~roster_sync~' || id || '@invalid'
+            WHERE id = ANY(%s)''', [[row['id'] for row in batch]])
+    apply_updates(cur, swaps)
+
+
+def apply_deactivations(cur, deactivations):
+    for batch in batches(deactivations):
+        cur.execute('UPDATE users SET active = FALSE, updated_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)',
+                    [[row['id'] for row in batch]])
+
+
+def print_diff(inserts, updates, deactivations, conflicts, limit):
+    def show(mark, title, rows, describe):
+        print(f'\n{mark} {title}: {len(rows)} 件')
+        for row in rows[:limit]:
+            print(f'    {describe(row)}')
+        if len(rows) > limit:
+            print(f'    … ほか {len(rows) - limit} 件')
+
+    show('➕', '追加', inserts, lambda r: f"{r['username']}  {r['name']}  {r['email']}  {r['department'] or ''}")
+    show('✏️', '更新', updates, lambda r: (f"{r['old_username']} → {r['username']}  " if r['old_username'] != r['username']
+                                          else f"{r['username']}  ") + f"{r['name']}  {r['email']}  {r['department'] or ''}")
+    show('🚫', '無効化', deactivations, lambda r: f"{r['username']}  {r['email']}")
+    if conflicts:
+        show('⚠️', '競合（スキップ）', conflicts, str)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='社員名簿を users テーブルに同期します')
+    parser.add_argument('roster', help='名簿ファイル（CSV / NDJSON）')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                        help='接続先（既定: 環境変数 DATABASE_URL）')
+    parser.add_argument('--dry-run', action='store_true', help='差分を表示するだけで反映しない')
+    parser.add_argument('--no-deactivate', action='store_true', help='名簿にないユーザーを無効化しない')
+    parser.add_argument('--default-password', help='名簿に password 列がない新規ユーザーの初期パスワード')
+    parser.add_argument('--show', type=int, default=20, help='差分の表示件数（種類ごと, 既定: 20）')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.roster):
+        print(f"❌ エラー: 名簿が見つかりません: {args.roster}")
+        sys.exit(1)
+
+    phases = Phases()
+    roster, problems = phases.run('名簿読み込み', lambda: read_roster(args.roster),
+                                  count=lambda result: len(result[0]))
+    for problem in problems:
+        print(f'⚠️ {problem}')
+
+    with connect(args.database_url) as conn:
+        from psycopg.rows import dict_row
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute("SELECT 1 FROM information_schema.columns "
+                        "WHERE table_name = 'users' AND column_name = 'active'")
+            if cur.fetchone() is None:
+                print('❌ エラー: users.active 列がありません。サーバーを起動してマイグレーションを適用してください')
+                sys.exit(1)
+
+            def load():
+                cur.execute(DB_FINGERPRINTS_SQL)
+                return cur.fetchall()
+
+            existing = phases.run('DB読み込み', load, count=len)
+            inserts, updates, deactivations, conflicts = phases.run(
+                '差分計算', lambda: plan(roster, existing, not args.no_deactivate),
+                count=lambda result: sum(len(rows) for rows in result[:3]))
+            print_diff(inserts, updates, deactivations, conflicts, args.show)
+
+            missing_password = [row['username'] for row in inserts if not row['password']]
+            if args.dry_run:
+                conn.rollback()
+                print('\n🔍 （ドライラン）変更は反映していません')
+            elif missing_password and not args.default_password:
+                conn.rollback()
+                print(f'\n❌ エラー: password 列のない新規ユーザーが {len(missing_password)} 件あります。'
+                      '--default-password を指定してください')
+                sys.exit(1)
+            else:
+                # 更新で空いた email を新規ユーザーが使えるよう、追加は更新の後
+                plain, swaps = split_swaps(updates)
+                phases.run('更新', lambda: apply_updates(cur, plain), count=len(plain))
+                if swaps:
+                    phases.run('更新（入れ替え）', lambda: apply_swaps(cur, swaps), count=len(swaps))
+                phases.run('追加', lambda: apply_inserts(cur, inserts, args.default_password), count=len(inserts))
+                phases.run('無効化', lambda: apply_deactivations(cur, deactivations), count=len(deactivations))
+                phases.run('コミット', conn.commit)
+                print(f'\n✅ 同期しました: 追加 {len(inserts)} / 更新 {len(updates)} / 無効化 {len(deactivations)}'
+                      + (f'（競合 {len(conflicts)} 件はスキップ）' if conflicts else ''))
+
+    phases.print()
+
+if __name__ == '__main__':
+    main()
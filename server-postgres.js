@@ -3,6 +3,7 @@ const cors = require('cors');
 const bodyParser = require('body-parser');
 const path = require('path');
 const db = require('./database');
+const { loadBuild } = require('./static-assets');
 
 const app = express();
 const PORT = process.env.PORT || 3000;
@@ -11,6 +12,22 @@ const PORT = process.env.PORT || 3000;
 app.use(cors());
 app.use(bodyParser.json({ limit: '100mb' })); // 制限を増やす
 app.use(bodyParser.urlencoded({ extended: true, limit: '100mb' }));
+// スライド画像（extract_slide_images.py で抽出、ファイル名がコンテンツハッシュ）は
+// 内容が変わらないため長期キャッシュ
+app.use('/slides', express.static(path.join(__dirname, 'public', 'slides'), {
+    immutable: true,
+    maxAge: '1y',
+    fallthrough: false
+}));
+// index.html のバックアップと修正スクリプトは配信しない（バックアップは public/snapshot_store.py で .snapshots/ に保存）
+const UNSERVED_PUBLIC_FILES = /^\/(index\.html\.[^/]+|[^/]+\.py)$/;
+app.use((req, res, next) => (UNSERVED_PUBLIC_FILES.test(req.path) ? res.status(404).end() : next()));
+// build_assets.py のビルド（スクリプト・スタイルを分割し、内容ハッシュ付きの名前で事前圧縮した
+// index.html）があれば優先して配信する（assets/ は長期キャッシュ、br / gzip は Accept-Encoding で選択）
+const builtAssets = loadBuild(path.join(__dirname, 'build'));
+if (builtAssets) {
+    app.use(builtAssets);
+}
 app.use(express.static('public'));
 
 // API エンドポイント
@@ -20,10 +37,27 @@ app.get('/api/health', (req, res) => {
     res.json({ status: 'ok', timestamp: new Date().toISOString() });
 });
 
+// 接続プールとクエリの計測（?reset=1 で集計をリセット）
+app.get('/api/metrics', (req, res) => {
+    const snapshot = db.metrics.snapshot();
+    if (req.query.reset === '1') {
+        db.metrics.reset();
+    }
+    res.json(snapshot);
+});
+
 // 全データ取得（既存のJSON形式互換）
 app.get('/api/data', async (req, res) => {
     try {
-        const data = await db.exportData();
+        // ?slides=lazy: 画像を除いたコース一覧（画像は /api/courses/:id/slides/:index で取得）
+        const lazySlides = req.query.slides === 'lazy';
+        // 変更がなければ全データを組み立てずに 304 を返す
+        const etag = `"${await db.getDataTag()}${lazySlides ? '-lazy' : ''}"`;
+        res.set({ 'ETag': etag, 'Cache-Control': 'no-cache' });
+        if (req.fresh) {
+            return res.status(304).end();
+        }
+        const data = await db.exportData({ lazySlides });
         res.json(data);
     } catch (error) {
         console.error('データ取得エラー:', error);
@@ -42,6 +76,24 @@ app.post('/api/data', async (req, res) => {
     });
 });
 
+// 差分保存（変更されたレコードのみ、リビジョンで競合検出）
+app.patch('/api/data', async (req, res) => {
+    const { baseRevision, changes } = req.body || {};
+    if (!Number.isInteger(baseRevision) || !changes || typeof changes !== 'object') {
+        return res.status(400).json({ success: false, error: 'baseRevision と changes が必要です' });
+    }
+    try {
+        const { revision, ids } = await db.applyDataPatch(baseRevision, changes);
+        res.json({ success: true, revision, ids });
+    } catch (error) {
+        if (error instanceof db.RevisionConflict) {
+            return res.status(409).json({ success: false, conflict: true, revision: error.revision });
+        }
+        console.error('差分保存エラー:', error);
+        res.status(500).json({ success: false, error: 'データの保存に失敗しました' });
+    }
+});
+
 // 進捗取得
 app.get('/api/progress/:userId', async (req, res) => {
     try {
@@ -75,6 +127,22 @@ app.get('/api/progress/:userId', async (req, res) => {
     }
 });
 
+// 進捗の一括保存（クライアントがまとめて送る / sendBeacon）
+// :userId のルートより先に定義する
+app.post('/api/progress/batch', async (req, res) => {
+    const items = req.body && Array.isArray(req.body.items) ? req.body.items : null;
+    if (!items || items.length > 1000) {
+        return res.status(400).json({ success: false, error: 'items（最大1000件）が必要です' });
+    }
+    try {
+        const { saved, rejected } = await db.saveProgressBatch(items);
+        res.json({ success: true, saved, rejected });
+    } catch (error) {
+        console.error('進捗一括保存エラー:', error);
+        res.status(500).json({ success: false, error: '進捗の保存に失敗しました' });
+    }
+});
+
 // 進捗保存
 app.post('/api/progress/:userId', async (req, res) => {
     try {
@@ -205,7 +273,8 @@ app.delete('/api/users/:id', async (req, res) => {
 // 全コース取得
 app.get('/api/courses', async (req, res) => {
     try {
-        const courses = await db.getCourses();
+        // ?view=summary: 一覧画面用（id, title, description, slideCount, quizLength, updated_at）
+        const courses = req.query.view === 'summary' ? await db.getCourseSummaries() : await db.getCourses();
         res.json(courses);
     } catch (error) {
         console.error('コース取得エラー:', error);
@@ -235,6 +304,37 @@ app.get('/api/courses/:id', async (req, res) => {
     }
 });
 
+// スライド1枚取得（?format=image で画像本体を返す）
+app.get('/api/courses/:id/slides/:index', async (req, res) => {
+    try {
+        const index = parseInt(req.params.index);
+        if (!Number.isInteger(index) || index < 0) {
+            return res.status(400).json({ error: 'スライド番号が不正です' });
+        }
+        const slide = await db.getCourseSlide(parseInt(req.params.id), index);
+        if (!slide) {
+            return res.status(404).json({ error: 'スライドが見つかりません' });
+        }
+        if (req.query.format !== 'image') {
+            return res.json(slide);
+        }
+        const data = typeof slide === 'string' ? slide : slide.data;
+        const match = /^data:([^;,]+);base64,/.exec(data || '');
+        if (match) {
+            res.set('Cache-Control', 'private, max-age=300');
+            res.type(match[1]).send(Buffer.from(data.slice(match[0].length), 'base64'));
+        } else if (data && data.startsWith('/slides/')) {
+            // 抽出済み（/slides/...）の画像は静的配信へ
+            res.redirect(data);
+        } else {
+            res.status(404).json({ error: '画像がありません' });
+        }
+    } catch (error) {
+        console.error('スライド取得エラー:', error);
+        res.status(500).json({ error: 'スライドの取得に失敗しました' });
+    }
+});
+
 // コース作成
 app.post('/api/courses', async (req, res) => {
     try {
@@ -278,17 +378,86 @@ app.delete('/api/courses/:id', async (req, res) => {
 
 // 学習記録API
 
+// ページ取得・集計の検索条件
+const RECORD_QUERY_KEYS = ['limit', 'cursor', 'department', 'courseId', 'userId', 'status', 'from', 'to'];
+const RECORD_PAGE_MAX = 500;
+
+// クエリ文字列を getLearningRecordsPage / getLearningRecordTotals の引数にする
+function parseRecordFilters(query) {
+    const filters = {
+        limit: query.limit === undefined ? 50 : parseInt(query.limit),
+        department: query.department || undefined,
+        courseId: query.courseId === undefined ? undefined : parseInt(query.courseId),
+        userId: query.userId === undefined ? undefined : parseInt(query.userId),
+        status: query.status || undefined,
+        from: query.from || undefined,
+        to: query.to || undefined
+    };
+    if (!(filters.limit >= 1 && filters.limit <= RECORD_PAGE_MAX)) {
+        return { error: `limit は 1〜${RECORD_PAGE_MAX} で指定してください` };
+    }
+    if (Number.isNaN(filters.courseId) || Number.isNaN(filters.userId)) {
+        return { error: 'courseId / userId は数値で指定してください' };
+    }
+    if (filters.status && !['completed', 'failed'].includes(filters.status)) {
+        return { error: 'status は completed または failed で指定してください' };
+    }
+    for (const key of ['from', 'to']) {
+        if (filters[key] && Number.isNaN(Date.parse(filters[key]))) {
+            return { error: `${key} は日付（YYYY-MM-DD など）で指定してください` };
+        }
+    }
+    if (query.cursor) {
+        try {
+            const after = JSON.parse(Buffer.from(query.cursor, 'base64url').toString());
+            if (!Number.isInteger(after.id) || (after.at !== null && typeof after.at !== 'string')) throw new Error();
+            filters.after = after;
+        } catch (error) {
+            return { error: 'cursor が不正です' };
+        }
+    }
+    return filters;
+}
+
 // 学習記録取得（全て）
+// limit / cursor / 絞り込み条件のいずれかを指定するとページ単位で返す:
+//   ?limit=100&department=...&courseId=1&status=completed|failed&from=2026-04-01&to=2026-04-30
+//   → { records, nextCursor }（次のページは &cursor=<nextCursor>）
 app.get('/api/learning-records', async (req, res) => {
     try {
-        const records = await db.getLearningRecords();
-        res.json(records);
+        if (!Object.keys(req.query).some(key => RECORD_QUERY_KEYS.includes(key))) {
+            const records = await db.getLearningRecords();
+            return res.json(records);
+        }
+        const filters = parseRecordFilters(req.query);
+        if (filters.error) {
+            return res.status(400).json({ error: filters.error });
+        }
+        const page = await db.getLearningRecordsPage(filters);
+        res.json({
+            records: page.records,
+            nextCursor: page.last ? Buffer.from(JSON.stringify(page.last)).toString('base64url') : null
+        });
     } catch (error) {
         console.error('学習記録取得エラー:', error);
         res.status(500).json({ error: '学習記録の取得に失敗しました' });
     }
 });
 
+// 学習記録の集計（/api/learning-records と同じ絞り込み条件）
+app.get('/api/learning-records/totals', async (req, res) => {
+    try {
+        const filters = parseRecordFilters(req.query);
+        if (filters.error) {
+            return res.status(400).json({ error: filters.error });
+        }
+        res.json(await db.getLearningRecordTotals(filters));
+    } catch (error) {
+        console.error('学習記録集計エラー:', error);
+        res.status(500).json({ error: '学習記録の集計に失敗しました' });
+    }
+});
+
 // 学習記録取得（ユーザーID）
 app.get('/api/learning-records/user/:userId', async (req, res) => {
     try {
@@ -311,6 +480,16 @@ app.post('/api/learning-records', async (req, res) => {
     }
 });
 
+// 修了状況ダッシュボード（部署 × コースの集計）
+app.get('/api/dashboard/completion', async (req, res) => {
+    try {
+        res.json(await db.getCompletionDashboard());
+    } catch (error) {
+        console.error('ダッシュボード取得エラー:', error);
+        res.status(500).json({ error: '修了状況の取得に失敗しました' });
+    }
+});
+
 // ルートパス
 app.get('/', (req, res) => {
     res.sendFile(path.join(__dirname, 'public', 'index.html'));
@@ -336,29 +515,28 @@ setInterval(async () => {
 // データベース診断エンドポイント
 app.get('/api/debug/database', async (req, res) => {
     try {
-        const usersCount = await db.pool.query('SELECT COUNT(*) as count FROM users');
-        const coursesCount = await db.pool.query('SELECT COUNT(*) as count FROM courses');
-        const recordsCount = await db.pool.query('SELECT COUNT(*) as count FROM learning_records');
-        const passedCount = await db.pool.query('SELECT COUNT(*) as count FROM learning_records WHERE passed = true');
+        // 件数は集計テーブルから1回で取得する（学習記録の全件走査をしない）
+        const counts = await db.pool.query(`
+            SELECT (SELECT COUNT(*) FROM users) AS users,
+                   (SELECT COUNT(*) FROM courses) AS courses,
+                   (SELECT COALESCE(SUM(attempts), 0) FROM course_rollups) AS "totalRecords",
+                   (SELECT COALESCE(SUM(passes), 0) FROM course_rollups) AS "passedRecords"
+        `);
         
-        // 重複チェック
+        // 重複チェック（受講者・コースごとの集計で2件以上）
         const duplicates = await db.pool.query(`
             SELECT 
                 user_id, 
                 course_id, 
-                COUNT(*) as count
-            FROM learning_records
-            GROUP BY user_id, course_id
-            HAVING COUNT(*) > 1
+                attempts as count
+            FROM course_user_stats
+            WHERE attempts > 1
         `);
 
         res.json({
             success: true,
             stats: {
-                users: usersCount.rows[0].count,
-                courses: coursesCount.rows[0].count,
-                totalRecords: recordsCount.rows[0].count,
-                passedRecords: passedCount.rows[0].count,
+                ...counts.rows[0],
                 duplicates: duplicates.rows.length
             },
             duplicateDetails: duplicates.rows
@@ -369,156 +547,92 @@ app.get('/api/debug/database', async (req, res) => {
     }
 });
 
-// 重複データ削除エンドポイント
+// コースキャッシュの統計（ヒット・ミス数）
+app.get('/api/debug/course-cache', (req, res) => {
+    res.json(db.getCourseCacheStats());
+});
+
+// 重複データ削除エンドポイント（ユーザー・コースごとに最新の記録を残す）
 app.post('/api/debug/cleanup-duplicates', async (req, res) => {
-    const client = await db.pool.connect();
-    
     try {
-        await client.query('BEGIN');
-        
-        // 重複を見つける
-        const duplicates = await client.query(`
-            SELECT 
-                user_id, 
-                course_id, 
-                array_agg(id ORDER BY completed_at DESC) as record_ids
-            FROM learning_records
-            GROUP BY user_id, course_id
-            HAVING COUNT(*) > 1
-        `);
-
-        let deletedCount = 0;
-        const details = [];
-
-        for (const dup of duplicates.rows) {
-            const idsToKeep = [dup.record_ids[0]];
-            const idsToDelete = dup.record_ids.slice(1);
-
-            details.push({
-                user_id: dup.user_id,
-                course_id: dup.course_id,
-                kept: idsToKeep[0],
-                deleted: idsToDelete
-            });
-
-            await client.query(
-                'DELETE FROM learning_records WHERE id = ANY($1)',
-                [idsToDelete]
-            );
-
-            deletedCount += idsToDelete.length;
-        }
-
-        await client.query('COMMIT');
-        
-        // 最終状態を確認
-        const finalCount = await client.query('SELECT COUNT(*) as count FROM learning_records');
+        const result = await db.dedupeLearningRecords({
+            dryRun: req.query.dryRun === 'true',
+            onBatch: logMaintenanceBatch
+        });
+        const finalCount = await db.pool.query('SELECT COUNT(*) as count FROM learning_records');
 
         res.json({
             success: true,
-            deletedCount,
+            deletedCount: result.deleted,
             remainingRecords: finalCount.rows[0].count,
-            details
+            ...result
         });
     } catch (error) {
-        await client.query('ROLLBACK');
         console.error('クリーンアップエラー:', error);
         res.status(500).json({ success: false, error: error.message });
-    } finally {
-        client.release();
     }
 });
 
+// メンテナンス処理の進捗ログ（バッチごと）
+function logMaintenanceBatch(progress) {
+    const rate = count => Math.round(count / Math.max(progress.seconds, 0.001)).toLocaleString();
+    console.log(`  [${progress.batches}] 走査 ${progress.scanned.toLocaleString()} / 削除 ${progress.deleted.toLocaleString()}` +
+        ` (${rate(progress.scanned)} 行/秒 走査, ${rate(progress.deleted)} 行/秒 削除)`);
+}
+
 // ========================================
 // 緊急対応: データベースクリーンアップAPI
 // ========================================
 
 // 学習記録を完全削除（管理者用）
 app.post('/api/debug/reset-learning-records', async (req, res) => {
-    const client = await db.pool.connect();
-    
     try {
         console.log('🚨 学習記録の完全リセットを実行中...');
         
-        await client.query('BEGIN');
-        
-        const beforeCount = await client.query('SELECT COUNT(*) as count FROM learning_records');
-        console.log('  削除前の記録数:', beforeCount.rows[0].count);
-        
-        await client.query('TRUNCATE TABLE learning_records RESTART IDENTITY');
-        
-        await client.query('COMMIT');
+        // TRUNCATE はテーブル全体をロックするため、id の範囲ごとに削除する
+        const result = await db.deleteLearningRecords({ onBatch: logMaintenanceBatch });
         
         console.log('✅ 学習記録を完全削除しました');
         
         res.json({
             success: true,
-            deletedCount: parseInt(beforeCount.rows[0].count),
+            deletedCount: result.deleted,
             message: '学習記録を完全にリセットしました'
         });
         
     } catch (error) {
-        await client.query('ROLLBACK');
         console.error('❌ リセットエラー:', error);
         res.status(500).json({ success: false, error: error.message });
-    } finally {
-        client.release();
     }
 });
 
 // ユーザーごとに最新の記録のみを保持
 app.post('/api/debug/keep-latest-only', async (req, res) => {
-    const client = await db.pool.connect();
-    
     try {
         console.log('🧹 ユーザーごとに最新の記録のみを保持...');
         
-        await client.query('BEGIN');
-        
-        const beforeCount = await client.query('SELECT COUNT(*) as count FROM learning_records');
+        const beforeCount = await db.pool.query('SELECT COUNT(*) as count FROM learning_records');
         console.log('  処理前の記録数:', beforeCount.rows[0].count);
         
-        const latestRecords = await client.query(`
-            SELECT DISTINCT ON (user_id, course_id) id
-            FROM learning_records
-            ORDER BY user_id, course_id, completed_at DESC
-        `);
-        
-        const idsToKeep = latestRecords.rows.map(r => r.id);
-        console.log('  保持するID:', idsToKeep);
-        
-        if (idsToKeep.length > 0) {
-            await client.query(
-                'DELETE FROM learning_records WHERE id NOT IN (' + 
-                idsToKeep.map((_, i) => `$${i + 1}`).join(',') + ')',
-                idsToKeep
-            );
-        } else {
-            await client.query('TRUNCATE TABLE learning_records RESTART IDENTITY');
-        }
-        
-        await client.query('COMMIT');
+        const result = await db.dedupeLearningRecords({ onBatch: logMaintenanceBatch });
         
-        const afterCount = await client.query('SELECT COUNT(*) as count FROM learning_records');
-        const deletedCount = parseInt(beforeCount.rows[0].count) - parseInt(afterCount.rows[0].count);
+        const afterCount = await db.pool.query('SELECT COUNT(*) as count FROM learning_records');
         
         console.log('  処理後の記録数:', afterCount.rows[0].count);
-        console.log('  削除した記録数:', deletedCount);
+        console.log('  削除した記録数:', result.deleted);
         
         res.json({
             success: true,
             before: parseInt(beforeCount.rows[0].count),
             after: parseInt(afterCount.rows[0].count),
-            deleted: deletedCount,
-            keptIds: idsToKeep
+            deleted: result.deleted,
+            batches: result.batches,
+            seconds: result.seconds
         });
         
     } catch (error) {
-        await client.query('ROLLBACK');
         console.error('❌ クリーンアップエラー:', error);
         res.status(500).json({ success: false, error: error.message });
-    } finally {
-        client.release();
     }
 });
 
@@ -532,6 +646,8 @@ async function startServer() {
 🚀 eラーニングシステムが起動しました！
 📡 サーバー: http://localhost:${PORT}
 🗄️  データベース: PostgreSQL (${process.env.DATABASE_URL ? '接続済み' : 'ローカル'})
+🔌 接続プール: 最大 ${db.metrics.config.max} 接続, statement_timeout ${db.metrics.config.statementTimeoutMs || 'なし'}${db.metrics.config.statementTimeoutMs ? 'ms' : ''}
+📦 静的ファイル: ${builtAssets ? `build/ (${builtAssets.summary})` : 'public/'}
             `);
         });
     } catch (error) {
@@ -3,6 +3,8 @@ const cors = require('cors');
 const bodyParser = require('body-parser');
 const fs = require('fs').promises;
 const path = require('path');
+const { JournalStore, applyChanges } = require('./journal-store');
+const { loadBuild } = require('./static-assets');
 
 const app = express();
 const PORT = process.env.PORT || 3000;
@@ -11,11 +13,32 @@ const PORT = process.env.PORT || 3000;
 const DATA_DIR = path.join(__dirname, 'data');
 const DATA_FILE = path.join(DATA_DIR, 'database.json');
 const PROGRESS_DIR = path.join(DATA_DIR, 'progress');
+const JOURNAL_FILE = path.join(DATA_DIR, 'database.journal');
+
+// DATA_STORAGE=journal: 変更をジャーナルに追記し、データはメモリから返す
+// （既定は保存のたびに database.json 全体を書き直す）
+const journal = process.env.DATA_STORAGE === 'journal' ? new JournalStore(DATA_FILE, JOURNAL_FILE) : null;
 
 // ミドルウェア
 app.use(cors());
 app.use(bodyParser.json({ limit: '50mb' }));
 app.use(bodyParser.urlencoded({ extended: true, limit: '50mb' }));
+// スライド画像（extract_slide_images.py で抽出、ファイル名がコンテンツハッシュ）は
+// 内容が変わらないため長期キャッシュ
+app.use('/slides', express.static(path.join(__dirname, 'public', 'slides'), {
+    immutable: true,
+    maxAge: '1y',
+    fallthrough: false
+}));
+// index.html のバックアップと修正スクリプトは配信しない（バックアップは public/snapshot_store.py で .snapshots/ に保存）
+const UNSERVED_PUBLIC_FILES = /^\/(index\.html\.[^/]+|[^/]+\.py)$/;
+app.use((req, res, next) => (UNSERVED_PUBLIC_FILES.test(req.path) ? res.status(404).end() : next()));
+// build_assets.py のビルド（スクリプト・スタイルを分割し、内容ハッシュ付きの名前で事前圧縮した
+// index.html）があれば優先して配信する（assets/ は長期キャッシュ、br / gzip は Accept-Encoding で選択）
+const builtAssets = loadBuild(path.join(__dirname, 'build'));
+if (builtAssets) {
+    app.use(builtAssets);
+}
 app.use(express.static('public'));
 
 // データディレクトリの初期化
@@ -143,6 +166,9 @@ async function initializeDataDirectory() {
 
 // データ読み込み
 async function loadData() {
+    if (journal) {
+        return journal.data;
+    }
     try {
         const data = await fs.readFile(DATA_FILE, 'utf-8');
         return JSON.parse(data);
@@ -152,11 +178,24 @@ async function loadData() {
     }
 }
 
-// データ保存
-async function saveData(data) {
+// データ保存（一時ファイルに書いてから置き換える）
+async function saveData(data, revision) {
+    if (journal) {
+        try {
+            dataRevision = await journal.replace(data);
+            return true;
+        } catch (error) {
+            console.error('データ保存エラー:', error);
+            return false;
+        }
+    }
     try {
         data.lastUpdated = new Date().toISOString();
-        await fs.writeFile(DATA_FILE, JSON.stringify(data, null, 2));
+        data.revision = revision !== undefined ? revision : (await currentRevision()) + 1;
+        const tmpFile = `${DATA_FILE}.${process.pid}.tmp`;
+        await fs.writeFile(tmpFile, JSON.stringify(data, null, 2));
+        await fs.rename(tmpFile, DATA_FILE);
+        dataRevision = data.revision;
         return true;
     } catch (error) {
         console.error('データ保存エラー:', error);
@@ -164,6 +203,52 @@ async function saveData(data) {
     }
 }
 
+// データファイルの書き込みは1件ずつ順番に実行する
+let writeQueue = Promise.resolve();
+function withDataLock(task) {
+    const run = writeQueue.then(task, task);
+    writeQueue = run.catch(() => {});
+    return run;
+}
+
+let dataRevision = null;
+async function currentRevision() {
+    if (dataRevision === null) {
+        const data = await loadData();
+        dataRevision = (data && data.revision) || 0;
+    }
+    return dataRevision;
+}
+
+class RevisionConflict extends Error {
+    constructor(revision) {
+        super('revision conflict');
+        this.revision = revision;
+    }
+}
+
+// 変更されたレコードだけを反映する（baseRevision が古ければ RevisionConflict）
+async function applyDataPatch(baseRevision, changes) {
+    const data = await loadData();
+    if (!data) {
+        throw new Error('データの読み込みに失敗しました');
+    }
+    const revision = data.revision || 0;
+    if (baseRevision !== revision) {
+        throw new RevisionConflict(revision);
+    }
+
+    if (journal) {
+        dataRevision = await journal.patch(changes);
+        return dataRevision;
+    }
+    applyChanges(data, changes);
+    if (!(await saveData(data, revision + 1))) {
+        throw new Error('データの保存に失敗しました');
+    }
+    return data.revision;
+}
+
 // 進捗データの読み込み
 async function loadProgress(userId) {
     try {
@@ -208,6 +293,19 @@ app.get('/api/health', (req, res) => {
 
 // 全データ取得
 app.get('/api/data', async (req, res) => {
+    if (journal) {
+        res.set({ 'ETag': `"j${journal.revision}"`, 'Cache-Control': 'no-cache' });
+        if (req.fresh) {
+            return res.status(304).end();
+        }
+        return res.type('json').send(journal.json());
+    }
+    // データファイルのリビジョン（保存のたびに saveData() が進め、ファイルにも書く）を ETag にし、
+    // 変更がなければ読み込まずに 304 を返す。更新時刻は粒度が粗く、同じサイズの保存が続くと見分けられない
+    res.set({ 'ETag': `"r${await currentRevision()}"`, 'Cache-Control': 'no-cache' });
+    if (req.fresh) {
+        return res.status(304).end();
+    }
     const data = await loadData();
     if (data) {
         res.json(data);
@@ -218,14 +316,32 @@ app.get('/api/data', async (req, res) => {
 
 // データ保存
 app.post('/api/data', async (req, res) => {
-    const success = await saveData(req.body);
+    const success = await withDataLock(() => saveData(req.body));
     if (success) {
-        res.json({ success: true, message: 'データを保存しました' });
+        res.json({ success: true, message: 'データを保存しました', revision: dataRevision });
     } else {
         res.status(500).json({ success: false, error: 'データの保存に失敗しました' });
     }
 });
 
+// 差分保存（変更されたレコードのみ）
+app.patch('/api/data', async (req, res) => {
+    const { baseRevision, changes } = req.body || {};
+    if (!Number.isInteger(baseRevision) || !changes || typeof changes !== 'object') {
+        return res.status(400).json({ success: false, error: 'baseRevision と changes が必要です' });
+    }
+    try {
+        const revision = await withDataLock(() => applyDataPatch(baseRevision, changes));
+        res.json({ success: true, revision, ids: {} });
+    } catch (error) {
+        if (error instanceof RevisionConflict) {
+            return res.status(409).json({ success: false, conflict: true, revision: error.revision });
+        }
+        console.error('差分保存エラー:', error);
+        res.status(500).json({ success: false, error: 'データの保存に失敗しました' });
+    }
+});
+
 // 進捗取得
 app.get('/api/progress/:userId', async (req, res) => {
     const progress = await loadProgress(req.params.userId);
@@ -236,6 +352,32 @@ app.get('/api/progress/:userId', async (req, res) => {
     }
 });
 
+// 進捗の一括保存（クライアントがまとめて送る / sendBeacon）
+// :userId のルートより先に定義する
+app.post('/api/progress/batch', async (req, res) => {
+    const items = req.body && Array.isArray(req.body.items) ? req.body.items : null;
+    if (!items || items.length > 1000) {
+        return res.status(400).json({ success: false, error: 'items（最大1000件）が必要です' });
+    }
+    try {
+        // 進捗ファイルはユーザー単位のため、ユーザーごとに最後の状態を保存
+        const latest = new Map();
+        for (const item of items) {
+            const userId = item.userId ?? item.user_id;
+            if (userId !== undefined && userId !== null && /^[\w-]+$/.test(String(userId))) {
+                latest.set(String(userId), item);
+            }
+        }
+        const results = await Promise.all(
+            [...latest].map(([userId, item]) => saveProgress(userId, item))
+        );
+        res.json({ success: results.every(Boolean), saved: results.filter(Boolean).length });
+    } catch (error) {
+        console.error('進捗一括保存エラー:', error);
+        res.status(500).json({ success: false, error: '進捗の保存に失敗しました' });
+    }
+});
+
 // 進捗保存
 app.post('/api/progress/:userId', async (req, res) => {
     const success = await saveProgress(req.params.userId, req.body);
@@ -270,7 +412,7 @@ app.get('/api/export', async (req, res) => {
 
 // データインポート
 app.post('/api/import', async (req, res) => {
-    const success = await saveData(req.body);
+    const success = await withDataLock(() => saveData(req.body));
     if (success) {
         res.json({ success: true, message: 'データをインポートしました' });
     } else {
@@ -297,7 +439,7 @@ app.delete('/api/data', async (req, res) => {
         lastUpdated: new Date().toISOString()
     };
     
-    const success = await saveData(initialData);
+    const success = await withDataLock(() => saveData(initialData));
     if (success) {
         // 全ての進捗ファイルも削除
         try {
@@ -323,12 +465,18 @@ app.get('/', (req, res) => {
 // サーバー起動
 async function startServer() {
     await initializeDataDirectory();
+    if (journal) {
+        const started = Date.now();
+        const replayed = await journal.open();
+        console.log(`📒 ジャーナルを再生しました: ${replayed} 件 (revision ${journal.revision}, ${Date.now() - started}ms)`);
+    }
     
     app.listen(PORT, () => {
         console.log(`
 🚀 eラーニングシステムが起動しました！
 📡 サーバー: http://localhost:${PORT}
-💾 データ保存先: ${DATA_DIR}
+💾 データ保存先: ${DATA_DIR}${journal ? '（ジャーナル方式）' : ''}
+📦 静的ファイル: ${builtAssets ? `build/ (${builtAssets.summary})` : 'public/'}
         `);
     });
 }
@@ -0,0 +1,154 @@
+// build_assets.py のビルド（build/asset-manifest.json）の配信
+//
+// マニフェストに載ったファイル（index.html と、分割したスクリプト・スタイル）を起動時に
+// メモリへ読み込み、Accept-Encoding に合わせて事前圧縮した br / gzip 版を返します。
+// ファイル名が内容ハッシュの assets/ は長期キャッシュ（immutable）、HTML は no-cache
+// （ETag で再検証）です。マニフェストがない場合や、ビルド後に public/ の HTML が
+// 修正された場合は null を返し、サーバーは従来どおり public/ から配信します。
+
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+
+const MANIFEST_FILE = 'asset-manifest.json';
+const MANIFEST_VERSION = 1;
+
+// 同じ q 値ならこの順に選ぶ
+const ENCODINGS = ['br', 'gzip'];
+
+const IMMUTABLE_CACHE = 'public, max-age=31536000, immutable';
+const REVALIDATE_CACHE = 'no-cache';
+
+// Accept-Encoding を {エンコーディング: q 値} にする
+function parseAcceptEncoding(header) {
+    const accepted = {};
+    for (const part of String(header || '').split(',')) {
+        const [name, ...params] = part.trim().toLowerCase().split(';');
+        if (!name) continue;
+        let q = 1;
+        for (const param of params) {
+            const [key, value] = param.trim().split('=');
+            if (key === 'q') q = Number(value) || 0;
+        }
+        accepted[name] = q;
+    }
+    return accepted;
+}
+
+// 圧縮版のうち受け付けられる最も q 値の高いもの（なければ identity）
+function chooseEncoding(header, variants) {
+    const accepted = parseAcceptEncoding(header);
+    let best = 'identity';
+    let bestQ = 0;
+    for (const encoding of ENCODINGS) {
+        if (!variants[encoding]) continue;
+        const q = encoding in accepted ? accepted[encoding] : (accepted['*'] || 0);
+        if (q > bestQ) {
+            best = encoding;
+            bestQ = q;
+        }
+    }
+    return best;
+}
+
+function etagMatches(header, etag) {
+    if (!header) return false;
+    return header.split(',').some(tag => {
+        const value = tag.trim();
+        return value === '*' || value === etag || value === `W/${etag}`;
+    });
+}
+
+function sha256(file) {
+    return crypto.createHash('sha256').update(fs.readFileSync(file)).digest('hex');
+}
+
+// ビルド後に修正された HTML（ビルドが古い）
+function stalePages(manifest, baseDir) {
+    return Object.entries(manifest.pages || {})
+        .filter(([page, info]) => {
+            try {
+                return sha256(path.join(baseDir, page)) !== info.sha256;
+            } catch (error) {
+                return false;
+            }
+        })
+        .map(([page]) => page);
+}
+
+// build/ のマニフェストを読み込み、配信用のミドルウェアを返す（使えない場合は null）
+function loadBuild(root, options = {}) {
+    const baseDir = options.baseDir || path.dirname(root);
+    let manifest;
+    try {
+        manifest = JSON.parse(fs.readFileSync(path.join(root, MANIFEST_FILE), 'utf8'));
+    } catch (error) {
+        if (error.code !== 'ENOENT') {
+            console.error(`⚠️  ${MANIFEST_FILE} を読み込めません（public/ から配信します）:`, error.message);
+        }
+        return null;
+    }
+    if (manifest.version !== MANIFEST_VERSION) {
+        console.error(`⚠️  ${MANIFEST_FILE} の形式が違います（public/ から配信します）。python3 build_assets.py を実行してください`);
+        return null;
+    }
+    const stale = stalePages(manifest, baseDir);
+    if (stale.length) {
+        console.error(`⚠️  ビルド後に ${stale.join(', ')} が修正されています（public/ から配信します）。python3 build_assets.py を実行してください`);
+        return null;
+    }
+
+    const files = new Map();
+    let bytes = 0;
+    try {
+        for (const [url, entry] of Object.entries(manifest.files || {})) {
+            const variants = { identity: fs.readFileSync(path.join(root, entry.path)) };
+            for (const [encoding, variant] of Object.entries(entry.encodings || {})) {
+                variants[encoding] = fs.readFileSync(path.join(root, variant.path));
+            }
+            Object.values(variants).forEach(body => { bytes += body.length; });
+            files.set(url, {
+                type: entry.type,
+                etag: `"${entry.hash}"`,
+                cacheControl: entry.immutable ? IMMUTABLE_CACHE : REVALIDATE_CACHE,
+                variants
+            });
+        }
+    } catch (error) {
+        console.error('⚠️  ビルドのファイルを読み込めません（public/ から配信します）:', error.message);
+        return null;
+    }
+    if (files.has('/index.html')) {
+        files.set('/', files.get('/index.html'));
+    }
+
+    const middleware = (req, res, next) => {
+        if (req.method !== 'GET' && req.method !== 'HEAD') return next();
+        const file = files.get(req.path);
+        if (!file) return next();
+
+        const encoding = chooseEncoding(req.headers['accept-encoding'], file.variants);
+        // 圧縮形式ごとに別の ETag（同じ ETag で中身の違う応答を返さない）
+        const etag = encoding === 'identity' ? file.etag : file.etag.replace(/"$/, `-${encoding}"`);
+        res.setHeader('Content-Type', file.type);
+        res.setHeader('Cache-Control', file.cacheControl);
+        res.vary('Accept-Encoding');
+        res.setHeader('ETag', etag);
+        if (etagMatches(req.headers['if-none-match'], etag)) {
+            return res.status(304).end();
+        }
+        const body = file.variants[encoding];
+        if (encoding !== 'identity') {
+            res.setHeader('Content-Encoding', encoding);
+        }
+        res.setHeader('Content-Length', body.length);
+        res.status(200);
+        return req.method === 'HEAD' ? res.end() : res.end(body);
+    };
+    middleware.manifest = manifest;
+    middleware.summary = `${files.size - (files.has('/') ? 1 : 0)} ファイル, ${(bytes / 1024).toFixed(1)} KB` +
+        ` (${manifest.built}, ${(manifest.encodings || []).join('/')})`;
+    return middleware;
+}
+
+module.exports = { loadBuild, chooseEncoding, parseAcceptEncoding };
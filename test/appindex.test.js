@@ -0,0 +1,129 @@
+// AppIndex（public/patch_engine.py が追加する AppData の索引）のテスト
+//
+// 索引の参照が、AppData の書き換え（配列の差し替え・件数の変わらない変更・キーの書き換え）の
+// 後も線形探索と同じ結果になることを確認する。定義は patch_engine.py から取り出すため python3 が必要。
+//
+//     node --test test/appindex.test.js
+
+const assert = require('assert');
+const path = require('path');
+const test = require('node:test');
+const vm = require('vm');
+const { spawnSync } = require('child_process');
+
+const PUBLIC_DIR = path.join(__dirname, '..', 'public');
+
+// patch_engine.py の APP_INDEX（target の変換をかけたもの）。python3 がなければ null
+function appIndexSource(target) {
+    const script = 'import sys, patch_engine as pe\n'
+        + 'transform = pe.TARGETS[sys.argv[1]]\n'
+        + 'sys.stdout.write(transform(pe.APP_INDEX) if transform else pe.APP_INDEX)\n';
+    const result = spawnSync('python3', ['-c', script, target], { cwd: PUBLIC_DIR, encoding: 'utf8' });
+    if (result.error || result.status !== 0) return null;
+    return result.stdout;
+}
+
+// Database.save() はサーバーが採番したIDを反映する（update_html.py 版の commit() と同じ）
+function createContext(source) {
+    const context = vm.createContext({ console, Promise, Map });
+    vm.runInContext(`
+        var AppData = { users: [], courses: [], learningRecords: [] };
+        var serverIds = null;
+        var Database = {
+            async load() {
+                AppData.users = [{ id: 1, username: 'a' }, { id: 2, username: 'b' }, { id: 3, username: 'a' }];
+                AppData.courses = [{ id: 'c1' }, { id: 'c2' }];
+                AppData.learningRecords = [
+                    { userId: 1, courseId: 'c1' }, { userId: 2, courseId: 'c1' }, { userId: 1, courseId: 'c2' }
+                ];
+                return true;
+            },
+            async save() {
+                if (serverIds) AppData.users.forEach(u => { if (serverIds[u.id]) u.id = serverIds[u.id]; });
+                return true;
+            }
+        };
+    ` + source.replace('const AppIndex', 'var AppIndex'), context);
+    return context;
+}
+
+// すべてのフィールド・値で AppIndex と線形探索の結果が同じか
+function assertConsistent(context) {
+    const { AppIndex, AppData } = context;
+    for (const [name, fields] of Object.entries(AppIndex.FIELDS)) {
+        for (const field of fields) {
+            const values = new Set(AppData[name].map(r => r[field]));
+            values.add('missing');
+            for (const value of values) {
+                assert.strictEqual(AppIndex.find(name, field, value), AppData[name].find(r => r[field] === value),
+                    `${name}.${field} = ${value}`);
+                assert.deepStrictEqual(AppIndex.filter(name, field, value), AppData[name].filter(r => r[field] === value),
+                    `${name}.${field} = ${value}`);
+            }
+        }
+    }
+}
+
+for (const target of ['modern', 'compatible']) {
+    const source = appIndexSource(target);
+
+    test(`${target}: 読み込み・追加・差し替えの後も線形探索と同じ結果`, { skip: !source && 'python3 がありません' }, async () => {
+        const context = createContext(source);
+        await context.Database.load();
+        assert.ok(context.AppIndex.indexes.users, 'load() の後に作成される');
+        assertConsistent(context);
+
+        context.AppData.users.push({ id: 4, username: 'd' });
+        assertConsistent(context);
+
+        context.AppData.courses = context.AppData.courses.filter(c => c.id !== 'c1');
+        assertConsistent(context);
+
+        // filter() の結果を書き換えても索引は変わらない
+        context.AppIndex.filter('learningRecords', 'userId', 1).push({ userId: 1 });
+        assertConsistent(context);
+    });
+
+    test(`${target}: 件数の変わらない変更は save() で破棄される`, { skip: !source && 'python3 がありません' }, async () => {
+        const context = createContext(source);
+        await context.Database.load();
+        const { AppData, AppIndex, Database } = context;
+        AppIndex.find('users', 'id', 2);
+
+        // 削除と追加で件数が同じ
+        AppData.users.splice(1, 1);
+        AppData.users.push({ id: 7, username: 'g' });
+        const saving = Database.save();
+        assertConsistent(context);
+        await saving;
+
+        // キーの書き換え
+        AppData.users[0].username = 'renamed';
+        await Database.save();
+        assertConsistent(context);
+    });
+
+    test(`${target}: サーバーが採番したIDと invalidate() を反映する`, { skip: !source && 'python3 がありません' }, async () => {
+        const context = createContext(source);
+        await context.Database.load();
+        const { AppData, AppIndex, Database } = context;
+
+        AppData.users.push({ id: 'tmp-5', username: 'e' });
+        assert.strictEqual(AppIndex.find('users', 'id', 'tmp-5').username, 'e');
+        context.serverIds = { 'tmp-5': 5 };
+        await Database.save();
+        await Promise.resolve();
+        assert.strictEqual(AppIndex.find('users', 'id', 'tmp-5'), undefined);
+        assert.strictEqual(AppIndex.find('users', 'id', 5).username, 'e');
+
+        // save() を経由しない書き換えは invalidate() で反映する
+        AppData.courses[0].id = 'c9';
+        AppIndex.invalidate('courses');
+        assertConsistent(context);
+
+        // attach() は二重に包まない
+        const save = Database.save;
+        AppIndex.attach(Database);
+        assert.strictEqual(Database.save, save);
+    });
+}
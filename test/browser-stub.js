@@ -0,0 +1,176 @@
+// public/*.html のインラインスクリプトを node で評価するための最小限の DOM スタブ
+//
+// 画面の描画結果は innerHTML / insertAdjacentHTML の文字列として記録するだけで、
+// HTML の解釈はしません。起動時の例外や、onclick から参照するグローバルの
+// 定義漏れを検出するためのものです。
+
+const fs = require('fs');
+const vm = require('vm');
+
+function extractScripts(html) {
+    const scripts = [];
+    const pattern = /<script\b([^>]*)>([\s\S]*?)<\/script\s*>/gi;
+    let m;
+    while ((m = pattern.exec(html))) {
+        if (!/\bsrc\s*=/i.test(m[1])) scripts.push(m[2]);
+    }
+    return scripts;
+}
+
+function createElement(id) {
+    const listeners = {};
+    return {
+        id,
+        innerHTML: '',
+        textContent: '',
+        value: '',
+        style: {},
+        rows: [],
+        children: [],
+        dataset: {},
+        classList: { add() {}, remove() {}, toggle() {}, contains: () => false },
+        inserted: [],
+        listeners,
+        addEventListener(type, handler) {
+            (listeners[type] = listeners[type] || []).push(handler);
+        },
+        removeEventListener() {},
+        insertAdjacentHTML(position, html) {
+            this.inserted.push(html);
+        },
+        appendChild(child) { this.children.push(child); return child; },
+        removeChild(child) { this.children = this.children.filter(c => c !== child); return child; },
+        setAttribute() {},
+        querySelector: () => null,
+        querySelectorAll: () => [],
+        closest: () => null,
+        click() {},
+        remove() {},
+        focus() {}
+    };
+}
+
+// fetch の応答: routes は { 'GET /api/data': 本文 or (url, options) => 本文 }
+function createFetch(routes, calls) {
+    return async (url, options = {}) => {
+        const method = (options.method || 'GET').toUpperCase();
+        const path = String(url).replace(/^https?:\/\/[^/]+/, '').split('?')[0];
+        calls.push({ method, url: String(url), options });
+        const route = routes[`${method} ${path}`];
+        if (route === undefined) {
+            return { ok: false, status: 404, headers: { get: () => null }, json: async () => ({}), text: async () => 'not found' };
+        }
+        const body = typeof route === 'function' ? route(String(url), options) : route;
+        return {
+            ok: true,
+            status: 200,
+            headers: { get: () => null },
+            json: async () => JSON.parse(JSON.stringify(body)),
+            text: async () => JSON.stringify(body),
+            blob: async () => ({})
+        };
+    };
+}
+
+function storage() {
+    const items = new Map();
+    return {
+        getItem: key => (items.has(key) ? items.get(key) : null),
+        setItem: (key, value) => items.set(key, String(value)),
+        removeItem: key => items.delete(key),
+        clear: () => items.clear()
+    };
+}
+
+// html のインラインスクリプトを1つの文脈で順に評価する
+function loadPage(file, { routes = {}, hostname = 'example.com' } = {}) {
+    const elements = new Map();
+    const documentListeners = {};
+    const windowListeners = {};
+    const alerts = [];
+    const logs = [];
+    const fetchCalls = [];
+    const element = id => {
+        if (!elements.has(id)) elements.set(id, createElement(id));
+        return elements.get(id);
+    };
+    const body = createElement('body');
+    const document = {
+        body,
+        visibilityState: 'visible',
+        getElementById: element,
+        querySelector: () => null,
+        querySelectorAll: () => [],
+        createElement: tag => createElement(tag),
+        addEventListener(type, handler) {
+            (documentListeners[type] = documentListeners[type] || []).push(handler);
+        },
+        removeEventListener() {}
+    };
+    const window = {
+        location: { hostname, origin: `https://${hostname}`, href: `https://${hostname}/`, reload() {} },
+        addEventListener(type, handler) {
+            (windowListeners[type] = windowListeners[type] || []).push(handler);
+        },
+        removeEventListener() {},
+        print() {}
+    };
+    const console_ = {
+        log: (...args) => logs.push(['log', ...args]),
+        info: (...args) => logs.push(['info', ...args]),
+        warn: (...args) => logs.push(['warn', ...args]),
+        error: (...args) => logs.push(['error', ...args])
+    };
+    const context = {
+        window,
+        document,
+        console: console_,
+        navigator: { userAgent: 'node', sendBeacon: () => true },
+        location: window.location,
+        sessionStorage: storage(),
+        localStorage: storage(),
+        fetch: createFetch(routes, fetchCalls),
+        alert: message => alerts.push(message),
+        confirm: () => true,
+        prompt: () => null,
+        setTimeout, clearTimeout, setInterval, clearInterval,
+        URL, URLSearchParams, Blob,
+        FormData: class { constructor() { this.entries = []; } [Symbol.iterator]() { return this.entries[Symbol.iterator](); } },
+        Image: class { decode() { return Promise.resolve(); } },
+        AbortController
+    };
+    window.document = document;
+    vm.createContext(context);
+    // window.X と グローバルの X を同じものにする
+    Object.setPrototypeOf(window, context);
+
+    const html = fs.readFileSync(file, 'utf8');
+    const scripts = extractScripts(html);
+    // const / let の宣言をスクリプト間で共有するため、1つのスクリプトとして評価する
+    vm.runInContext(scripts.join('\n;\n'), context, { filename: file });
+
+    return {
+        context,
+        window,
+        document,
+        element,
+        body,
+        alerts,
+        logs,
+        fetchCalls,
+        // 式を評価する（const で宣言されたグローバルも参照できる）
+        evaluate: code => vm.runInContext(code, context),
+        async fire(type) {
+            for (const handler of documentListeners[type] || []) await handler({ type });
+        },
+        listeners: type => (documentListeners[type] || []).length,
+        errors: () => logs.filter(entry => entry[0] === 'error')
+    };
+}
+
+// 保留中の Promise を処理させる
+function settle() {
+    return new Promise(resolve => setImmediate(resolve));
+}
+
+module.exports = { loadPage, extractScripts, settle };
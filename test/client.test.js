@@ -0,0 +1,87 @@
+// public/index.html の起動スモークテスト（DOM スタブ上でスクリプトを評価する）
+//
+//     npm test                       # すべて
+//     node --test test/client.test.js
+
+const assert = require('assert');
+const fs = require('fs');
+const path = require('path');
+const test = require('node:test');
+const { loadPage, settle } = require('./browser-stub');
+
+const INDEX = path.join(__dirname, '..', 'public', 'index.html');
+
+const DATA = {
+    users: [
+        { id: 1, username: 'admin', password: 'admin123', role: 'admin', name: '管理者', department: '総務部', email: 'admin@example.com' },
+        { id: 2, username: 'user1', password: 'user1123', role: 'user', name: '受講者1', department: '営業部', email: 'user1@example.com' }
+    ],
+    courses: [
+        { id: 10, title: '研修コース', slideImages: [], quiz: [] }
+    ],
+    learningRecords: [
+        { id: 100, userId: 2, courseId: 10, courseTitle: '研修コース', userName: '受講者1', score: 90, passed: true, completedAt: '2025-11-01T10:00:00Z' }
+    ]
+};
+
+function openIndex() {
+    return loadPage(INDEX, {
+        routes: {
+            'GET /api/data': DATA,
+            'GET /api/progress/2': null,
+            'GET /api/progress/1': null
+        }
+    });
+}
+
+test('スクリプトを評価しても例外にならず、起動処理が登録される', () => {
+    const page = openIndex();
+    assert.strictEqual(page.listeners('DOMContentLoaded'), 1);
+    for (const name of ['App', 'AdminScreen', 'UserScreen']) {
+        assert.strictEqual(typeof page.window[name], 'object', `window.${name}`);
+    }
+});
+
+test('onclick から呼ぶメソッドがすべて定義されている', () => {
+    const page = openIndex();
+    const html = fs.readFileSync(INDEX, 'utf8');
+    const calls = new Set();
+    for (const m of html.matchAll(/on(?:click|submit|change)="[^"]*?\b(App|AdminScreen|UserScreen)\.(\w+)\(/g)) {
+        calls.add(`${m[1]}.${m[2]}`);
+    }
+    assert.ok(calls.size > 0);
+    for (const call of calls) {
+        assert.strictEqual(page.evaluate(`typeof ${call}`), 'function', call);
+    }
+});
+
+test('起動するとデータを読み込んでログイン画面を表示する', async () => {
+    const page = openIndex();
+    await page.fire('DOMContentLoaded');
+    await settle();
+    assert.deepStrictEqual(page.errors(), []);
+    assert.deepStrictEqual(page.alerts, []);
+    assert.strictEqual(page.evaluate('AppData.users.length'), 2);
+    assert.match(page.element('app').innerHTML, /loginForm/);
+    assert.strictEqual(page.element('loginForm').listeners.submit.length, 1);
+});
+
+test('管理者でログインし、受講者詳細・修了証・全学習記録を開ける', async () => {
+    const page = openIndex();
+    await page.fire('DOMContentLoaded');
+    await settle();
+    page.element('username').value = 'admin';
+    page.element('password').value = 'admin123';
+    page.evaluate('App.handleLogin()');
+    assert.match(page.element('app').innerHTML, /管理者ダッシュボード/);
+
+    await page.evaluate('AdminScreen.viewLearnerDetail(2)');
+    page.evaluate('AdminScreen.viewCertificate(2)');
+    page.evaluate('AdminScreen.viewAllRecords()');
+    await settle();
+    const modals = page.body.inserted.join('\n');
+    assert.match(modals, /受講者詳細/);
+    assert.match(modals, /修了証/);
+    assert.match(modals, /全学習記録/);
+    assert.deepStrictEqual(page.alerts, []);
+});
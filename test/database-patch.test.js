@@ -0,0 +1,120 @@
+// update_html.py の Database（API 版）の差分保存のテスト
+//
+// サーバーが採番したIDを、レコード自身と、それを参照する学習記録（userId / courseId）に
+// 反映すること、受講者は画像を除いたコース一覧（?slides=lazy）を読み込むことを確認する。
+// 定義は update_html.py から取り出すため python3 が必要。
+//
+//     node --test test/database-patch.test.js
+
+const assert = require('assert');
+const path = require('path');
+const test = require('node:test');
+const vm = require('vm');
+const { spawnSync } = require('child_process');
+
+const ROOT = path.join(__dirname, '..');
+
+// update_html.py の new_database。python3 がなければ null
+function databaseSource() {
+    const script = 'import sys, update_html\nsys.stdout.write(update_html.new_database)\n';
+    const result = spawnSync('python3', ['-c', script], { cwd: ROOT, encoding: 'utf8' });
+    if (result.error || result.status !== 0) return null;
+    return result.stdout;
+}
+
+const source = databaseSource();
+
+// fetch スタブで Database を評価する。response は応答の本文か (url, options) => 本文
+// （requests は送信した本文、urls は要求したURL）
+function createContext(response, session = null) {
+    const context = vm.createContext({
+        console: { log() {}, warn() {}, error() {} },
+        window: { location: { origin: '' } },
+        sessionStorage: { getItem: () => session && JSON.stringify(session) },
+        requests: [],
+        urls: [],
+        fetch: async (url, options = {}) => {
+            context.urls.push(url);
+            if (options.body) context.requests.push(JSON.parse(options.body));
+            const body = typeof response === 'function' ? response(url, options) : response;
+            return { status: 200, ok: true, headers: { get: () => '"1"' }, json: async () => body };
+        }
+    });
+    vm.runInContext('var AppData = { users: [], courses: [], learningRecords: [] };\n'
+        + source.replace('const Database', 'var Database'), context);
+    return context;
+}
+
+test('新しいユーザー・コースのIDを参照する学習記録にも反映する', { skip: !source && 'python3 がありません' }, async () => {
+    const context = createContext({
+        success: true, revision: 2,
+        ids: { users: [[1700000000001, 41]], courses: [[1700000000002, 42]], learningRecords: [[1700000000003, 43]] }
+    });
+    const { AppData, Database } = context;
+    AppData.users = [{ id: 1, username: 'admin' }];
+    AppData.courses = [];
+    AppData.learningRecords = [{ id: 7, userId: 1, courseId: 5, score: 8 }];
+    Database.snapshot();
+
+    AppData.users.push({ id: 1700000000001, username: 'new' });
+    AppData.courses.push({ id: 1700000000002, title: '新しいコース' });
+    AppData.learningRecords.push({ id: 1700000000003, userId: 1700000000001, courseId: 1700000000002, score: 9 });
+    assert.strictEqual(await Database.save(), true);
+
+    assert.strictEqual(context.requests.length, 1);
+    assert.deepStrictEqual(AppData.users[1].id, 41);
+    assert.deepStrictEqual(AppData.courses[0].id, 42);
+    assert.deepStrictEqual(
+        { id: AppData.learningRecords[1].id, userId: AppData.learningRecords[1].userId, courseId: AppData.learningRecords[1].courseId },
+        { id: 43, userId: 41, courseId: 42 });
+    // 付け替えた内容は同期済みなので、次の保存では何も送らない
+    assert.strictEqual(Database.diff().count, 0);
+    assert.strictEqual(await Database.save(), true);
+    assert.strictEqual(context.requests.length, 1);
+});
+
+const LAZY_DATA = {
+    revision: 3,
+    users: [{ id: 1, username: 'user1', role: 'user' }],
+    courses: [{ id: 5, title: 'コース', quiz: [], slideImages: [], slideCount: 2 }],
+    learningRecords: []
+};
+
+test('受講者は画像を除いた一覧を読み込み、スライドは画像のURLで参照する', { skip: !source && 'python3 がありません' }, async () => {
+    const context = createContext(() => JSON.parse(JSON.stringify(LAZY_DATA)), { id: 1, role: 'user' });
+    const { AppData, Database } = context;
+    assert.strictEqual(await Database.load(), true);
+
+    assert.deepStrictEqual(context.urls, ['/api/data?slides=lazy']);
+    assert.deepStrictEqual(Array.from(AppData.courses[0].slideImages, slide => slide.data),
+        ['/api/courses/5/slides/0?format=image', '/api/courses/5/slides/1?format=image']);
+    assert.strictEqual(Database.diff().count, 0);
+});
+
+test('管理者は画像を含む一覧を読み込む', { skip: !source && 'python3 がありません' }, async () => {
+    const context = createContext(() => JSON.parse(JSON.stringify(LAZY_DATA)), { id: 9, role: 'admin' });
+    await context.Database.load();
+    assert.deepStrictEqual(context.urls, ['/api/data']);
+});
+
+test('画像を除いて読み込んだコースの保存では変えていないスライドを送らない', { skip: !source && 'python3 がありません' }, async () => {
+    const slide = { data: 'data:image/png;base64,AAAA' };
+    const context = createContext(url => {
+        if (url.startsWith('/api/data?')) return JSON.parse(JSON.stringify(LAZY_DATA));
+        if (url === '/api/courses/5/slides/1') return slide;
+        return { success: true, revision: 4, ids: {} };
+    });
+    const { AppData, Database } = context;
+    await Database.load();
+
+    // タイトルだけの変更: スライドは空で送り、サーバーの画像を保持する
+    AppData.courses[0].title = '新しいタイトル';
+    assert.strictEqual(await Database.save(), true);
+    assert.deepStrictEqual(context.requests[0].changes.courses.upsert[0].slideImages, []);
+
+    // スライドの削除: 残りのスライドの画像を取得して送る
+    AppData.courses[0].slideImages.splice(0, 1);
+    assert.strictEqual(await Database.save(), true);
+    const sent = context.requests[1].changes.courses.upsert[0];
+    assert.deepStrictEqual({ slideImages: sent.slideImages, slideCount: sent.slideCount }, { slideImages: [slide], slideCount: 1 });
+});
@@ -0,0 +1,141 @@
+// 集計テーブル（course_rollups）と進捗の一括保存のテスト（PostgreSQL が必要）
+//
+// 学習記録の追加（同時追加を含む）・更新・削除、所属の変更、ユーザー・コースの削除の後に
+// verifyRollups() が差分を返さないことを確認する。テスト用のユーザー・コースを作成して
+// 最後に削除する（既存のデータには触れない）。接続先は TEST_DATABASE_URL
+// （なければ DATABASE_URL）で、どちらもないか pg がインストールされていなければスキップする。
+//
+//     TEST_DATABASE_URL=postgres://localhost/elearning_test node --test test/rollups.test.js
+
+const assert = require('assert');
+const test = require('node:test');
+
+const DATABASE_URL = process.env.TEST_DATABASE_URL || process.env.DATABASE_URL;
+
+function skipReason() {
+    if (!DATABASE_URL) return 'TEST_DATABASE_URL / DATABASE_URL が設定されていません';
+    try {
+        require.resolve('pg');
+    } catch (error) {
+        return 'pg がインストールされていません';
+    }
+    return false;
+}
+
+const skip = skipReason();
+
+test('学習記録・ユーザー・コースの変更後も集計が学習記録と一致する', { skip }, async () => {
+    process.env.DATABASE_URL = DATABASE_URL;
+    const db = require('../database');
+    const suffix = `${process.pid}-${Date.now()}`;
+    const created = { users: [], courses: [] };
+    const assertRollups = async step => {
+        assert.deepStrictEqual(await db.verifyRollups(), [], `${step}の後に集計がずれています`);
+    };
+
+    try {
+        await db.initializeDatabase();
+        await assertRollups('初期化');
+
+        const newUser = department => db.createUser({
+            username: `rollup-test-${department}-${suffix}`, password: 'x', name: 'rollup test',
+            email: `rollup-test-${department}-${suffix}@example.com`, department: `rollup-test-${department}-${suffix}`
+        });
+        const alice = await newUser('a');
+        const bob = await newUser('b');
+        created.users.push(alice.id, bob.id);
+        const course = await db.createCourse({ title: `rollup test ${suffix}`, description: '', quiz: [] });
+        created.courses.push(course.id);
+
+        // 追加
+        const first = await db.createLearningRecord({ user_id: alice.id, course_id: course.id, score: 6, passed: false });
+        const second = await db.createLearningRecord({ user_id: alice.id, course_id: course.id, score: 9, passed: true });
+        await db.createLearningRecord({ user_id: bob.id, course_id: course.id, score: 8, passed: true });
+        await assertRollups('学習記録の追加');
+
+        // 差分保存（更新・担当者の付け替え・追加・削除）
+        let revision = await db.getRevision();
+        const patched = await db.applyDataPatch(revision, {
+            learningRecords: {
+                upsert: [
+                    { id: first.id, userId: bob.id, courseId: course.id, score: 10, passed: true },
+                    { id: Date.now(), userId: alice.id, courseId: course.id, score: 3, passed: false }
+                ],
+                delete: [second.id]
+            }
+        });
+        assert.strictEqual(patched.ids.learningRecords.length, 1);
+        await assertRollups('差分保存');
+
+        // 同じパッチで追加したユーザーを参照する学習記録は、採番されたIDで追加される
+        const clientId = Date.now();
+        revision = await db.getRevision();
+        const withUser = await db.applyDataPatch(revision, {
+            users: { upsert: [{ id: clientId, username: `rollup-test-c-${suffix}`, password: 'x', name: 'rollup test',
+                email: `rollup-test-c-${suffix}@example.com`, department: `rollup-test-c-${suffix}` }] },
+            learningRecords: { upsert: [{ id: clientId + 1, userId: clientId, courseId: course.id, score: 7, passed: true }] }
+        });
+        const carolId = withUser.ids.users[0][1];
+        created.users.push(carolId);
+        const carolRecords = await db.pool.query('SELECT id FROM learning_records WHERE user_id = $1', [carolId]);
+        assert.deepStrictEqual(carolRecords.rows.map(row => row.id), [withUser.ids.learningRecords[0][1]]);
+        await assertRollups('ユーザーと学習記録の同時追加');
+
+        // 同じ受講者・コースの最初の記録を2つのトランザクションで同時に追加する
+        // （2つ目は course_user_stats の行ロックで1つ目のコミットを待つ）
+        const other = await db.createCourse({ title: `rollup test 2 ${suffix}`, description: '', quiz: [] });
+        created.courses.push(other.id);
+        const [one, two] = [await db.pool.connect(), await db.pool.connect()];
+        try {
+            const insert = client => client.query(
+                'INSERT INTO learning_records (user_id, course_id, score, passed) VALUES ($1, $2, 9, TRUE)',
+                [bob.id, other.id]);
+            await one.query('BEGIN');
+            await two.query('BEGIN');
+            await insert(one);
+            const waiting = insert(two);
+            await new Promise(resolve => setTimeout(resolve, 200));
+            await one.query('COMMIT');
+            await waiting;
+            await two.query('COMMIT');
+        } finally {
+            one.release();
+            two.release();
+        }
+        await assertRollups('同時追加');
+
+        // 行が変わらなかった文では /api/data の ETag（getDataTag）を進めない
+        const tag = await db.getDataTag();
+        await db.pool.query('DELETE FROM learning_records WHERE id = -1');
+        assert.strictEqual(await db.getDataTag(), tag);
+        await db.pool.query('UPDATE learning_records SET score = 8 WHERE user_id = $1 AND course_id = $2', [bob.id, other.id]);
+        assert.notStrictEqual(await db.getDataTag(), tag);
+
+        // courseId のない進捗は保存せず rejected として返す（ON CONFLICT で重複しないように）
+        const progress = await db.saveProgressBatch([
+            { userId: bob.id, courseId: null, slideIndex: 1 },
+            { userId: bob.id, courseId: course.id, slideIndex: 2 }
+        ]);
+        assert.strictEqual(progress.saved, 1);
+        assert.deepStrictEqual(progress.rejected.map(item => item.index), [0]);
+
+        // 所属の変更（users_rollup_department）
+        await db.updateUser(bob.id, { ...bob, department: `rollup-test-moved-${suffix}` });
+        await assertRollups('所属の変更');
+
+        // 差分保存でのユーザー削除（学習記録は CASCADE で削除）
+        revision = await db.getRevision();
+        await db.applyDataPatch(revision, { users: { delete: [alice.id] } });
+        created.users = created.users.filter(id => id !== alice.id);
+        await assertRollups('ユーザーの削除');
+
+        // コースの削除
+        await db.deleteCourse(course.id);
+        created.courses = created.courses.filter(id => id !== course.id);
+        await assertRollups('コースの削除');
+    } finally {
+        for (const id of created.courses) await db.deleteCourse(id);
+        for (const id of created.users) await db.deleteUser(id);
+        await db.pool.end();
+    }
+});
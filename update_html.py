@@ -1,9 +1,36 @@
 #!/usr/bin/env python3
+"""
+public/index.html の Database 定義を API 版に置き換えるスクリプト
+
+使用方法:
+    python3 update_html.py                   # public/index.html をメモリ上で修正
+    python3 update_html.py --stream          # メモリマップで読み、ストリーム出力
+    python3 update_html.py --stream -i in.html -o out.html
+
+--stream はファイル全体を文字列として読み込まないため、スライド画像を
+埋め込んだ数十MBの index.html でもメモリ使用量がほぼ一定です。
+どちらのモードも一時ファイル経由で書き込み、最後に置き換えます。
+
+何度実行しても結果は同じです（async / await は二重に付けません）。置き換えた
+Database 定義には版マーカー（public/patch_state.py）を付け、入力の内容ハッシュを
+キャッシュするため、変更のないファイルへの再実行はハッシュ計算だけで終わります。
+修正前後の内容は public/snapshot_store.py のスナップショットに保存します（--no-snapshot で無効）。
+"""
+import argparse
+import mmap
+import os
 import re
+import sys
+
+from cli_common import atomic_output
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public'))
 
-# 元のHTMLファイルを読み込み
-with open('public/index.html', 'r', encoding='utf-8') as f:
-    content = f.read()
+from patch_state import (HASH_LENGTH, MARKER_PATTERN, PatchCache, file_hash, find_markers,  # noqa: E402
+                         is_intact, marker, patch_set_version, strip_markers, text_hash)
+from snapshot_store import snapshot  # noqa: E402
+
+INDEX_FILE = 'public/index.html'
 
 # Database objectの定義を検索して置き換え
 # 860行目から1008行目までの部分
@@ -12,23 +39,154 @@ with open('public/index.html', 'r', encoding='utf-8') as f:
 new_database = '''        // データベース管理(API使用)
         const Database = {
             API_BASE: window.location.origin,
+            COLLECTIONS: ['users', 'courses', 'learningRecords'],
+            revision: 0,
+            synced: null,   // 最後に同期した内容（コレクション → Map(キー → JSON)）
+            
+            recordKey(record) {
+                return record.id !== undefined && record.id !== null ? String(record.id) : JSON.stringify(record);
+            },
+            
+            snapshot() {
+                this.synced = {};
+                this.COLLECTIONS.forEach(name => {
+                    const map = new Map();
+                    (AppData[name] || []).forEach(record => {
+                        map.set(this.recordKey(record), JSON.stringify(record));
+                    });
+                    this.synced[name] = map;
+                });
+            },
+            
+            // 前回の同期から変わったレコードだけを集める
+            diff() {
+                const changes = {};
+                const sent = {};
+                let count = 0;
+                this.COLLECTIONS.forEach(name => {
+                    const before = this.synced[name];
+                    const seen = new Set();
+                    const upsert = [];
+                    const json = [];
+                    (AppData[name] || []).forEach(record => {
+                        const key = this.recordKey(record);
+                        const current = JSON.stringify(record);
+                        seen.add(key);
+                        if (before.get(key) !== current) {
+                            upsert.push(record);
+                            json.push([key, current]);
+                        }
+                    });
+                    const remove = [];
+                    before.forEach((current, key) => {
+                        if (!seen.has(key)) {
+                            const id = JSON.parse(current).id;
+                            if (id !== undefined && id !== null) remove.push(id);
+                        }
+                    });
+                    if (upsert.length || remove.length) {
+                        changes[name] = { upsert, delete: remove };
+                        sent[name] = { json, remove };
+                        count += upsert.length + remove.length;
+                    }
+                });
+                return { changes, sent, count };
+            },
+            
+            // 学習記録の列 → 参照するコレクション（applyDataPatch の references と同じ）
+            REFERENCES: { userId: 'users', courseId: 'courses' },
+            
+            // 送信済みの内容を同期済みとして記録（サーバーが採番したIDも反映）
+            commit(sent, ids) {
+                Object.keys(sent).forEach(name => {
+                    const synced = this.synced[name];
+                    const mapping = new Map((ids && ids[name]) || []);
+                    // 採番されたレコードは1回の走査で引けるようにしておく（仮ID → 最初のレコード）
+                    const targets = new Map();
+                    if (mapping.size > 0) {
+                        (AppData[name] || []).forEach(r => {
+                            if (mapping.has(r.id) && !targets.has(r.id)) targets.set(r.id, r);
+                        });
+                    }
+                    sent[name].json.forEach(([key, json]) => {
+                        const record = JSON.parse(json);
+                        if (mapping.has(record.id)) {
+                            const serverId = mapping.get(record.id);
+                            const target = targets.get(record.id);
+                            if (target) target.id = serverId;
+                            record.id = serverId;
+                            synced.delete(key);
+                            synced.set(this.recordKey(record), JSON.stringify(record));
+                        } else {
+                            synced.set(key, json);
+                        }
+                    });
+                    sent[name].remove.forEach(id => synced.delete(String(id)));
+                    // ID を書き換えたレコードは AppIndex（patch_engine.py）の索引を作り直す
+                    if (targets.size > 0 && typeof AppIndex !== 'undefined') {
+                        AppIndex.invalidate(name);
+                    }
+                });
+                this.remapReferences(ids);
+            },
+            
+            // 採番されたユーザー・コースのIDを、それを参照する学習記録にも反映する
+            // （同期済みだった記録は同期済みの内容も書き換え、次の保存で再送しない）
+            remapReferences(ids) {
+                const maps = {};
+                Object.values(this.REFERENCES).forEach(name => {
+                    if (ids && ids[name] && ids[name].length > 0) maps[name] = new Map(ids[name]);
+                });
+                if (Object.keys(maps).length === 0) return;
+                const synced = this.synced.learningRecords;
+                let changed = false;
+                (AppData.learningRecords || []).forEach(record => {
+                    const fields = Object.keys(this.REFERENCES).filter(field => {
+                        const map = maps[this.REFERENCES[field]];
+                        return map && map.has(record[field]);
+                    });
+                    if (fields.length === 0) return;
+                    const key = this.recordKey(record);
+                    const wasSynced = synced && synced.get(key) === JSON.stringify(record);
+                    fields.forEach(field => {
+                        record[field] = maps[this.REFERENCES[field]].get(record[field]);
+                    });
+                    if (wasSynced) {
+                        synced.delete(key);
+                        synced.set(this.recordKey(record), JSON.stringify(record));
+                    }
+                    changed = true;
+                });
+                if (changed && typeof AppIndex !== 'undefined') {
+                    AppIndex.invalidate('learningRecords');
+                }
+            },
             
             async save() {
                 try {
-                    const dataToSave = {
-                        users: AppData.users,
-                        courses: AppData.courses,
-                        learningRecords: AppData.learningRecords,
-                        lastUpdated: new Date().toISOString()
-                    };
+                    if (!this.synced) {
+                        return await this.saveAll();
+                    }
+                    const { changes, sent, count } = this.diff();
+                    if (count === 0) {
+                        return true;
+                    }
                     const response = await fetch(`${this.API_BASE}/api/data`, {
-                        method: 'POST',
+                        method: 'PATCH',
                         headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify(dataToSave)
+                        body: JSON.stringify({ baseRevision: this.revision, changes: await this.resolveSlides(changes) })
                     });
                     const result = await response.json();
+                    if (response.status === 409) {
+                        console.warn('⚠️ 他の管理者の更新と競合しました', { base: this.revision, server: result.revision });
+                        alert('他の管理者がデータを更新しました。最新のデータを読み込み直しますので、もう一度操作してください。');
+                        await this.load({ fresh: true });
+                        return false;
+                    }
                     if (result.success) {
-                        console.log('✅ データを保存しました', new Date().toLocaleTimeString());
+                        this.commit(sent, result.ids);
+                        this.revision = result.revision;
+                        console.log('✅ データを保存しました', new Date().toLocaleTimeString(), `(${count}件, revision ${this.revision})`);
                         return true;
                     }
                     return false;
@@ -38,57 +196,300 @@ new_database = '''        // データベース管理(API使用)
                 }
             },
             
-            async load() {
+            // 全データ保存（読み込み前の保存のみ）
+            async saveAll() {
+                const dataToSave = {
+                    users: AppData.users,
+                    courses: AppData.courses,
+                    learningRecords: AppData.learningRecords,
+                    lastUpdated: new Date().toISOString()
+                };
+                const response = await fetch(`${this.API_BASE}/api/data`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(dataToSave)
+                });
+                const result = await response.json();
+                if (result.success) {
+                    if (result.revision !== undefined) this.revision = result.revision;
+                    this.snapshot();
+                    console.log('✅ データを保存しました', new Date().toLocaleTimeString());
+                    return true;
+                }
+                return false;
+            },
+            
+            // 受講者は画像を除いたコース一覧（?slides=lazy）を読み込み、スライドは1枚ずつ
+            // /api/courses/:id/slides/:index?format=image から取得する（SlideLoader の先読みもこのURL）。
+            // 管理者（ログイン済みのセッション）はコース編集のため画像を含む一覧を読み込む
+            lazy: false,
+            
+            lazySlides() {
+                let user = AppData.currentUser;
+                if (!user && typeof sessionStorage !== 'undefined') {
+                    try {
+                        user = JSON.parse(sessionStorage.getItem('currentUser') || 'null');
+                    } catch (error) {
+                        user = null;
+                    }
+                }
+                return !(user && user.role === 'admin');
+            },
+            
+            slideUrl(courseId, index) {
+                return `${this.API_BASE}/api/courses/${courseId}/slides/${index}?format=image`;
+            },
+            
+            // 画像を除いて読み込んだコース（slideCount だけがある）に、画像URLの仮のスライドを入れる
+            // （slideImages の件数と data をそのまま使う画面・SlideLoader がそのまま動くように）
+            expandSlides(courses) {
+                courses.forEach(course => {
+                    if (!course.slideCount || (course.slideImages && course.slideImages.length > 0)) return;
+                    course.slideImages = Array.from({ length: course.slideCount }, (_, index) => ({
+                        data: this.slideUrl(course.id, index), lazy: true, courseId: course.id, index
+                    }));
+                });
+            },
+            
+            // 送信するコースの仮のスライドを戻す。スライドを変えていなければ画像を送らず
+            // （サーバーが保持する）、並べ替え・追加・削除していれば仮のスライドの画像を取得して送る
+            async resolveSlides(changes) {
+                if (!changes.courses) return changes;
+                const upsert = await Promise.all(changes.courses.upsert.map(async course => {
+                    const slides = course.slideImages || [];
+                    if (!slides.some(slide => slide && slide.lazy)) return course;
+                    const untouched = slides.length === course.slideCount
+                        && slides.every((slide, index) => slide && slide.lazy && slide.courseId === course.id && slide.index === index);
+                    if (untouched) return { ...course, slideImages: [] };
+                    const resolved = await Promise.all(slides.map(slide => slide && slide.lazy ? this.fetchSlide(slide) : slide));
+                    return { ...course, slideImages: resolved, slideCount: resolved.length };
+                }));
+                return { ...changes, courses: { ...changes.courses, upsert } };
+            },
+            
+            async fetchSlide(slide) {
+                const response = await fetch(`${this.API_BASE}/api/courses/${slide.courseId}/slides/${slide.index}`);
+                if (!response.ok) throw new Error(`スライドの取得に失敗しました: HTTP ${response.status}`);
+                return response.json();
+            },
+            
+            // 前回のデータを IndexedDB に保存し、次回はそこから即座に起動して
+            // バックグラウンドで ETag による再検証（変更がなければ 304）を行う
+            CACHE_DB: 'elearning-cache',
+            cacheDb: null,
+            etag: null,
+            
+            openCache() {
+                if (!this.cacheDb) {
+                    this.cacheDb = new Promise(resolve => {
+                        if (typeof indexedDB === 'undefined') return resolve(null);
+                        const request = indexedDB.open(this.CACHE_DB, 1);
+                        request.onupgradeneeded = () => request.result.createObjectStore('snapshots');
+                        request.onsuccess = () => resolve(request.result);
+                        request.onerror = () => resolve(null);
+                    });
+                }
+                return this.cacheDb;
+            },
+            
+            // 画像を除いた一覧と画像を含む一覧は別のキーに保存する
+            cacheKey(lazy) {
+                return lazy ? 'data-lazy' : 'data';
+            },
+            
+            async readCache(lazy) {
+                const db = await this.openCache();
+                if (!db) return null;
+                return new Promise(resolve => {
+                    const request = db.transaction('snapshots').objectStore('snapshots').get(this.cacheKey(lazy));
+                    request.onsuccess = () => resolve(request.result || null);
+                    request.onerror = () => resolve(null);
+                });
+            },
+            
+            async writeCache(etag, data, lazy) {
+                const db = await this.openCache();
+                if (!db || !etag) return;
                 try {
-                    const response = await fetch(`${this.API_BASE}/api/data`);
-                    if (response.ok) {
-                        const data = await response.json();
-                        
-                        AppData.users = data.users || [];
-                        AppData.courses = data.courses || [];
-                        AppData.learningRecords = data.learningRecords || [];
-                        
-                        console.log('✅ データを読み込みました', {
+                    db.transaction('snapshots', 'readwrite').objectStore('snapshots').put({ etag, data }, this.cacheKey(lazy));
+                } catch (error) {
+                    console.warn('⚠️ キャッシュ保存エラー:', error.message);
+                }
+            },
+            
+            // 変更がなければ null（304）
+            async fetchData(etag, lazy) {
+                const response = await fetch(`${this.API_BASE}/api/data${lazy ? '?slides=lazy' : ''}`, {
+                    headers: etag ? { 'If-None-Match': etag } : {},
+                    cache: 'no-store'
+                });
+                if (response.status === 304) return null;
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return { etag: response.headers.get('ETag'), data: await response.json() };
+            },
+            
+            apply(etag, data) {
+                AppData.users = data.users || [];
+                AppData.courses = data.courses || [];
+                AppData.learningRecords = data.learningRecords || [];
+                this.expandSlides(AppData.courses);
+                this.revision = data.revision || 0;
+                this.etag = etag;
+                this.snapshot();
+                if (typeof AppIndex !== 'undefined') {
+                    AppIndex.invalidate();
+                }
+            },
+            
+            async load({ fresh = false } = {}) {
+                try {
+                    this.lazy = this.lazySlides();
+                    const cached = fresh ? null : await this.readCache(this.lazy);
+                    if (cached) {
+                        this.apply(cached.etag, cached.data);
+                        console.log('⚡ キャッシュから読み込みました', {
                             users: AppData.users.length,
                             courses: AppData.courses.length,
-                            records: AppData.learningRecords.length
+                            records: AppData.learningRecords.length,
+                            revision: this.revision
                         });
+                        this.revalidate();
                         return true;
                     }
-                    return false;
+                    
+                    const result = await this.fetchData(null, this.lazy);
+                    this.apply(result.etag, result.data);
+                    this.writeCache(result.etag, result.data, this.lazy);
+                    
+                    console.log('✅ データを読み込みました', {
+                        users: AppData.users.length,
+                        courses: AppData.courses.length,
+                        records: AppData.learningRecords.length,
+                        revision: this.revision
+                    });
+                    return true;
                 } catch (error) {
                     console.error('❌ データ読み込みエラー:', error);
                     return false;
                 }
             },
             
-            async saveProgress(userId) {
+            async revalidate() {
                 try {
-                    const progress = {
-                        ...AppData.learningState,
-                        userId: userId,
-                        courseId: AppData.currentCourse ? AppData.currentCourse.id : null,
-                        lastUpdated: new Date().toISOString()
-                    };
-                    const response = await fetch(`${this.API_BASE}/api/progress/${userId}`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify(progress)
-                    });
-                    const result = await response.json();
-                    if (result.success) {
-                        console.log('💾 進行状況を保存');
-                        return true;
+                    const result = await this.fetchData(this.etag, this.lazy);
+                    if (!result) {
+                        console.log('✅ キャッシュは最新です');
+                        return;
+                    }
+                    if (this.diff().count > 0) {
+                        // 未保存の変更は上書きしない（保存時にリビジョンで競合検出される）
+                        console.warn('⚠️ 未保存の変更があるため最新データの反映を保留しました');
+                        return;
+                    }
+                    this.apply(result.etag, result.data);
+                    this.writeCache(result.etag, result.data, this.lazy);
+                    console.log('🔄 最新データに更新しました', { revision: this.revision });
+                    if (typeof App !== 'undefined' && App.render) {
+                        App.render();
                     }
-                    return false;
                 } catch (error) {
-                    console.error('❌ 進行状況保存エラー:', error);
-                    return false;
+                    console.warn('⚠️ データの再検証に失敗しました:', error.message);
                 }
             },
             
+            // 進行状況はすぐには送らず、PROGRESS_DELAY 内の変更をまとめて
+            // ユーザー・コースごとの最新の状態だけを /api/progress/batch に送る
+            PROGRESS_DELAY: 2000,
+            PROGRESS_MAX_RETRY: 60000,
+            progressQueue: new Map(),
+            progressTimer: null,
+            progressRetry: 0,
+            progressFlushing: null,
+            pageHideWatched: false,
+            
+            async saveProgress(userId) {
+                const progress = {
+                    ...AppData.learningState,
+                    userId: userId,
+                    courseId: AppData.currentCourse ? AppData.currentCourse.id : null,
+                    lastUpdated: new Date().toISOString()
+                };
+                this.progressQueue.set(`${userId}:${progress.courseId}`, progress);
+                this.watchPageHide();
+                this.scheduleProgressFlush(this.PROGRESS_DELAY);
+                return true;
+            },
+            
+            scheduleProgressFlush(delay) {
+                if (this.progressTimer) return;
+                this.progressTimer = setTimeout(() => {
+                    this.progressTimer = null;
+                    this.flushProgress();
+                }, delay);
+            },
+            
+            async flushProgress() {
+                if (this.progressFlushing) return this.progressFlushing;
+                clearTimeout(this.progressTimer);
+                this.progressTimer = null;
+                if (this.progressQueue.size === 0) return true;
+                
+                const items = [...this.progressQueue.entries()];
+                this.progressQueue.clear();
+                this.progressFlushing = (async () => {
+                    try {
+                        const response = await fetch(`${this.API_BASE}/api/progress/batch`, {
+                            method: 'POST',
+                            headers: { 'Content-Type': 'application/json' },
+                            body: JSON.stringify({ items: items.map(([, progress]) => progress) }),
+                            keepalive: true
+                        });
+                        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                        this.progressRetry = 0;
+                        console.log('💾 進行状況を保存', `(${items.length}件)`);
+                        return true;
+                    } catch (error) {
+                        // 送れなかった分は、より新しい変更がなければ戻して再送
+                        items.forEach(([key, progress]) => {
+                            if (!this.progressQueue.has(key)) this.progressQueue.set(key, progress);
+                        });
+                        this.progressRetry = Math.min(this.progressRetry ? this.progressRetry * 2 : 1000, this.PROGRESS_MAX_RETRY);
+                        console.warn(`⚠️ 進行状況の保存に失敗しました。${this.progressRetry / 1000}秒後に再試行します`, error.message);
+                        this.scheduleProgressFlush(this.progressRetry);
+                        return false;
+                    } finally {
+                        this.progressFlushing = null;
+                        if (this.progressQueue.size > 0) this.scheduleProgressFlush(this.PROGRESS_DELAY);
+                    }
+                })();
+                return this.progressFlushing;
+            },
+            
+            // ページを離れる・非表示になるときは sendBeacon で残りを送る
+            watchPageHide() {
+                if (this.pageHideWatched) return;
+                this.pageHideWatched = true;
+                const flush = () => {
+                    if (this.progressQueue.size === 0) return;
+                    const items = [...this.progressQueue.values()];
+                    const body = new Blob([JSON.stringify({ items })], { type: 'application/json' });
+                    if (navigator.sendBeacon && navigator.sendBeacon(`${this.API_BASE}/api/progress/batch`, body)) {
+                        this.progressQueue.clear();
+                        clearTimeout(this.progressTimer);
+                        this.progressTimer = null;
+                    } else {
+                        this.flushProgress();
+                    }
+                };
+                document.addEventListener('visibilitychange', () => {
+                    if (document.visibilityState === 'hidden') flush();
+                });
+                window.addEventListener('pagehide', flush);
+            },
+            
             async loadProgress(userId) {
                 try {
+                    await this.flushProgress();
                     const response = await fetch(`${this.API_BASE}/api/progress/${userId}`);
                     if (response.ok) {
                         const progress = await response.json();
@@ -107,6 +508,10 @@ new_database = '''        // データベース管理(API使用)
             
             async clearProgress(userId) {
                 try {
+                    // 未送信の進行状況が削除後に書き戻されないよう破棄
+                    [...this.progressQueue.keys()].forEach(key => {
+                        if (key.startsWith(`${userId}:`)) this.progressQueue.delete(key);
+                    });
                     const response = await fetch(`${this.API_BASE}/api/progress/${userId}`, {
                         method: 'DELETE'
                     });
@@ -151,7 +556,7 @@ new_database = '''        // データベース管理(API使用)
                     });
                     const result = await response.json();
                     if (result.success) {
-                        await this.load();
+                        await this.load({ fresh: true });
                         return true;
                     }
                     return false;
@@ -162,24 +567,226 @@ new_database = '''        // データベース管理(API使用)
         };'''
 
 # 正規表現で古いDatabase定義を検索
-pattern = r'// データベース管理.*?const Database = \{.*?\};'
-content_modified = re.sub(pattern, new_database, content, flags=re.DOTALL)
-
-# App.init()をasyncに変更
-content_modified = content_modified.replace(
-    'init() {',
-    'async init() {'
-)
-
-# Database.load()の呼び出しをawaitに変更
-content_modified = content_modified.replace(
-    'Database.load();',
-    'await Database.load();'
-)
-
-# 修正したHTMLを保存
-with open('public/index.html', 'w', encoding='utf-8') as f:
-    f.write(content_modified)
-
-print('✅ HTMLファイルを修正しました')
-print(f'   ファイルサイズ: {len(content_modified)} バイト')
+DATABASE_PATTERN = re.compile(r'// データベース管理.*?const Database = \{.*?\};', re.DOTALL)
+
+# 置き換え後のブロック（一致位置の字下げはそのまま残すため先頭の空白は除く）と版マーカー
+DATABASE_VERSION = 5
+DATABASE_REGION = new_database.lstrip()
+DATABASE_BLOCK = marker('database', DATABASE_VERSION, DATABASE_REGION) + DATABASE_REGION
+
+
+# キャッシュのキー（手順の版 + 置き換え後のブロック）
+CACHE_VERSION = (patch_set_version('update_html', {'database': DATABASE_VERSION, 'init': 2, 'load': 2})
+                 + ':' + text_hash(DATABASE_BLOCK)[:12])
+
+
+def replace_database(content):
+    """Database定義を新しい実装に置き換え（マーカーが一致すれば何もしない）"""
+    found = find_markers(content).get('database')
+    if is_intact(content, found, DATABASE_VERSION):
+        return content
+    if found is not None and is_intact(content, found, found[2]):
+        # 前の版のブロックがそのまま残っている場合はマーカーの長さで範囲を決める
+        # （DATABASE_PATTERN だと定義内の `};` で範囲が途中までになる）
+        start, end, _, length, _ = found
+        return content[:start] + DATABASE_BLOCK + content[end + length:]
+    content = strip_markers(content, ['database'])
+    return DATABASE_PATTERN.sub(lambda m: DATABASE_BLOCK, content)
+
+
+# 既に async / await が付いているものは二重にしない（再実行で async async にしない）
+def make_init_async(content):
+    """App.init()をasyncに変更"""
+    return content.replace('init() {', 'async init() {').replace('async async init() {', 'async init() {')
+
+
+def await_database_load(content):
+    """Database.load()の呼び出しをawaitに変更"""
+    return content.replace('Database.load();', 'await Database.load();').replace(
+        'await await Database.load();', 'await Database.load();')
+
+
+# (表示名, 関数) - ベンチマークからも参照
+STEPS = [
+    ('Database置換', replace_database),
+    ('init() → async', make_init_async),
+    ('load() → await', await_database_load),
+]
+
+
+def update_html(content):
+    for _, step in STEPS:
+        content = step(content)
+    return content
+
+
+# ===========================================
+# ストリーミング（メモリマップ）モード
+# ===========================================
+
+DATABASE_MARKER = '// データベース管理'.encode('utf-8')
+DATABASE_START = b'const Database = {'
+DATABASE_END = b'};'
+# (トークン, 置換, 直前にあれば置き換えない接頭辞)
+TOKEN_EDITS = [
+    (b'init() {', b'async init() {', b'async '),
+    (b'Database.load();', b'await Database.load();', b'await '),
+]
+DATABASE_MARKER_TAIL = re.compile(rb'/\* @patch database v\d+ \d+:[0-9a-f]+ \*/$')
+
+# マーカーから const Database = { までの最大距離 / Database 定義の最大長
+MARKER_WINDOW = 64 * 1024
+DATABASE_WINDOW = 1024 * 1024
+COPY_CHUNK = 1024 * 1024
+
+
+def find_database_regions(mm, marker_window=MARKER_WINDOW, database_window=DATABASE_WINDOW):
+    """DATABASE_PATTERN と同じ範囲を、窓を限定した走査で列挙する"""
+    regions = []
+    pos = 0
+    size = len(mm)
+    while True:
+        marker = mm.find(DATABASE_MARKER, pos)
+        if marker < 0:
+            return regions
+        start = mm.find(DATABASE_START, marker, min(size, marker + marker_window))
+        if start < 0:
+            pos = marker + len(DATABASE_MARKER)
+            continue
+        body = start + len(DATABASE_START)
+        end = mm.find(DATABASE_END, body, min(size, body + database_window))
+        if end < 0:
+            print(f'⚠️ Database 定義の終端が {database_window:,} バイト以内に見つかりません（offset {start}）')
+            pos = body
+            continue
+        regions.append((marker, end + len(DATABASE_END)))
+        pos = end + len(DATABASE_END)
+
+
+def _token_edits(mm, start, end):
+    """[start, end) 内の init() { / Database.load(); を出現順に列挙する"""
+    nexts = [mm.find(token, start, end) for token, _, _ in TOKEN_EDITS]
+    while True:
+        candidates = [(p, i) for i, p in enumerate(nexts) if p >= 0]
+        if not candidates:
+            return
+        p, i = min(candidates)
+        token, replacement, prefix = TOKEN_EDITS[i]
+        if mm[max(0, p - len(prefix)):p] != prefix:
+            yield p, p + len(token), replacement
+        nexts[i] = mm.find(token, p + len(token), end)
+
+
+def applied_block_size(mm, marker_bytes, start):
+    """マーカーの長さ・ハッシュと一致する適用済みブロックが start にあればそのバイト数（なければ None）"""
+    m = MARKER_PATTERN.fullmatch(marker_bytes.decode('ascii'))
+    if not m:
+        return None
+    length = int(m.group(3))
+    # UTF-8 は1文字4バイト以下
+    region = bytes(mm[start:start + length * 4]).decode('utf-8', errors='ignore')[:length]
+    if len(region) != length or text_hash(region)[:HASH_LENGTH] != m.group(4):
+        return None
+    return len(region.encode('utf-8'))
+
+
+def _copy(view, out, start, end):
+    for chunk_start in range(start, end, COPY_CHUNK):
+        out.write(view[chunk_start:min(end, chunk_start + COPY_CHUNK)])
+
+
+def stream_update(input_file, output_file):
+    """入力をメモリマップし、未変更部分 + 新しいブロックを一時ファイルへ書き出す"""
+    new_block = DATABASE_BLOCK.encode('utf-8')
+    if os.path.getsize(input_file) == 0:
+        with atomic_output(output_file):
+            pass
+        return 0, 0
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        regions = find_database_regions(mm)
+        with atomic_output(output_file) as out:
+            view = memoryview(mm)
+            try:
+                pos = 0
+                # Database 定義の外側だけ init() / Database.load() を置換する
+                for region_start, region_end in regions + [(len(mm), len(mm))]:
+                    if region_start < pos:
+                        continue
+                    # 直前の古いマーカーは新しいブロックのマーカーで置き換える
+                    copy_end = region_start
+                    if region_start < len(mm):
+                        tail = DATABASE_MARKER_TAIL.search(mm[max(pos, region_start - 256):region_start])
+                        if tail:
+                            copy_end = region_start - (tail.end() - tail.start())
+                            applied = applied_block_size(mm, tail.group(), region_start)
+                            if applied is not None:
+                                # 適用済み（定義内の `};` で範囲が途中までになるため、ブロック全体を飛ばす）
+                                region_end = region_start + applied
+                    for start, end, replacement in _token_edits(mm, pos, copy_end):
+                        _copy(view, out, pos, start)
+                        out.write(replacement)
+                        pos = end
+                    _copy(view, out, pos, copy_end)
+                    if region_start < len(mm):
+                        out.write(new_block)
+                    pos = region_end
+            finally:
+                view.release()
+            written = out.tell()
+    return len(regions), written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='index.html の Database 定義を API 版に置き換えます')
+    parser.add_argument('-i', '--input', default=INDEX_FILE, help=f'入力ファイル（既定: {INDEX_FILE}）')
+    parser.add_argument('-o', '--output', default=None, help='出力ファイル（既定: 入力ファイルを上書き）')
+    parser.add_argument('--stream', action='store_true', help='メモリマップ + ストリーム出力で処理')
+    parser.add_argument('--no-cache', action='store_true', help='内容ハッシュのキャッシュを使わない')
+    parser.add_argument('--no-snapshot', action='store_true', help='修正前後のスナップショットを保存しない')
+    args = parser.parse_args()
+    output_file = args.output or args.input
+
+    # 前回の入力・出力と同じなら何もしない（出力先が入力と同じなら修正済みのファイル）
+    cache = None if args.no_cache else PatchCache(CACHE_VERSION)
+    digest = None
+    if cache is not None:
+        digest = file_hash(args.input)
+        entry = cache.lookup(digest)
+        if entry and os.path.exists(output_file) and (
+                output_file == args.input and entry['output'] == digest
+                or output_file != args.input and file_hash(output_file) == entry['output']):
+            print('✅ 変更はありません（修正済みです）')
+            return
+
+    if not args.no_snapshot and output_file == args.input:
+        snapshot(args.input, 'update_html')
+
+    if args.stream:
+        count, written = stream_update(args.input, output_file)
+        print(f'✅ HTMLファイルを修正しました（ストリーミング, Database定義 {count} 件）')
+        print(f'   ファイルサイズ: {written} バイト')
+    else:
+        # 元のHTMLファイルを読み込み
+        with open(args.input, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        content_modified = update_html(content)
+
+        # 修正したHTMLを保存
+        with atomic_output(output_file, 'w', encoding='utf-8') as f:
+            f.write(content_modified)
+
+        print('✅ HTMLファイルを修正しました')
+        print(f'   ファイルサイズ: {len(content_modified)} バイト')
+
+    if not args.no_snapshot:
+        saved = snapshot(output_file, 'update_html')
+        if saved:
+            print(f'📦 スナップショット: {saved}')
+    if cache is not None:
+        cache.record(digest, file_hash(output_file))
+        cache.save()
+
+
+if __name__ == '__main__':
+    main()